@@ -1,11 +1,14 @@
 from decimal import Decimal
 
 from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import post_delete, post_save
 from django.utils.safestring import mark_safe
 from django.utils.translation import get_language
 from l10n.l10n_settings import get_l10n_setting
+import keyedcache
 import logging
 import re
+import time
 
 # Create a regex to strip out the decimal places with currency formatting
 # Example string = u"$%(val)0.2f" so this regex should let us get the 0.2f portion
@@ -20,68 +23,156 @@ decimal_separator = re.compile(r'(\d)\.(\d)')
 
 UNSET = object()
 
-def lookup_translation(obj, attr, language_code=None, version=-1):
-    """Get a translated attribute by language.
+# the translation models whose translations are kept in the shared cache
+_shared_models = set()
 
-    If specific language isn't found, returns the attribute from the base object.
+# how many objects have their translations loaded in one query
+PREFETCH_BATCH_SIZE = 500
+
+def _short_code(language_code):
+    pos = language_code.find('_')
+    if pos == -1:
+        pos = language_code.find('-')
+    if pos > -1:
+        return language_code[:pos]
+    return language_code
+
+def _translation_field(model):
+    """Get the translation model of `model`, and its foreign key to it."""
+    related = model.translations.related
+    return related.model, related.field
+
+def _model_label(model):
+    return '%s.%s' % (model._meta.app_label, model._meta.object_name.lower())
+
+def _generation(trans_model):
+    label = _model_label(trans_model)
+    try:
+        return keyedcache.cache_get('l10n', 'translation', label, 'version')
+    except keyedcache.NotCachedError:
+        if not keyedcache.cache_enabled():
+            return None
+        # start from the clock, so that an evicted version is never reused
+        generation = int(time.time() * 1000)
+        keyedcache.cache_set('l10n', 'translation', label, 'version', value=generation)
+        return generation
+
+def _invalidate_translations(sender, **kwargs):
+    label = _model_label(sender)
+    try:
+        generation = keyedcache.cache_get('l10n', 'translation', label, 'version')
+    except keyedcache.NotCachedError:
+        generation = 0
+    keyedcache.cache_set('l10n', 'translation', label, 'version',
+        value=max(generation + 1, int(time.time() * 1000)))
+
+def listen_for_translation_changes(*models):
+    """Keep the translations of `models`, translation models such as
+    `ProductTranslation`, in the shared cache, and drop them from it when
+    one of them is saved or deleted."""
+    for model in models:
+        uid = 'l10n.translation.%s' % _model_label(model)
+        post_save.connect(_invalidate_translations, sender=model, weak=False, dispatch_uid=uid)
+        post_delete.connect(_invalidate_translations, sender=model, weak=False, dispatch_uid=uid)
+        _shared_models.add(model)
+
+def choose_translation(translations, language_code, version=-1):
+    """Choose the translation for `language_code` among `translations`, the
+    translations of one object in their default order.
+
+    The translations in the language are used, else the ones in its short
+    language, else the ones whose language starts with it. Of these, the
+    requested version is used if it is there, else the most recent one.
     """
+    code = language_code.lower()
+    found = [t for t in translations if t.languagecode.lower() == code]
+    if not found:
+        short_code = _short_code(code)
+        if short_code != code:
+            return choose_translation(translations, short_code, version)
+        found = [t for t in translations if t.languagecode.lower().startswith(code)]
+        if not found:
+            return None
+
+    found.sort(key=lambda t: -t.version)
+    if version == -1:
+        return found[0]
+    for t in found:
+        if t.version == version:
+            return t
+    return found[0]
+
+def _shared_key(pk, trans_model, language_code, version, generation):
+    return ('l10n', 'translation', _model_label(trans_model), pk, language_code, version, generation)
+
+def prefetch_translations(objs, language_code=None, version=-1):
+    """Load the translations of `objs` for `lookup_translation`, with one
+    query per model for the ones which aren't cached, instead of a few
+    queries per object."""
     if not language_code:
         language_code = get_language()
 
+    by_model = {}
+    for obj in objs:
+        if obj.pk is None:
+            continue
+        if language_code in obj.__dict__.get('_translationcache', {}):
+            continue
+        by_model.setdefault(obj.__class__, {}).setdefault(obj.pk, []).append(obj)
+
+    for model, objects in by_model.items():
+        trans_model, field = _translation_field(model)
+        shared = trans_model in _shared_models
+        generation = shared and _generation(trans_model) or None
+
+        missing = []
+        for pk, same in objects.items():
+            if shared:
+                try:
+                    trans = keyedcache.cache_get(*_shared_key(pk, trans_model, language_code, version, generation))
+                    for obj in same:
+                        _set_translation(obj, language_code, trans)
+                    continue
+                except keyedcache.NotCachedError:
+                    pass
+            missing.append(pk)
+
+        translations = {}
+        for ix in range(0, len(missing), PREFETCH_BATCH_SIZE):
+            qry = trans_model._default_manager.filter(**{
+                '%s__in' % field.name: missing[ix:ix+PREFETCH_BATCH_SIZE],
+                'languagecode__istartswith': _short_code(language_code)})
+            for trans in qry:
+                translations.setdefault(getattr(trans, field.attname), []).append(trans)
+
+        for pk in missing:
+            trans = choose_translation(translations.get(pk, []), language_code, version)
+            for obj in objects[pk]:
+                _set_translation(obj, language_code, trans)
+            if shared:
+                keyedcache.cache_set(*_shared_key(pk, trans_model, language_code, version, generation), value=trans)
+
+def _set_translation(obj, language_code, trans):
     if not hasattr(obj, '_translationcache'):
         obj._translationcache = {}
+    obj._translationcache[language_code] = trans
 
-    short_code = language_code
-    pos = language_code.find('_')
-    if pos > -1:
-        short_code = language_code[:pos]
+def get_translation(obj, language_code=None, version=-1):
+    """Get the translation of `obj` by language, or None."""
+    if not language_code:
+        language_code = get_language()
+    if obj.pk is None:
+        return None
+    if language_code not in obj.__dict__.get('_translationcache', {}):
+        prefetch_translations([obj], language_code, version)
+    return obj._translationcache[language_code]
 
-    else:
-        pos = language_code.find('-')
-        if pos > -1:
-            short_code = language_code[:pos]
-
-    trans = None
-    has_key = obj._translationcache.has_key(language_code)
-    if has_key:
-        if obj._translationcache[language_code] == None and short_code != language_code:
-            return lookup_translation(obj, attr, short_code)
-
-    if not has_key:
-        q = obj.translations.filter(
-            languagecode__iexact = language_code)
-
-        if q.count() == 0:
-            obj._translationcache[language_code] = None
-
-            if short_code != language_code:
-                return lookup_translation(obj, attr, language_code=short_code, version=version)
-
-            else:
-                q = obj.translations.filter(
-                    languagecode__istartswith = language_code)
-
-        if q.count() > 0:
-            trans = None
-            if version > -1:
-                trans = q.order_by('-version')[0]
-            else:
-                # try to get the requested version, if it is available,
-                # else fallback to the most recent version
-                fallback = None
-                for t in q.order_by('-version'):
-                    if not fallback:
-                        fallback = t
-                    if t.version == version:
-                        trans = t
-                        break
-                if not trans:
-                    trans = fallback
-
-            obj._translationcache[language_code] = trans
+def lookup_translation(obj, attr, language_code=None, version=-1):
+    """Get a translated attribute by language.
 
-    if not trans:
-        trans = obj._translationcache[language_code]
+    If specific language isn't found, returns the attribute from the base object.
+    """
+    trans = get_translation(obj, language_code, version)
 
     if not trans:
         trans = obj
@@ -19,8 +19,9 @@ from satchmo_store.shop.signals import satchmo_shipping_price_query
 from satchmo_utils.dynamic import lookup_template
 from satchmo_utils.views import CreditCard
 from shipping.config import shipping_methods, shipping_method_by_key
+from shipping.quoting import calculate_methods
 from shipping.signals import shipping_choices_query
-from shipping.utils import update_shipping
+from shipping.utils import ShippingCosts, update_shipping
 from signals_ahoy.signals import form_init, form_initialdata, form_presave, form_postsave, form_validate
 from tax.templatetags.satchmo_tax import _get_taxprocessor
 from threaded_multihost import threadlocals
@@ -49,11 +50,11 @@ def _get_cheapest_shipping(shipping_dict):
 def _get_shipping_choices(request, paymentmodule, cart, contact, default_view_tax=False, order=None):
     """Iterate through legal shipping modules, building the list for display to the user.
 
-    Returns the shipping choices list, along with a dictionary of shipping choices, useful
-    for building javascript that operates on shipping choices.
+    Returns the shipping choices list, along with a `ShippingCosts` dictionary of shipping
+    choices, useful for building javascript that operates on shipping choices.
     """
     shipping_options = []
-    shipping_dict = {}
+    shipping_dict = ShippingCosts()
     rendered = {}
     if not order:
         try:
@@ -80,58 +81,61 @@ def _get_shipping_choices(request, paymentmodule, cart, contact, default_view_ta
         taxer = _get_taxprocessor(request)
         shipping_tax = TaxClass.objects.get(title=config_value('TAX', 'TAX_CLASS'))
 
-    for method in methods:
-        method.calculate(cart, contact)
-        if method.valid():
-            template = lookup_template(paymentmodule, 'shipping/options.html')
-            t = loader.get_template(template)
-            shipcost = finalcost = method.cost()
-
-            if discount and order:
-                order.shipping_cost = shipcost
-                discount.calc(order)
-                shipdiscount = discount.item_discounts.get('Shipping', 0)
-            else:
-                shipdiscount = 0
-
-            # set up query to determine shipping price to show
-            shipprice = Price()
-            shipprice.price = shipcost
-            shipadjust = PriceAdjustmentCalc(shipprice)
-            if shipdiscount:
-                shipadjust += PriceAdjustment('discount', _('Discount'), shipdiscount)
-
-            satchmo_shipping_price_query.send(cart, adjustment=shipadjust)
-            shipdiscount = shipadjust.total_adjustment()
-
-            if shipdiscount:
-                finalcost -= shipdiscount
-
-            shipping_dict[method.id] = {'cost' : shipcost, 'discount' : shipdiscount, 'final' : finalcost}
-
-            taxed_shipping_price = None
-            if tax_shipping:
-                taxcost = taxer.by_price(shipping_tax, finalcost)
-                total = finalcost + taxcost
-                taxed_shipping_price = moneyfmt(total)
-                shipping_dict[method.id]['taxedcost'] = total
-                shipping_dict[method.id]['tax'] = taxcost
-
-            c = RequestContext(request, {
-                'amount': finalcost,
-                'description' : method.description(),
-                'method' : method.method(),
-                'expected_delivery' : method.expectedDelivery(),
-                'default_view_tax' : default_view_tax,
-                'shipping_tax': shipping_tax,
-                'taxed_shipping_price': taxed_shipping_price})
-            rendered[method.id] = t.render(c)
+    valid = [method for method in calculate_methods(methods, cart, contact) if method.valid()]
+    costs = dict([(method.id, method.cost()) for method in valid])
 
-    #now sort by price, low to high
-    sortme = [(value['cost'], key) for key, value in shipping_dict.items()]
-    sortme.sort()
+    # the order is discounted once for all the methods
+    if discount and order:
+        shipdiscounts = discount.calc_shipping(order, costs)
+    else:
+        shipdiscounts = {}
+
+    # the options are rendered by the same template and context
+    template = lookup_template(paymentmodule, 'shipping/options.html')
+    t = loader.get_template(template)
+    c = RequestContext(request, {
+        'default_view_tax' : default_view_tax,
+        'shipping_tax': shipping_tax})
+
+    for method in valid:
+        shipcost = finalcost = costs[method.id]
+        shipdiscount = shipdiscounts.get(method.id, 0)
+
+        # set up query to determine shipping price to show
+        shipprice = Price()
+        shipprice.price = shipcost
+        shipadjust = PriceAdjustmentCalc(shipprice)
+        if shipdiscount:
+            shipadjust += PriceAdjustment('discount', _('Discount'), shipdiscount)
+
+        satchmo_shipping_price_query.send(cart, adjustment=shipadjust)
+        shipdiscount = shipadjust.total_adjustment()
+
+        if shipdiscount:
+            finalcost -= shipdiscount
+
+        entry = shipping_dict.add(method, shipcost, shipdiscount, finalcost)
+
+        taxed_shipping_price = None
+        if tax_shipping:
+            taxcost = taxer.by_price(shipping_tax, finalcost)
+            total = finalcost + taxcost
+            taxed_shipping_price = moneyfmt(total)
+            entry['taxedcost'] = total
+            entry['tax'] = taxcost
+
+        labels = shipping_dict.labels[method.id]
+        c.update({
+            'amount': finalcost,
+            'description' : labels['description'],
+            'method' : labels['method'],
+            'expected_delivery' : labels['expected_delivery'],
+            'taxed_shipping_price': taxed_shipping_price})
+        rendered[method.id] = t.render(c)
+        c.pop()
 
-    shipping_options = [(key, rendered[key]) for cost, key in sortme]
+    #now sort by price, low to high
+    shipping_options = [(key, rendered[key]) for key in shipping_dict.sorted_keys()]
 
     shipping_choices_query.send(sender=cart, cart=cart,
         paymentmodule=paymentmodule, contact=contact,
@@ -330,7 +334,7 @@ class SimplePayShipForm(forms.Form):
                 if discount and discount.shipping == "FREECHEAP":
                     if cheapshipping:
                         shipping_choices = [opt for opt in shipping_choices if opt[0] == cheapshipping]
-                        shipping_dict = {cheapshipping: shipping_dict[cheapshipping]}
+                        shipping_dict = shipping_dict.only([cheapshipping])
             except Discount.DoesNotExist:
                 pass
         
@@ -66,4 +66,11 @@ config_register_list(
         help_text=_("If yes, then a Photo Not Available Image will be shown on the category page."),
         default=False
     ),
+
+    BooleanValue(PRODUCT_GROUP,
+        'DEFERRED_PRICE_LOOKUP',
+        description=_("Defer price lookup updates?"),
+        help_text=_("If yes, product, price and stock changes only mark the price lookup table as stale, and the satchmo_refresh_pricing command or the hourly job updates it."),
+        default=False
+    ),
 )
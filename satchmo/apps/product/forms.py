@@ -484,6 +484,10 @@ class VariationManagerForm(forms.Form):
         #dirty is a comma delimited list of groupid__optionid strings
         dirty = self.cleaned_data['dirty'].split(',')
         if dirty:
+            from product.modules.configurable.bulk import VariationGenerator
+
+            # the variations are created together once the others are deleted
+            generator = VariationGenerator(self.product.configurableproduct)
             for key in dirty:
                 # this is the keep/create checkbox field
                 try:
@@ -491,15 +495,19 @@ class VariationManagerForm(forms.Form):
                     opts = _get_options_for_key(key, optiondict)
                     if opts:
                         if keep:
-                            self._create_variation(opts, key, data, request)
+                            self._create_variation(opts, key, data, generator)
                         else:
                             self._delete_variation(opts, request)
                 except KeyError:
                     pass
 
+            for v in generator.generate():
+                log.info('Updated variation %s', v)
+                messages.add_message(request, messages.INFO, 'Created %s' % v)
+
     save = transaction.commit_on_success(_save)
 
-    def _create_variation(self, opts, key, data, request):
+    def _create_variation(self, opts, key, data, generator):
         namekey = "name__" + key
         nameval = data[namekey]
         skukey = "sku__" + key
@@ -507,14 +515,11 @@ class VariationManagerForm(forms.Form):
         slugkey = "slug__" + key
         slugval = data[slugkey]
         log.debug("Got name=%s, sku=%s, slug=%s", nameval, skuval, slugval)
-        v = self.product.configurableproduct.create_variation(
+        generator.add(
             opts,
             name=nameval,
             sku=skuval,
             slug=slugval)
-        log.info('Updated variation %s', v)
-        messages.add_message(request, messages.INFO, 'Created %s' % v)
-        return v
 
     def _delete_variation(self, opts, request):
         variation = self.product.configurableproduct.get_product_from_options(opts)
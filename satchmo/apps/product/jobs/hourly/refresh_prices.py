@@ -0,0 +1,10 @@
+from django.contrib.sites.models import Site
+from django_extensions.management.jobs import HourlyJob
+from product.models import ProductPriceLookup
+
+class Job(HourlyJob):
+    help = "Update the pricing lookup rows of changed products."
+
+    def execute(self):
+        for site in Site.objects.all():
+            ProductPriceLookup.objects.refresh_stale(site=site)
@@ -1,8 +1,15 @@
 from decimal import Decimal, InvalidOperation
 from django.contrib.sites.models import Site
 from django.db.models import Q
+from django.db.models.signals import class_prepared, m2m_changed, post_delete, post_save
+from l10n.utils import listen_for_translation_changes
 from livesettings import config_value
-from product.models import Product, Category, Discount
+from product.models import Product, Category, CategoryTranslation, Discount, Price, ProductPriceLookup
+from product.models import (CategoryImageTranslation, OptionGroupTranslation, OptionTranslation,
+    ProductImageTranslation, ProductTranslation)
+from product.navigation import invalidate_category_tree
+from product.utils import invalidate_auto_discounts
+import keyedcache
 import logging
 
 log = logging.getLogger('search listener')
@@ -54,14 +61,13 @@ def default_product_search_listener(sender, request=None, category=None, keyword
         'products': products
         })
 
-def priceband_search_listener(sender, request=None, category=None, keywords=[], results={}, **kwargs):
-    """Filter search results by price bands.
+def get_priceband(request):
+    """Get the (low, high) price band requested by a search, or None.
 
     If a "priceband" parameter is available, it will be parsed as follows:
         lowval-highval
         if there is no "-", then it will be parsed as lowval or higher
     """
-    log.debug('priceband search listener')
     if request.method=="GET":
         data = request.GET
     else:
@@ -70,19 +76,27 @@ def priceband_search_listener(sender, request=None, category=None, keywords=[],
     priceband = data.get('priceband', None)
 
     if not priceband:
-        return
+        return None
 
     bands = priceband.split('-')
     try:
+        low = Decimal(bands[0])
         if len(bands) > 1:
-            low = int(bands[0])
-            high = int(bands[1])
+            high = Decimal(bands[1])
         else:
-            low = bands[0]
             high = Decimal('1000000000.00')
-    except (TypeError, InvalidOperation):
+    except (TypeError, ValueError, InvalidOperation):
         log.warn("Couldn't parse priceband=%s", priceband)
+        return None
+    return low, high
+
+def priceband_search_listener(sender, request=None, category=None, keywords=[], results={}, **kwargs):
+    """Filter search results by price bands, see `get_priceband`."""
+    log.debug('priceband search listener')
+    band = get_priceband(request)
+    if not band:
         return
+    low, high = band
 
     priced = []
     products = results['products']
@@ -113,3 +127,82 @@ def discount_used_listener(sender, order=None, **kwargs):
             discount.save()
         except Discount.DoesNotExist:
             pass
+
+def update_lookup_on_product_save(sender, instance=None, raw=False, **kwargs):
+    """Keep the price lookup rows in sync with a saved product, which also
+    covers stock level changes."""
+    if not raw:
+        ProductPriceLookup.objects.product_changed(instance)
+
+def update_lookup_on_price_change(sender, instance=None, raw=False, **kwargs):
+    """Keep the price lookup rows in sync when a price is saved or deleted."""
+    if raw:
+        return
+    try:
+        product = Product.objects.get(pk=instance.product_id)
+    except Product.DoesNotExist:
+        # the product is being deleted as well
+        return
+    ProductPriceLookup.objects.product_changed(product)
+
+def remove_lookup_on_product_delete(sender, instance=None, **kwargs):
+    """Delete the price lookup rows of a deleted product and of its variations."""
+    ProductPriceLookup.objects.filter(siteid=instance.site_id, productslug=instance.slug).delete()
+    ProductPriceLookup.objects.filter(siteid=instance.site_id, parentid=instance.id).delete()
+
+def clear_subtypes_on_change(sender, instance=None, created=False, **kwargs):
+    """Forget the cached subtypes of a product when one of its subtype
+    objects is saved or deleted, or when a product is created."""
+    if hasattr(sender, '_get_subtype'):
+        keyedcache.cache_delete('product', 'subtypes', instance.product_id)
+    elif sender is Product and created:
+        keyedcache.cache_delete('product', 'subtypes', instance.pk)
+
+def listen_for_subtype_changes(sender, **kwargs):
+    """Connect `clear_subtypes_on_change` to the product subtype models, as
+    they are loaded after the products."""
+    if hasattr(sender, '_get_subtype'):
+        post_save.connect(clear_subtypes_on_change, sender=sender)
+        post_delete.connect(clear_subtypes_on_change, sender=sender)
+
+def update_path_on_category_load(sender, instance=None, raw=False, **kwargs):
+    """Categories loaded from fixtures don't go through `Category.save`, so
+    maintain their materialized path here."""
+    if raw:
+        instance._update_path()
+
+def invalidate_tree_on_change(sender, instance=None, **kwargs):
+    """Rebuild the navigation tree of the site when one of its categories or
+    their translations changes."""
+    if isinstance(instance, CategoryTranslation):
+        try:
+            instance = instance.category
+        except Category.DoesNotExist:
+            # deleted along with its category
+            return
+    invalidate_category_tree(instance.site_id)
+
+def invalidate_discounts_on_change(sender, instance=None, **kwargs):
+    """Rebuild the automatic discount index when a discount, the products
+    it is valid for, or the products of a category change."""
+    if not isinstance(instance, Discount) or instance.automatic:
+        invalidate_auto_discounts()
+
+def start_default_listening():
+    post_save.connect(clear_subtypes_on_change, sender=Product)
+    class_prepared.connect(listen_for_subtype_changes)
+    post_save.connect(update_path_on_category_load, sender=Category)
+    for sender in (Category, CategoryTranslation):
+        post_save.connect(invalidate_tree_on_change, sender=sender)
+        post_delete.connect(invalidate_tree_on_change, sender=sender)
+    post_save.connect(invalidate_discounts_on_change, sender=Discount)
+    post_delete.connect(invalidate_discounts_on_change, sender=Discount)
+    for through in (Discount.valid_products.through, Discount.valid_categories.through, Product.category.through):
+        m2m_changed.connect(invalidate_discounts_on_change, sender=through)
+    post_save.connect(update_lookup_on_product_save, sender=Product)
+    post_delete.connect(remove_lookup_on_product_delete, sender=Product)
+    post_save.connect(update_lookup_on_price_change, sender=Price)
+    post_delete.connect(update_lookup_on_price_change, sender=Price)
+    listen_for_translation_changes(CategoryTranslation, CategoryImageTranslation, OptionGroupTranslation,
+        OptionTranslation, ProductTranslation, ProductImageTranslation)
+    log.debug('Added product listeners')
@@ -1,6 +1,7 @@
 from django.contrib.sites.models import Site
 from django.core.management.base import BaseCommand
-from product.models import Product, ProductPriceLookup
+from product.models import ProductPriceLookup
+import time
 
 class Command(BaseCommand):
     help = "Builds Satcho Product pricing lookup tables."
@@ -13,7 +14,7 @@ class Command(BaseCommand):
         if len(sitenames) == 0:
             if verbosity>0:
                 print "Rebuilding pricing for all products for all sites"
-                sites = Site.objects.all()
+            sites = Site.objects.all()
         else:
             sites = []
             for sitename in sitenames:
@@ -24,35 +25,19 @@ class Command(BaseCommand):
 
         total = 0
         for site in sites:
-            ct = 0
             if verbosity > 0:
                 print "Starting product pricing for %s" % site.domain
 
-            if verbosity > 1:
-                print "Deleting old pricing"
+            start = time.time()
+            productct, ct = ProductPriceLookup.objects.bulk_rebuild(site=site)
+            elapsed = time.time() - start
 
-            for lookup in ProductPriceLookup.objects.filter(siteid=site.id):
-                lookup.delete()
-
-            products = Product.objects.active_by_site(site=site, variations=False)
             if verbosity > 0:
-                print "Adding %i products" % products.count()
-
-            for product in products:
-                if verbosity > 1:
-                    print "Processing product: %s" % product.slug
-
-                prices = ProductPriceLookup.objects.smart_create_for_product(product)
-                if verbosity > 1:
-                    print "Created %i prices" % len(prices)
-
-                ct += len(prices)
-
-            if verbosity > 0:
-                print "Added %i total prices for site" % ct
+                print "Added %i total prices for %i products" % (ct, productct)
+            if verbosity > 1 and elapsed > 0:
+                print "Built in %.2f seconds (%.0f rows/sec)" % (elapsed, ct / elapsed)
 
             total += ct
 
         if verbosity > 0:
             print "Added %i total prices" % total
-
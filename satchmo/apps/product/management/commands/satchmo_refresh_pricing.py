@@ -0,0 +1,26 @@
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand
+from product.models import ProductPriceLookup
+
+class Command(BaseCommand):
+    help = "Rebuilds the Satchmo Product pricing lookup rows of products changed since the last refresh."
+    args = ['sitename...']
+
+    requires_model_validation = True
+
+    def handle(self, *sitenames, **options):
+        verbosity = int(options.get('verbosity', 1))
+        if len(sitenames) == 0:
+            sites = Site.objects.all()
+        else:
+            sites = []
+            for sitename in sitenames:
+                try:
+                    sites.append(Site.objects.get(domain__iexact=sitename))
+                except Site.DoesNotExist:
+                    print "Warning: Could not find site '%s'" % sitename
+
+        for site in sites:
+            productct, ct = ProductPriceLookup.objects.refresh_stale(site=site)
+            if verbosity > 0:
+                print "Refreshed %i prices for %i products on %s" % (ct, productct, site.domain)
@@ -8,8 +8,7 @@ from django import forms
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core import urlresolvers
-from django.core.cache import cache
-from django.db import models
+from django.db import connection, models, transaction
 from django.db.models import Q
 from django.utils.encoding import smart_str
 from django.utils.translation import get_language, ugettext, ugettext_lazy as _
@@ -17,7 +16,7 @@ from l10n.utils import moneyfmt, lookup_translation
 from livesettings import config_value, SettingNotSet, config_value_safe
 from prices import get_product_quantity_price, get_product_quantity_adjustments
 from product import active_product_types
-from product.prices import PriceAdjustmentCalc
+from product.prices import PriceAdjustmentCalc, get_cached_price
 from satchmo_utils import get_flat_list
 from satchmo_utils.fields import CurrencyField
 from satchmo_utils.thumbnail.field import ImageWithThumbnailField
@@ -28,6 +27,7 @@ import keyedcache
 import logging
 import operator
 import signals
+import time
 
 log = logging.getLogger('product.models')
 
@@ -62,6 +62,20 @@ def default_weight_unit():
     else:
         return 'lb'
 
+def get_subtype_models():
+    """Get a list of the active product subtypes, in the form of
+    [(subtype name, subtype model),...]
+    """
+    subtypes = []
+    try:
+        for module, subtype in active_product_types():
+            model = models.get_model(module.split('.')[-1], subtype)
+            if model is not None:
+                subtypes.append((subtype, model))
+    except SettingNotSet:
+        log.warn("Error getting subtypes, OK if in SyncDB")
+    return subtypes
+
 class CategoryManager(models.Manager):
     def active(self, **kwargs):
         return self.filter(is_active=True, **kwargs)
@@ -130,6 +144,8 @@ class Category(models.Model):
     is_active = models.BooleanField(_("Active"), default=True, blank=True)
     related_categories = models.ManyToManyField('self', blank=True, null=True,
         verbose_name=_('Related Categories'), related_name='related_categories')
+    path = models.CharField(_("Path"), max_length=255, blank=True, db_index=True, editable=False,
+        help_text=_("Ids of the parents and of the category itself, maintained on save"))
     objects = CategoryManager()
 
     def _get_mainImage(self):
@@ -158,8 +174,10 @@ class Category(models.Model):
         if not include_children:
             qry = self.product_set.all()
         else:
+            # the subtree is read with one query through the materialized
+            # path, leaving out the inactive categories and what is below them
             cats = self.get_all_children(include_self=True)
-            qry = Product.objects.filter(category__in=cats)
+            qry = Product.objects.filter(category__in=[cat.id for cat in cats])
 
         if variations:
             slugs = qry.filter(site=self.site, active=True, **kwargs).values_list('slug',flat=True)
@@ -193,11 +211,63 @@ class Category(models.Model):
             p_list.reverse()
         return p_list
 
+    def _path_ids(self):
+        """Get the ids in the materialized path, if it matches the current parent."""
+        if not self.path:
+            return None
+        ids = [int(pk) for pk in self.path.split('/') if pk]
+        if len(ids) > 1:
+            if ids[-2] != self.parent_id:
+                return None
+        elif self.parent_id:
+            return None
+        return ids
+
     def parents(self):
-        return self._recurse_for_parents(self)
+        """Get the parent categories, from the root down, with a single query."""
+        if not hasattr(self, '_parents_cache'):
+            ids = self._path_ids()
+            if ids is None:
+                parents = self._recurse_for_parents(self)
+            else:
+                cats = Category.objects.in_bulk(ids[:-1])
+                parents = [cats[pk] for pk in ids[:-1] if pk in cats]
+            self._parents_cache = parents
+        return self._parents_cache
+
+    def _update_path(self):
+        """Store the materialized path of the category, and update the paths
+        of its descendants if it changed."""
+        path = ''
+        if self.parent_id:
+            parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True)
+            if parent_path and parent_path[0]:
+                path = '%s%i/' % (parent_path[0], self.pk)
+        else:
+            path = '%i/' % self.pk
+
+        if path != self.path:
+            old_path = self.path
+            self.path = path
+            Category.objects.filter(pk=self.pk).update(path=path)
+            if old_path and path:
+                # replace the prefix of the whole subtree in one query
+                qn = connection.ops.quote_name
+                column = qn('path')
+                if 'mysql' in connection.settings_dict['ENGINE']:
+                    value = 'CONCAT(%%s, SUBSTR(%s, %%s))' % column
+                else:
+                    value = '%%s || SUBSTR(%s, %%s)' % column
+                sql = 'UPDATE %s SET %s = %s WHERE %s LIKE %%s AND %s <> %%s' % (
+                    qn(Category._meta.db_table), column, value, column, qn('id'))
+                connection.cursor().execute(sql, [path, len(old_path) + 1, old_path + '%', self.pk])
+                transaction.commit_unless_managed()
+            else:
+                for child in Category.objects.filter(parent=self):
+                    child._update_path()
 
     def get_absolute_url(self):
-        parents = self._recurse_for_parents(self)
+        parents = self.parents()
         slug_list = [cat.slug for cat in parents]
         if slug_list:
             slug_list = "/".join(slug_list) + "/"
@@ -210,7 +280,7 @@ class Category(models.Model):
         return ' :: '
 
     def _parents_repr(self):
-        name_list = [cat.name for cat in self._recurse_for_parents(self)]
+        name_list = [cat.name for cat in self.parents()]
         return self.get_separator().join(name_list)
     _parents_repr.short_description = "Category parents"
 
@@ -218,7 +288,10 @@ class Category(models.Model):
         # Get all the absolute URLs and names for use in the site navigation.
         name_list = []
         url_list = []
-        for cat in self._recurse_for_parents(self):
+        parents = self.parents()
+        for ix, cat in enumerate(parents):
+            # the parents of each parent are already known
+            cat._parents_cache = parents[:ix]
             name_list.append(cat.translated_name())
             url_list.append(cat.get_absolute_url())
         name_list.append(self.translated_name())
@@ -226,24 +299,25 @@ class Category(models.Model):
         return zip(name_list, url_list)
 
     def __unicode__(self):
-        name_list = [cat.name for cat in self._recurse_for_parents(self)]
+        name_list = [cat.name for cat in self.parents()]
         name_list.append(self.name)
         return self.get_separator().join(name_list)
 
     def save(self, **kwargs):
-        if self.id:
-            if self.parent and self.parent_id == self.id:
+        if hasattr(self, '_parents_cache'):
+            del self._parents_cache
+        if self.id and self.parent_id:
+            if self.parent_id == self.id:
                 raise forms.ValidationError(_("You must not save a category in itself!"))
 
-            for p in self._recurse_for_parents(self):
+            for p in self.parent.parents():
                 if self.id == p.id:
                     raise forms.ValidationError(_("You must not save a category in itself!"))
 
         if not self.slug:
             self.slug = slugify(self.name, instance=self)
-        cache_key = "cat-%s" % self.site.id
-        cache.delete(cache_key)
         super(Category, self).save(**kwargs)
+        self._update_path()
 
     def _flatten(self, L):
         """
@@ -269,10 +343,38 @@ class Category(models.Model):
         """
         return self.get_all_children(only_active=True, include_self=include_self)
 
+    def _descendants(self, only_active=False):
+        """Get the active descendants in depth-first order, loading the whole
+        subtree with one query on the materialized path."""
+        children = {}
+        for cat in Category.objects.filter(path__startswith=self.path).exclude(pk=self.pk).order_by('ordering', 'name'):
+            children.setdefault(cat.parent_id, []).append(cat)
+
+        if only_active:
+            ids = [cat.id for cats in children.values() for cat in cats]
+            with_products = set(Product.category.through.objects.filter(category__in=ids,
+                product__site=self.site, product__active=True,
+                product__productvariation__parent__isnull=True).values_list('category', flat=True))
+
+        flat_list = []
+        def walk(parent_id):
+            for cat in children.get(parent_id, []):
+                if cat.is_active and ((not only_active) or cat.id in with_products):
+                    flat_list.append(cat)
+                    walk(cat.id)
+        walk(self.pk)
+        return flat_list
+
     def get_all_children(self, only_active=False, include_self=False):
         """
         Gets a list of all of the children categories.
         """
+        if self._path_ids() is not None:
+            flat_list = self._descendants(only_active=only_active)
+            if include_self:
+                flat_list.insert(0, self)
+            return flat_list
+
         children_list = self._recurse_for_children(self, only_active=only_active)
         if include_self:
             ix = 0
@@ -384,9 +486,12 @@ class NullDiscount(object):
         self.discounted_prices = []
         self.automatic = False
 
-    def calc(self, *args):
+    def calc(self, *args, **kwargs):
         return Decimal("0.00")
 
+    def calc_shipping(self, order, costs, items=None):
+        return dict([(key, Decimal("0.00")) for key in costs])
+
     def is_valid(self):
         return False
 
@@ -524,16 +629,40 @@ class Discount(models.Model):
             Q(productslug__in=validslugs) | Q(productslug__in=slugs_from_cat)
             ).values_list('productslug', flat=True)
 
-    def calc(self, order):
-        # Use the order details and the discount specifics to calculate the actual discount
+    def calc(self, order, items=None, save=True):
+        """Use the order details and the discount specifics to calculate the actual discount.
+
+        `items` may hold the already loaded order items, and `save=False`
+        keeps the discount from being written when its shipping default
+        gets filled in.
+        """
+        discounted = self._discountable(order, items=items, save=save)
+        self._item_discounts = self._apply(discounted, order.shipping_cost)
+        self._calculated = True
+
+    def calc_shipping(self, order, costs, items=None):
+        """Get the discount on each of the shipping costs in `costs`, a
+        dictionary of {key: cost}, as `calc` would with the cost as the
+        shipping cost of the order. The order items are only walked once.
+        """
+        discounted = self._discountable(order, items=items, save=False)
+        shipping = {}
+        for key, cost in costs.items():
+            shipping[key] = self._apply(discounted, cost).get('Shipping', Decimal("0.00"))
+        return shipping
+
+    def _discountable(self, order, items=None, save=True):
+        """Get the prices of the order items this discount applies to."""
         discounted = {}
+        if items is None:
+            items = order.orderitem_set.all()
         if self.allValid:
             allvalid = True
         else:
             allvalid = False
             validproducts = self._valid_products(order.orderitem_set)
 
-        for lineitem in order.orderitem_set.all():
+        for lineitem in items:
             lid = lineitem.id
             price = lineitem.line_item_price
             if lineitem.product.is_discountable and (allvalid or lineitem.product.slug in validproducts):
@@ -546,10 +675,14 @@ class Discount(models.Model):
 
         if not self.shipping:
             self.shipping = "NONE"
-            self.save()
+            if save:
+                self.save()
+        return discounted
 
+    def _apply(self, discounted, shipcost):
+        """Get the discounts on the `discounted` prices and on `shipcost`."""
+        discounted = discounted.copy()
         if self.shipping == "APPLY":
-            shipcost = order.shipping_cost
             discounted['Shipping'] = shipcost
 
         if self.amount:
@@ -567,11 +700,8 @@ class Discount(models.Model):
                 discounted[key] = zero
 
         if self.shipping in ('FREE', 'FREECHEAP'):
-            shipcost = order.shipping_cost
             discounted['Shipping'] = shipcost
-
-        self._item_discounts = discounted
-        self._calculated = True
+        return discounted
 
     def save(self, **kwargs):
         if self.automatic:
@@ -599,6 +729,12 @@ class Discount(models.Model):
 
     def valid_for_product(self, product):
         """Tests if discount is valid for a single product"""
+        if self.automatic and self.id:
+            from product.utils import get_auto_discount_index
+            index = get_auto_discount_index()
+            if self.id in index.rank:
+                return index.valid_for_product(self, product)
+
         if not product.is_discountable:
             return False
         elif self.allValid:
@@ -821,6 +957,37 @@ class ProductManager(models.Manager):
         query = query.order_by('-date_added', '-id')
         return query
 
+    def prefetch_subtypes(self, products):
+        """Resolve the subtypes of a list of products at once, so that
+        `Product.get_subtypes` doesn't query for each of them.
+
+        Subtypes come from the cache where possible, and the rest are loaded
+        with one query per product module. Returns the products.
+        """
+        missing = {}
+        for product in products:
+            if hasattr(product, '_sub_types') or not product.pk:
+                continue
+            try:
+                product._sub_types = keyedcache.cache_get('product', 'subtypes', product.pk)
+            except keyedcache.NotCachedError:
+                product._sub_types = ()
+                missing.setdefault(product.pk, []).append(product)
+
+        if missing:
+            ids = missing.keys()
+            for subtype, model in get_subtype_models():
+                for ix in range(0, len(ids), PRICE_LOOKUP_BATCH_SIZE):
+                    qry = model.objects.filter(product__in=ids[ix:ix+PRICE_LOOKUP_BATCH_SIZE])
+                    for pk in qry.values_list('product', flat=True):
+                        for product in missing[pk]:
+                            product._sub_types += (subtype,)
+
+            for pk, found in missing.items():
+                keyedcache.cache_set('product', 'subtypes', pk, value=found[0]._sub_types)
+
+        return products
+
 
 class Product(models.Model):
     """
@@ -923,6 +1090,10 @@ class Product(models.Model):
         returns price as a Decimal
         """
 
+        cached = get_cached_price(self)
+        if cached is not None:
+            return cached.price
+
         subtype = self.get_subtype_with_attr('unit_price')
 
         if subtype and subtype is not self:
@@ -942,6 +1113,11 @@ class Product(models.Model):
         the specified qty.  Otherwise, return the unit_price
         returns price as a Decimal
         """
+        if include_discount:
+            cached = get_cached_price(self, qty)
+            if cached is not None:
+                return cached.price
+
         subtype = self.get_subtype_with_attr('get_qty_price')
         if subtype and subtype is not self:
             price = subtype.get_qty_price(qty, include_discount=include_discount)
@@ -1017,13 +1193,18 @@ class Product(models.Model):
         if not self.sku:
             self.sku = self.slug
         super(Product, self).save(**kwargs)
-        ProductPriceLookup.objects.smart_create_for_product(self)
 
     def get_subtypes(self):
         # If we've already computed it once, let's not do it again.
         # This is a performance speedup.
         if hasattr(self,"_sub_types"):
             return self._sub_types
+        if self.pk:
+            try:
+                self._sub_types = keyedcache.cache_get('product', 'subtypes', self.pk)
+                return self._sub_types
+            except keyedcache.NotCachedError:
+                pass
         types = []
         try:
             for module, subtype in active_product_types():
@@ -1035,6 +1216,8 @@ class Product(models.Model):
                         types.append(subtype)
                 except models.ObjectDoesNotExist:
                     pass
+            if self.pk:
+                keyedcache.cache_set('product', 'subtypes', self.pk, value=tuple(types))
         except SettingNotSet:
             log.warn("Error getting subtypes, OK if in SyncDB")
 
@@ -1235,6 +1418,8 @@ class ProductPriceLookupManager(models.Manager):
                 items_in_stock=product.items_in_stock)
             obj.save()
             objs.append(obj)
+        signals.price_lookup_changed.send(ProductPriceLookup, site_id=product.site_id,
+            product_ids=[product.id])
         return objs
 
     def create_for_configurableproduct(self, configproduct):
@@ -1266,25 +1451,160 @@ class ProductPriceLookupManager(models.Manager):
                 items_in_stock=product.items_in_stock)
             obj.save()
             objs.append(obj)
+        signals.price_lookup_changed.send(ProductPriceLookup, site_id=product.site_id,
+            product_ids=[product.id, parent.pk])
         return objs
 
     def delete_for_product(self, product):
-        for obj in self.filter(productslug=product.slug, siteid=product.site.id):
+        for obj in self.filter(productslug=product.slug, siteid=product.site_id):
             obj.delete()
+        signals.price_lookup_changed.send(ProductPriceLookup, site_id=product.site_id,
+            product_ids=[product.id])
 
-    def rebuild_all(self, site=None):
+    def product_changed(self, product):
+        """Bring the lookup rows of a changed product up to date.
+
+        If price lookups are deferred, the product is only queued in
+        `StalePriceLookup` and the rows are rebuilt by `refresh_stale`.
+        """
+        if config_value_safe('PRODUCT', 'DEFERRED_PRICE_LOOKUP', False):
+            StalePriceLookup.objects.create(siteid=product.site_id, productid=product.id)
+        else:
+            self.smart_create_for_product(product)
+
+    def refresh_stale(self, site=None):
+        """Rebuild the lookup rows of every product queued in `StalePriceLookup`.
+
+        Variations are refreshed through their parent, so that a parent and
+        all of its variations are always rebuilt together.
+
+        Returns a tuple of (number of products, number of prices).
+        """
         if not site:
             site = Site.objects.get_current()
 
-        for lookup in self.filter(siteid=site.id):
-            lookup.delete()
+        markers = list(StalePriceLookup.objects.filter(siteid=site.id).values_list('id', 'productid'))
+        if not markers:
+            return 0, 0
+
+        last = max([marker_id for marker_id, product_id in markers])
+        product_ids = set([product_id for marker_id, product_id in markers])
+        variation_model = models.get_model('configurable', 'ProductVariation')
+        if variation_model is not None:
+            stale = list(product_ids)
+            for ix in range(0, len(stale), PRICE_LOOKUP_BATCH_SIZE):
+                qry = variation_model.objects.filter(product__in=stale[ix:ix+PRICE_LOOKUP_BATCH_SIZE])
+                for variation_id, parent_id in qry.values_list('product', 'parent'):
+                    product_ids.discard(variation_id)
+                    product_ids.add(parent_id)
+
+        productct, pricect = self.rebuild_products(product_ids, site=site)
+
+        StalePriceLookup.objects.filter(siteid=site.id, id__lte=last).delete()
+        log.debug('ProductPriceLookup refreshed %i prices for %i stale products', pricect, productct)
+        return productct, pricect
+
+    def products_changed(self, product_ids, site=None):
+        """Bring the lookup rows of several changed products up to date at
+        once, or queue them in `StalePriceLookup` if price lookups are deferred.
+        """
+        if not site:
+            site = Site.objects.get_current()
+
+        if config_value_safe('PRODUCT', 'DEFERRED_PRICE_LOOKUP', False):
+            for product_id in product_ids:
+                StalePriceLookup.objects.create(siteid=site.id, productid=product_id)
+        else:
+            self.rebuild_products(product_ids, site=site)
+
+    def rebuild_products(self, product_ids, site=None):
+        """Rebuild the lookup rows of the products in `product_ids`, and of
+        their variations, with the bulk builder.
+
+        Returns a tuple of (number of products, number of prices).
+        """
+        if not site:
+            site = Site.objects.get_current()
+
+        product_ids = sorted(product_ids)
+        productct = pricect = 0
+        for ix in range(0, len(product_ids), PRICE_LOOKUP_BATCH_SIZE):
+            chunk = product_ids[ix:ix+PRICE_LOOKUP_BATCH_SIZE]
+            builder = PriceLookupBuilder(site, product_ids=chunk)
+            rows = builder.build()
+            self._replace_rows(site, rows, product_ids=chunk)
+            productct += builder.productct
+            pricect += len(rows)
+        return productct, pricect
+
+    def rebuild_all(self, site=None):
+        if not site:
+            site = Site.objects.get_current()
 
-        ct = 0
         log.debug('ProductPriceLookup rebuilding all pricing')
-        for p in Product.objects.active_by_site(site=site, variations=False):
-            prices = self.smart_create_for_product(p)
-            ct += len(prices)
-        log.info('ProductPriceLookup built %i prices', ct)
+        return self.bulk_rebuild(site=site)
+
+    def bulk_rebuild(self, site=None):
+        """Rebuild every lookup row for a site in a single pass.
+
+        Products, subtypes, prices and variation options are read with a few
+        batched queries, all of the rows are computed in memory, and the old
+        rows are replaced with bulk inserts inside one transaction.
+
+        Returns a tuple of (number of products, number of prices).
+        """
+        if not site:
+            site = Site.objects.get_current()
+
+        start = time.time()
+        builder = PriceLookupBuilder(site)
+        rows = builder.build()
+        self._replace_rows(site, rows)
+        elapsed = time.time() - start
+
+        if elapsed > 0:
+            rate = len(rows) / elapsed
+        else:
+            rate = len(rows)
+        log.info('ProductPriceLookup built %i prices for %i products in %.2fs (%.0f rows/sec)',
+            len(rows), builder.productct, elapsed, rate)
+        return builder.productct, len(rows)
+
+    def _replace_rows(self, site, rows, product_ids=None):
+        """Delete the lookup rows for the site and bulk insert `rows`, which
+        are tuples ordered as `PRICE_LOOKUP_FIELDS`.
+
+        If `product_ids` is given, only the rows of those products and of
+        their variations are deleted."""
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        fields = [opts.get_field(name) for name in PRICE_LOOKUP_FIELDS]
+        table = qn(opts.db_table)
+        insert = 'INSERT INTO %s (%s) VALUES (%s)' % (table,
+            ', '.join([qn(f.column) for f in fields]),
+            ', '.join(['%s'] * len(fields)))
+        delete = 'DELETE FROM %s WHERE %s = %%s' % (table, qn(opts.get_field('siteid').column))
+        params = [site.id]
+        if product_ids is not None:
+            slugs = list(Product.objects.filter(id__in=product_ids).values_list('slug', flat=True))
+            delete += ' AND (%s IN (%s) OR %s IN (%s))' % (
+                qn(opts.get_field('parentid').column), ', '.join(['%s'] * len(product_ids)),
+                qn(opts.get_field('productslug').column), ', '.join(['%s'] * len(slugs) or ['NULL']))
+            params.extend(product_ids)
+            params.extend(slugs)
+
+        def replace():
+            cursor = connection.cursor()
+            cursor.execute(delete, params)
+            for ix in range(0, len(rows), PRICE_LOOKUP_BATCH_SIZE):
+                batch = [[f.get_db_prep_save(value, connection=connection) for f, value in zip(fields, row)]
+                    for row in rows[ix:ix+PRICE_LOOKUP_BATCH_SIZE]]
+                cursor.executemany(insert, batch)
+            transaction.set_dirty()
+
+        transaction.commit_on_success(replace)()
+        signals.price_lookup_changed.send(ProductPriceLookup, site_id=site.id,
+            product_ids=product_ids)
 
     def smart_create_for_product(self, product):
         subtypes = product.get_subtypes()
@@ -1295,6 +1615,141 @@ class ProductPriceLookupManager(models.Manager):
         else:
             return self.create_for_product(product)
 
+PRICE_LOOKUP_FIELDS = ('productslug', 'parentid', 'siteid', 'active', 'price',
+    'quantity', 'key', 'discountable', 'items_in_stock')
+
+PRICE_LOOKUP_BATCH_SIZE = 500
+
+class PriceLookupBuilder(object):
+    """Computes `ProductPriceLookup` rows for a site in memory.
+
+    This produces the same rows as calling `smart_create_for_product` on
+    every active top-level product, but reads everything it needs up front
+    instead of querying per product and per price. If `product_ids` is
+    given, only those products and their variations are built, active or
+    not, as saving each of them would.
+    """
+
+    def __init__(self, site, product_ids=None):
+        self.site = site
+        self.product_ids = product_ids
+        self.productct = 0
+        self.subtype_models = dict(get_subtype_models())
+
+    def build(self):
+        """Return a list of row tuples, ordered as `PRICE_LOOKUP_FIELDS`."""
+        if self.product_ids is None:
+            qry = Product.objects.filter(active=True)
+        else:
+            qry = Product.objects.all()
+        products = {}
+        for product in self._restrict(qry):
+            product._sub_types = ()
+            products[product.id] = product
+
+        self._load_subtypes(products)
+        prices = self._load_prices()
+        variations, options = self._load_variations()
+
+        rows = []
+        pricelists = {}
+        for product in products.values():
+            if product.id in variations:
+                continue
+            self.productct += 1
+            pricelist = self._price_list(product, prices)
+            pricelists[product.id] = pricelist
+            rows.extend(self._rows(product, pricelist))
+
+        for variation_id, parent_id in variations.items():
+            product = products.get(variation_id, None)
+            if product is None or parent_id not in pricelists:
+                continue
+            variation_options = options.get(variation_id, [])
+            if product.id in prices:
+                pricelist = self._price_list(product, prices)
+            else:
+                delta = Decimal("0.00")
+                for group_id, value, price_change in variation_options:
+                    if price_change:
+                        delta += Decimal(price_change)
+                pricelist = [(qty, price + delta) for qty, price in pricelists[parent_id]]
+
+            key = "::".join([smart_str(value) for group_id, value, price_change in variation_options])
+            rows.extend(self._rows(product, pricelist, parentid=parent_id, key=key))
+
+        return rows
+
+    def _restrict(self, qry, prefix='', variations=True):
+        """Limit `qry` to the site and, if set, to `product_ids`. `prefix` is
+        the lookup path from the queried model to `Product`, and `variations`
+        also keeps the variations of the selected products."""
+        qry = qry.filter(**{prefix + 'site': self.site})
+        if self.product_ids is not None:
+            q = Q(**{prefix + 'id__in': self.product_ids})
+            if variations and 'ProductVariation' in self.subtype_models:
+                q = q | Q(**{prefix + 'productvariation__parent__product__id__in': self.product_ids})
+            qry = qry.filter(q)
+        return qry
+
+    def _load_subtypes(self, products):
+        """Set the cached subtypes on every product using one query per product module."""
+        for subtype, model in self.subtype_models.items():
+            for pk in self._restrict(model.objects.all(), 'product__').values_list('product', flat=True):
+                product = products.get(pk, None)
+                if product is not None and subtype not in product._sub_types:
+                    product._sub_types += (subtype,)
+
+    def _load_prices(self):
+        """Return a dictionary of product id -> unexpired prices, in the
+        same order as `Product.get_qty_price_list`."""
+        prices = {}
+        qry = self._restrict(Price.objects.all(), 'product__').exclude(
+            expires__isnull=False,
+            expires__lt=datetime.date.today())
+        for price in qry:
+            prices.setdefault(price.product_id, []).append(price)
+        return prices
+
+    def _load_variations(self):
+        """Return the variation -> parent map and the variation -> options map,
+        with options sorted by option group like `ProductVariation.optionkey`."""
+        variations = {}
+        options = {}
+        variation_model = self.subtype_models.get('ProductVariation', None)
+        if variation_model is None:
+            return variations, options
+
+        qry = self._restrict(variation_model.objects.all(), 'parent__product__', variations=False)
+        for variation_id, parent_id in qry.values_list('product', 'parent'):
+            variations[variation_id] = parent_id
+
+        qry = self._restrict(variation_model.options.through.objects.all(),
+            'productvariation__parent__product__', variations=False).values_list(
+            'productvariation', 'option__option_group', 'option__value', 'option__price_change')
+        for variation_id, group_id, value, price_change in qry:
+            options.setdefault(variation_id, []).append((group_id, value, price_change))
+        for variation_options in options.values():
+            variation_options.sort(key=lambda opt: opt[0])
+
+        return variations, options
+
+    def _is_discountable(self, product):
+        for subtype in product._sub_types:
+            if hasattr(self.subtype_models[subtype], 'discountable'):
+                return product.is_discountable
+        return True
+
+    def _price_list(self, product, prices):
+        discountable = self._is_discountable(product)
+        return [(price.quantity, price.adjustments(product, discountable=discountable).final_price())
+            for price in prices.get(product.id, [])]
+
+    def _rows(self, product, pricelist, parentid=None, key=None):
+        discountable = self._is_discountable(product)
+        return [(product.slug, parentid, self.site.id, product.active, price, qty,
+            key, discountable, product.items_in_stock) for qty, price in pricelist]
+
 class ProductPriceLookup(models.Model):
     """
     A denormalized object, used to quickly provide
@@ -1327,6 +1782,15 @@ class ProductPriceLookup(models.Model):
 
     dynamic_price = property(fget=_dynamic_price)
 
+class StalePriceLookup(models.Model):
+    """
+    A product whose `ProductPriceLookup` rows are out of date, queued when
+    price lookups are deferred and cleared by `ProductPriceLookup.objects.refresh_stale`.
+    """
+    siteid = models.IntegerField()
+    productid = models.IntegerField()
+    date_added = models.DateTimeField(default=datetime.datetime.now)
+
 # Support the user's setting of custom expressions in the settings.py file
 try:
     user_validations = settings.SATCHMO_SETTINGS.get('ATTRIBUTE_VALIDATIONS')
@@ -1438,16 +1902,19 @@ class Price(models.Model):
     def __unicode__(self):
         return unicode(self.price)
 
-    def adjustments(self, product=None):
+    def adjustments(self, product=None, discountable=None):
         """Get a list of price adjustments, in the form of a PriceAdjustmentCalc
         object. Optionally, provide a pre-fetched product to avoid the foreign
-        key lookup of the `product' attribute.
+        key lookup of the `product' attribute, and a precomputed `discountable'
+        flag to avoid the subtype lookups of `product.is_discountable'.
         """
         if product is None:
             product = self.product
+        if discountable is None:
+            discountable = product.is_discountable
         adjust = PriceAdjustmentCalc(self, product)
         signals.satchmo_price_query.send(self, adjustment=adjust,
-            slug=product.slug, discountable=product.is_discountable)
+            slug=product.slug, discountable=discountable)
         return adjust
 
     def _dynamic_price(self):
@@ -1471,7 +1938,6 @@ class Price(models.Model):
             return #Duplicate Price
 
         super(Price, self).save(**kwargs)
-        ProductPriceLookup.objects.smart_create_for_product(self.product)
 
     class Meta:
         ordering = ['expires', '-quantity']
@@ -1571,3 +2037,6 @@ def split_option_unique_id(uid):
 
     parts = uid.split('-')
     return (parts[0], '-'.join(parts[1:]))
+
+import listeners
+listeners.start_default_listening()
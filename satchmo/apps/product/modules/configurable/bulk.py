@@ -0,0 +1,136 @@
+"""
+Creates the variations of a configurable product in bulk, such as all the
+combinations of its options at once.
+
+Saving the variations one by one looks each of them up, finds a free slug
+query by query, and rebuilds the price lookup rows of the product after each
+save, which is too slow for a product with hundreds of combinations. The
+generator reads the existing variations and slugs once, inserts the new
+products, variations and option links with a few bulk inserts, and rebuilds
+the price lookup rows of the product once at the end.
+"""
+from django.db import connection, transaction
+from django.db.models import AutoField
+from product import signals
+from product.models import Product, ProductPriceLookup
+from product.modules.configurable.matrix import invalidate_variation_matrix
+from satchmo_utils.unique_id import SlugAllocator, slugify
+import datetime
+import logging
+
+log = logging.getLogger('product.modules.configurable.bulk')
+
+# how many rows are inserted, or products looked up, at once
+BATCH_SIZE = 200
+
+def _insert(model, objs):
+    """Insert the unsaved `objs` of `model`, without their automatic primary
+    key and without sending any signal."""
+    qn = connection.ops.quote_name
+    opts = model._meta
+    fields = [f for f in opts.local_fields if not isinstance(f, AutoField)]
+    insert = 'INSERT INTO %s (%s) VALUES (%s)' % (qn(opts.db_table),
+        ', '.join([qn(f.column) for f in fields]),
+        ', '.join(['%s'] * len(fields)))
+    cursor = connection.cursor()
+    for ix in range(0, len(objs), BATCH_SIZE):
+        batch = [[f.get_db_prep_save(f.pre_save(obj, True), connection=connection) for f in fields]
+            for obj in objs[ix:ix+BATCH_SIZE]]
+        cursor.executemany(insert, batch)
+    transaction.set_dirty()
+
+class VariationGenerator(object):
+    """Creates the variations added to it for a configurable product.
+
+    The variations which already exist are updated by
+    `ConfigurableProduct.create_variation` as usual, the others are created
+    together by `generate`.
+    """
+
+    def __init__(self, configurable):
+        self.configurable = configurable
+        self.pending = []
+
+    def add(self, options, name=u"", sku=u"", slug=u""):
+        self.pending.append((list(options), name, sku, slug))
+
+    def generate(self):
+        """Create the variations added, returns the products of the
+        variations created or updated."""
+        configurable = self.configurable
+        parent = configurable.product
+        existing = configurable.get_variation_matrix().variation_ids
+
+        done = []
+        new = []
+        seen = set()
+        for options, name, sku, slug in self.pending:
+            key = configurable._unique_ids_from_options(options)
+            if key in seen:
+                continue
+            seen.add(key)
+            if key in existing:
+                done.append(configurable.create_variation(options, name=name, sku=sku, slug=slug))
+            else:
+                new.append((options, name, sku, slug))
+        self.pending = []
+        if not new:
+            return done
+
+        groups = dict([(group.id, group) for group in configurable.option_group.all()])
+        def group_order(option):
+            group = groups.get(option.option_group_id, None) or option.option_group
+            return (group.sort_order, group.name)
+
+        slugs = []
+        for options, name, sku, given in new:
+            if given:
+                slugs.append(slugify(given))
+            else:
+                slugs.append(slugify(u'%s_%s' % (parent.slug, u'_'.join([opt.value for opt in options]))))
+        allocator = SlugAllocator(Product)
+        allocator.prefetch(slugs)
+
+        today = datetime.date.today()
+        products = []
+        for (options, name, sku, given), slug in zip(new, slugs):
+            while not allocator.is_free(slug):
+                slug = u'_'.join((slug, unicode(parent.id)))
+            allocator.reserve(slug)
+            if not name:
+                ordered = sorted(options, key=group_order)
+                name = u'%s (%s)' % (parent.name, u'/'.join([option.name for option in ordered]))
+            products.append(Product(site=parent.site, items_in_stock=0, name=name,
+                slug=slug, sku=sku or slug, date_added=today))
+
+        def create():
+            from product.modules.configurable.models import ProductVariation
+
+            _insert(Product, products)
+            ids = {}
+            slugs = [product.slug for product in products]
+            for ix in range(0, len(slugs), BATCH_SIZE):
+                ids.update(Product.objects.filter(site=parent.site, slug__in=slugs[ix:ix+BATCH_SIZE]).values_list('slug', 'id'))
+
+            variations = []
+            links = []
+            through = ProductVariation.options.through
+            for product, (options, name, sku, given) in zip(products, new):
+                product.id = ids[product.slug]
+                variations.append(ProductVariation(product_id=product.id, parent_id=parent.id))
+                for option in options:
+                    links.append(through(productvariation_id=product.id, option_id=option.id))
+            _insert(ProductVariation, variations)
+            _insert(through, links)
+
+        try:
+            transaction.commit_on_success(create)()
+        finally:
+            allocator.release()
+        log.info('Created %i variations of %s', len(products), parent.slug)
+
+        invalidate_variation_matrix(parent.id)
+        signals.variations_created.send(configurable, product=parent,
+            variation_ids=[product.id for product in products])
+        ProductPriceLookup.objects.products_changed([parent.id], site=parent.site)
+        return done + products
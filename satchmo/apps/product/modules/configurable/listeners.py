@@ -0,0 +1,85 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from product import signals
+from product.models import Option, OptionGroup, Product, ProductPriceLookup
+from product.modules.configurable.matrix import invalidate_variation_matrix
+from product.modules.configurable.models import ConfigurableProduct, ProductVariation
+import logging
+
+log = logging.getLogger('product.modules.configurable.listeners')
+
+def _product_changed(product):
+    # the subtypes cached on the product may predate this subtype
+    if hasattr(product, '_sub_types'):
+        del product._sub_types
+    ProductPriceLookup.objects.product_changed(product)
+
+def update_lookup_on_configurable_save(sender, instance=None, raw=False, **kwargs):
+    """Rebuild the price lookup rows of a configurable product and its variations."""
+    if not raw:
+        _product_changed(instance.product)
+
+def update_lookup_on_variation_save(sender, instance=None, raw=False, **kwargs):
+    """Rebuild the price lookup rows of a saved variation."""
+    if not raw:
+        _product_changed(instance.product)
+        invalidate_variation_matrix(instance.parent_id)
+
+def update_lookup_on_variation_options_change(sender, instance=None, action=None, **kwargs):
+    """The lookup key and price of a variation depend on its options."""
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, ProductVariation):
+        _product_changed(instance.product)
+        invalidate_variation_matrix(instance.parent_id)
+
+def update_lookup_on_option_save(sender, instance=None, raw=False, **kwargs):
+    """Rebuild every configurable product with a variation using this option,
+    since the option price change is added to the variation prices."""
+    if raw:
+        return
+    parent_ids = ProductVariation.objects.filter(options=instance).values_list('parent', flat=True).distinct()
+    for product in Product.objects.filter(id__in=list(parent_ids)):
+        _product_changed(product)
+
+def remove_lookup_on_variation_delete(sender, instance=None, **kwargs):
+    """Delete the price lookup rows of a product which is no longer a variation."""
+    try:
+        product = Product.objects.get(pk=instance.product_id)
+    except Product.DoesNotExist:
+        # the rows are removed along with the product
+        product = None
+    if product is not None:
+        ProductPriceLookup.objects.delete_for_product(product)
+    invalidate_variation_matrix(instance.parent_id)
+
+def invalidate_matrix_on_lookup_change(sender, product_ids=None, **kwargs):
+    """The variation matrix holds the price lookup rows of the variations."""
+    if product_ids is None or len(product_ids) > 100:
+        invalidate_variation_matrix()
+    else:
+        for product_id in product_ids:
+            invalidate_variation_matrix(product_id)
+
+def invalidate_matrix_on_option_change(sender, raw=False, **kwargs):
+    """The options, their order and the order of their groups are in the
+    matrices of all the configurable products using them."""
+    if not raw:
+        invalidate_variation_matrix()
+
+def invalidate_matrix_on_option_groups_change(sender, instance=None, action=None, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        if isinstance(instance, ConfigurableProduct):
+            invalidate_variation_matrix(instance.product_id)
+        else:
+            invalidate_variation_matrix()
+
+def start_default_listening():
+    post_save.connect(update_lookup_on_configurable_save, sender=ConfigurableProduct)
+    post_save.connect(update_lookup_on_variation_save, sender=ProductVariation)
+    post_delete.connect(remove_lookup_on_variation_delete, sender=ProductVariation)
+    m2m_changed.connect(update_lookup_on_variation_options_change, sender=ProductVariation.options.through)
+    post_save.connect(update_lookup_on_option_save, sender=Option)
+    signals.price_lookup_changed.connect(invalidate_matrix_on_lookup_change, sender=ProductPriceLookup)
+    for model in (Option, OptionGroup):
+        post_save.connect(invalidate_matrix_on_option_change, sender=model)
+        post_delete.connect(invalidate_matrix_on_option_change, sender=model)
+    m2m_changed.connect(invalidate_matrix_on_option_groups_change, sender=ConfigurableProduct.option_group.through)
+    log.debug('Added configurable product listeners')
@@ -0,0 +1,141 @@
+"""
+A compiled matrix of the variations of a configurable product, so that its
+page and the details of its variations don't load the variations, their
+options and their prices one by one.
+
+The matrix holds the option combinations which have an active variation, the
+options themselves, the variations by their options, and the price lookup
+rows of the product: the slug, stock and price by quantity of each
+variation. It is kept in the cache as one object per product, and rebuilt
+when the price lookup rows of the product or of one of its variations
+change, or when its options do.
+"""
+from product.models import Option, ProductPriceLookup, make_option_unique_id
+import keyedcache
+import logging
+import time
+
+log = logging.getLogger('product.modules.configurable.matrix')
+
+class VariationMatrix(object):
+    """The variations of a configurable product."""
+
+    def __init__(self, configurable, version=None):
+        from product.modules.configurable.models import ProductVariation
+
+        self.product_id = configurable.product_id
+        self.version = version
+
+        groups = list(configurable.option_group.all())
+        self.group_sortmap = dict([(group.id, group.sort_order) for group in groups])
+        group_positions = dict([(group.id, ix) for ix, group in enumerate(groups)])
+
+        # the position of each option, as `get_all_options` orders them
+        positions = {}
+        options = {}
+        counts = {}
+        for option in Option.objects.filter(option_group__in=groups).select_related('option_group'):
+            group_ix = group_positions[option.option_group_id]
+            positions[option.id] = (group_ix, counts.get(group_ix, 0))
+            counts[group_ix] = counts.get(group_ix, 0) + 1
+            options[option.id] = option
+
+        active = {}
+        variations = {}
+        uids = {}
+        for pk, is_active in ProductVariation.objects.filter(parent=configurable).values_list('product', 'product__active'):
+            active[pk] = is_active
+            variations[pk] = []
+            uids[pk] = []
+        links = ProductVariation.options.through.objects.filter(productvariation__parent=configurable)
+        for variation_id, option_id, group_id, value in links.values_list(
+                'productvariation', 'option', 'option__option_group', 'option__value'):
+            variations[variation_id].append(option_id)
+            uids[variation_id].append(make_option_unique_id(group_id, value))
+
+        # the variations by the sorted unique ids of their options
+        self.variation_ids = {}
+        for pk, option_uids in uids.items():
+            option_uids = list(set(option_uids))
+            option_uids.sort()
+            self.variation_ids[tuple(option_uids)] = pk
+
+        # the combinations with one option of each group of the product
+        combinations = set()
+        for pk, option_ids in variations.items():
+            if not active[pk]:
+                continue
+            if [option_id for option_id in option_ids if option_id not in positions]:
+                continue
+            found = [positions[option_id] for option_id in option_ids]
+            found.sort()
+            if [group_ix for group_ix, option_ix in found] == range(len(groups)):
+                combinations.add(tuple([option_ix for group_ix, option_ix in found]))
+
+        by_position = dict([(position, options[option_id]) for option_id, position in positions.items()])
+        valid = []
+        for combination in sorted(combinations):
+            valid.append([by_position[(group_ix, option_ix)].unique_id
+                for group_ix, option_ix in enumerate(combination)])
+        self.valid_options = valid
+
+        self.options = {}
+        for option_ids in valid:
+            for uid in option_ids:
+                self.options[uid] = None
+        for option in options.values():
+            if option.unique_id in self.options:
+                self.options[option.unique_id] = option
+
+        # the price lookup rows of the variations, most expensive first
+        self.rows = list(ProductPriceLookup.objects.filter(parentid=self.product_id).order_by('-price').values_list(
+            'key', 'productslug', 'siteid', 'active', 'items_in_stock', 'quantity', 'price', 'discountable'))
+
+    def variation_id(self, option_uids):
+        """Get the product id of the variation with the options of the sorted
+        tuple `option_uids`, or None."""
+        return self.variation_ids.get(tuple(option_uids), None)
+
+    def lookups(self):
+        """Get the price lookup rows of the variations, as unsaved objects."""
+        return [ProductPriceLookup(key=key, parentid=self.product_id, productslug=slug, siteid=siteid,
+            active=active, items_in_stock=items_in_stock, quantity=quantity, price=price,
+            discountable=discountable)
+            for key, slug, siteid, active, items_in_stock, quantity, price, discountable in self.rows]
+
+def _version(*keys):
+    try:
+        return keyedcache.cache_get('configurable', 'matrix', *keys)
+    except keyedcache.NotCachedError:
+        return None
+
+def _current_version(*keys):
+    version = _version(*(keys + ('version',)))
+    if version is None and keyedcache.cache_enabled():
+        # start from the clock, so that an evicted version is never reused
+        version = int(time.time() * 1000)
+        keyedcache.cache_set('configurable', 'matrix', *(keys + ('version',)), value=version)
+    return version
+
+def invalidate_variation_matrix(product_id=None):
+    """Rebuild the matrix of a configurable product on its next use, or the
+    matrices of all of them."""
+    if product_id is None:
+        keys = ('version',)
+    else:
+        keys = (product_id, 'version')
+    version = _version(*keys) or 0
+    keyedcache.cache_set('configurable', 'matrix', *keys,
+        value=max(version + 1, int(time.time() * 1000)))
+
+def get_variation_matrix(configurable):
+    """Get the `VariationMatrix` of a configurable product, from the cache
+    when it is up to date."""
+    version = (_current_version(), _current_version(configurable.product_id))
+    try:
+        matrix = keyedcache.cache_get('configurable', 'matrix', configurable.product_id, 'data', *version)
+    except keyedcache.NotCachedError, nce:
+        matrix = VariationMatrix(configurable, version)
+        log.debug('Compiled the variation matrix of %s', configurable.product_id)
+        keyedcache.cache_set(nce.key, value=matrix)
+    return matrix
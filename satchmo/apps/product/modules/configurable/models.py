@@ -1,12 +1,13 @@
 from decimal import Decimal
 from django import forms
 from django.db import models
+from django.db.models import Count
 from django.utils.translation import ugettext_lazy as _
 from django.utils.encoding import smart_str
 from product.models import Option, Product, ProductPriceLookup, OptionGroup, Price ,make_option_unique_id
 from product.prices import get_product_quantity_price, get_product_quantity_adjustments
 from satchmo_utils import cross_list
-from satchmo_utils.unique_id import slugify
+from satchmo_utils.unique_id import SlugAllocator, slugify
 import config # livesettings options
 import datetime
 import logging
@@ -87,19 +88,27 @@ class ConfigurableProduct(models.Model):
         Returns unique_ids from get_all_options(), but filters out Options that this
         ConfigurableProduct doesn't have a ProductVariation for.
         """
-        variations = self.productvariation_set.filter(product__active='1')
-        active_options = [v.unique_option_ids for v in variations]
-        all_options = get_all_options(self, ids_only=True)
-        return [opt for opt in all_options if self._unique_ids_from_options(opt) in active_options]
+        return [list(options) for options in self.get_variation_matrix().valid_options]
+
+    def get_variation_matrix(self):
+        """
+        Returns the compiled `VariationMatrix` of this product.
+        """
+        from product.modules.configurable.matrix import get_variation_matrix
+        return get_variation_matrix(self)
 
     def create_all_variations(self):
         """
         Get a list of all the optiongroups applied to this object
         Create all combinations of the options and create variations
         """
-        # Create a new ProductVariation for each combination.
+        from product.modules.configurable.bulk import VariationGenerator
+
+        # Create a new ProductVariation for each missing combination.
+        generator = VariationGenerator(self)
         for options in self.get_all_options():
-            self.create_variation(options)
+            generator.add(options)
+        generator.generate()
 
     def create_variation(self, options, name=u"", sku=u"", slug=u""):
         """Create a productvariation with the specified options.
@@ -119,7 +128,8 @@ class ConfigurableProduct(models.Model):
             if not slug:
                 slug = slugify(u'%s_%s' % (self.product.slug, u'_'.join(optnames)))
 
-            while Product.objects.filter(slug=slug).count():
+            allocator = SlugAllocator(Product)
+            while not allocator.is_free(slug):
                 slug = u'_'.join((slug, unicode(self.product.id)))
 
             variant.slug = slug
@@ -184,25 +194,32 @@ class ConfigurableProduct(models.Model):
         Returns the product that matches or None
         """
         options = self._unique_ids_from_options(options)
-        pv = None
         if hasattr(self, '_variation_cache'):
             pv =  self._variation_cache.get(options, None)
-        else:
-            for member in self.productvariation_set.all():
-                if member.unique_option_ids == options:
-                    pv = member
-                    break
-        if pv:
-            return pv.product
-        return None
+            if pv:
+                return pv.product
+            return None
+
+        product_id = self.get_variation_matrix().variation_id(options)
+        if product_id is None:
+            return None
+        try:
+            return Product.objects.get(pk=product_id)
+        except Product.DoesNotExist:
+            return None
 
     def get_variations_for_options(self, options):
         """
         Returns a list of existing ProductVariations with the specified options.
         """
         variations = ProductVariation.objects.filter(parent=self)
-        for option in options:
-            variations = variations.filter(options=option)
+        option_ids = set([option.pk for option in options])
+        if option_ids:
+            # the variations with as many of the options as asked for
+            matches = ProductVariation.options.through.objects.filter(productvariation__parent=self,
+                option__in=list(option_ids)).values('productvariation').annotate(
+                found=Count('option')).filter(found=len(option_ids))
+            variations = variations.filter(pk__in=[row['productvariation'] for row in matches])
         return variations
 
     def add_template_context(self, context, request, selected_options, default_view_tax=False, **kwargs):
@@ -245,8 +262,6 @@ class ConfigurableProduct(models.Model):
             self.create_subs = False
             super(ConfigurableProduct, self).save(**kwargs)
 
-        ProductPriceLookup.objects.smart_create_for_product(self.product)
-
     def get_absolute_url(self):
         return self.product.get_absolute_url()
 
@@ -430,7 +445,6 @@ class ProductVariation(models.Model):
             self.name = ""
 
         super(ProductVariation, self).save(**kwargs)
-        ProductPriceLookup.objects.smart_create_for_product(self.product)
 
     def _set_name(self, name):
         if not name:
@@ -469,3 +483,5 @@ class ProductVariation(models.Model):
     def __unicode__(self):
         return self.product.slug
 
+import listeners
+listeners.start_default_listening()
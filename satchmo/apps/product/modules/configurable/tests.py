@@ -1,8 +1,10 @@
 from decimal import Decimal
 from django.contrib.sites.models import Site
+from django.db import connection
 from django.test import TestCase
-from product.models import Option, OptionGroup, Product, Price
-from product.modules.configurable.models import ConfigurableProduct, ProductVariation
+from livesettings import config_get
+from product.models import Option, OptionGroup, Product, Price, ProductPriceLookup
+from product.modules.configurable.models import ConfigurableProduct, ProductVariation, get_all_options
 import datetime
 import keyedcache
 from product.utils import serialize_options, productvariation_details
@@ -110,6 +112,34 @@ class OptionGroupTest(TestCase):
         django_config.save()
         self.assertEqual(ProductVariation.objects.filter(parent=django_config).count(), 4)
 
+    def testCreateAllVariations(self):
+        """Create all the variations of a product at once."""
+        django_shirt = Product.objects.create(slug="django-shirt", name="Django shirt", site=self.site)
+        Price.objects.create(product=django_shirt, price="10.5")
+        django_config = ConfigurableProduct.objects.create(product=django_shirt)
+        django_config.option_group.add(self.sizes, self.colors)
+        white_shirt = Product.objects.create(slug="django-shirt_small_white",
+            name="Django Shirt (White/Small)", site=self.site)
+        pv_white = ProductVariation.objects.create(product=white_shirt, parent=django_config)
+        pv_white.options.add(self.option_white, self.option_small)
+
+        django_config.create_all_variations()
+        variations = ProductVariation.objects.filter(parent=django_config)
+        self.assertEqual(variations.count(), 4)
+        large_white = Product.objects.get(slug="django-shirt_large_white")
+        self.assertEqual(large_white.name, u"Django shirt (Large/White)")
+        self.assertEqual(large_white.sku, "django-shirt_large_white")
+        self.assertEqual(large_white.productvariation.unique_option_ids,
+            tuple(sorted([self.option_white.unique_id, self.option_large.unique_id])))
+        self.assertEqual(large_white.productvariation.unit_price, Decimal("16.50"))
+        self.assertEqual(django_config.get_product_from_options([self.option_large, self.option_white]), large_white)
+        lookup = ProductPriceLookup.objects.get(productslug="django-shirt_large_white", quantity=1)
+        self.assertEqual(lookup.price, Decimal("16.50"))
+
+        # nothing left to create
+        django_config.create_all_variations()
+        self.assertEqual(ProductVariation.objects.filter(parent=django_config).count(), 4)
+
 
 class ProductTest(TestCase):
     """Test Product functions"""
@@ -194,6 +224,164 @@ class ConfigurableProductTest(TestCase):
             dj_rocks.get_variations_for_options([])],
             [6, 7, 8, 9, 10, 11, 12, 13, 14])
 
+class VariationMatrixTest(TestCase):
+    """Test the compiled variations of a configurable product."""
+    fixtures = ['products.yaml']
+
+    def tearDown(self):
+        keyedcache.cache_delete()
+
+    def test_valid_options(self):
+        dj_rocks = ConfigurableProduct.objects.get(product__slug="dj-rocks")
+        active_options = [v.unique_option_ids for v in dj_rocks.productvariation_set.filter(product__active=True)]
+        expected = [opt for opt in get_all_options(dj_rocks, ids_only=True)
+            if dj_rocks._unique_ids_from_options(opt) in active_options]
+        self.assertEqual(dj_rocks.get_valid_options(), expected)
+
+        # a variation which is no longer active is left out
+        variation = Product.objects.get(slug='dj-rocks-s-b')
+        variation.active = False
+        variation.save()
+        dj_rocks = ConfigurableProduct.objects.get(product__slug="dj-rocks")
+        self.assertEqual(len(dj_rocks.get_valid_options()), len(expected) - 1)
+
+    def test_invalidated(self):
+        dj_rocks = ConfigurableProduct.objects.get(product__slug="dj-rocks")
+        ProductPriceLookup.objects.smart_create_for_product(dj_rocks.product)
+        version = dj_rocks.get_variation_matrix().version
+        self.assertEqual(dj_rocks.get_variation_matrix().version, version)
+        detl = productvariation_details(dj_rocks.product, False, None)
+        self.assertEqual(detl['S::B']['SLUG'], 'dj-rocks-s-b')
+        self.assertNotEqual(detl['S::B']['PRICE']['1'], '$8.00')
+
+        # the price of a variation
+        Price.objects.create(product=Product.objects.get(slug='dj-rocks-s-b'), quantity=Decimal('1'), price=Decimal('8.00'))
+        detl = productvariation_details(dj_rocks.product, False, None)
+        self.assertEqual(detl['S::B']['PRICE']['1'], '$8.00')
+
+        # the order of the options
+        small = Option.objects.get(pk=1)
+        small.sort_order = 100
+        small.save()
+        serialized = serialize_options(dj_rocks)
+        self.assertEqual([opt.value for opt in serialized[0]['items']], ['M', 'L', 'S'])
+
+    def test_details_from_matrix(self):
+        dj_rocks = ConfigurableProduct.objects.get(product__slug="dj-rocks")
+        ProductPriceLookup.objects.smart_create_for_product(dj_rocks.product)
+        detl = productvariation_details(dj_rocks.product, False, None)
+        self.assertEqual(detl['S::B']['SLUG'], 'dj-rocks-s-b')
+
+        # the rows are read from the cached matrix, not from the table
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM %s' % connection.ops.quote_name(ProductPriceLookup._meta.db_table))
+        self.assertEqual(ProductPriceLookup.objects.filter(parentid=dj_rocks.product_id).count(), 0)
+        self.assertEqual(productvariation_details(dj_rocks.product, False, None), detl)
+
+    def test_product_from_options(self):
+        dj_rocks = ConfigurableProduct.objects.get(product__slug="dj-rocks")
+        for variation in dj_rocks.productvariation_set.all():
+            self.assertEqual(dj_rocks.get_product_from_options(variation.unique_option_ids), variation.product)
+        option_small = Option.objects.get(pk=1)
+        option_black = Option.objects.get(pk=4)
+        self.assertEqual(dj_rocks.get_product_from_options([option_small, option_black]).slug, 'dj-rocks-s-b')
+        self.assertEqual(dj_rocks.get_product_from_options([option_small]), None)
+
+        # a variation removed
+        Product.objects.get(slug='dj-rocks-s-b').delete()
+        self.assertEqual(dj_rocks.get_product_from_options([option_small, option_black]), None)
+        variation = dj_rocks.create_variation([option_small, option_black])
+        self.assertEqual(dj_rocks.get_product_from_options([option_small, option_black]), variation)
+
+class PriceLookupRebuildTest(TestCase):
+    """Test that the bulk rebuild matches the per-product lookup creation."""
+    fixtures = ['products.yaml']
+
+    def tearDown(self):
+        keyedcache.cache_delete()
+
+    def _lookup_rows(self):
+        rows = ProductPriceLookup.objects.values_list('productslug', 'parentid', 'siteid',
+            'active', 'price', 'quantity', 'key', 'discountable', 'items_in_stock')
+        return sorted(rows)
+
+    def test_bulk_rebuild(self):
+        site = Site.objects.get_current()
+        # add a variation with its own price, and an expired price
+        sb = Product.objects.get(slug='dj-rocks-s-b')
+        Price.objects.create(product=sb, quantity=Decimal('1'), price=Decimal("12.00"))
+        Price.objects.create(product=sb, quantity=Decimal('5'), price=Decimal("1.00"),
+            expires=datetime.date.today() - datetime.timedelta(days=7))
+
+        ProductPriceLookup.objects.all().delete()
+        for product in Product.objects.active_by_site(site=site, variations=False):
+            ProductPriceLookup.objects.smart_create_for_product(product)
+        expected = self._lookup_rows()
+
+        productct, pricect = ProductPriceLookup.objects.bulk_rebuild(site=site)
+        self.assertEqual(pricect, len(expected))
+        self.assertEqual(productct, Product.objects.active_by_site(site=site, variations=False).count())
+        self.assertEqual(self._lookup_rows(), expected)
+
+        keys = ProductPriceLookup.objects.filter(productslug='dj-rocks-s-b').values_list('key', 'price')
+        self.assertEqual(list(keys), [('S::B', Decimal("12.00"))])
+
+    def test_price_change_updates_lookup(self):
+        parent = Product.objects.get(slug='dj-rocks')
+        price = parent.price_set.get(quantity=Decimal('1'))
+        price.price = Decimal("25.00")
+        price.save()
+        lookup = ProductPriceLookup.objects.get(productslug='dj-rocks-s-b')
+        self.assertEqual(lookup.price, Decimal("25.00"))
+
+    def test_refresh_stale(self):
+        site = Site.objects.get_current()
+        ProductPriceLookup.objects.bulk_rebuild(site=site)
+        setting = config_get('PRODUCT', 'DEFERRED_PRICE_LOOKUP')
+        setting.update(True)
+        try:
+            parent = Product.objects.get(slug='dj-rocks')
+            price = parent.price_set.get(quantity=Decimal('1'))
+            price.price = Decimal("25.00")
+            price.save()
+            sb = Product.objects.get(slug='dj-rocks-s-b')
+            sb.items_in_stock = Decimal('3')
+            sb.save()
+
+            lookup = ProductPriceLookup.objects.get(productslug='dj-rocks-s-b')
+            self.assertEqual(lookup.price, Decimal("20.00"))
+            self.assertEqual(lookup.items_in_stock, Decimal('0'))
+
+            productct, pricect = ProductPriceLookup.objects.refresh_stale(site=site)
+            self.assertEqual(productct, 1)
+            refreshed = self._lookup_rows()
+            self.assertEqual(ProductPriceLookup.objects.refresh_stale(site=site), (0, 0))
+        finally:
+            setting.update(False)
+
+        ProductPriceLookup.objects.bulk_rebuild(site=site)
+        self.assertEqual(refreshed, self._lookup_rows())
+        lookup = ProductPriceLookup.objects.get(productslug='dj-rocks-s-b')
+        self.assertEqual(lookup.price, Decimal("25.00"))
+        self.assertEqual(lookup.items_in_stock, Decimal('3'))
+
+    def test_refresh_stale_inactive(self):
+        site = Site.objects.get_current()
+        ProductPriceLookup.objects.bulk_rebuild(site=site)
+        setting = config_get('PRODUCT', 'DEFERRED_PRICE_LOOKUP')
+        setting.update(True)
+        try:
+            # the rows of a deactivated product are rewritten, as saving it does
+            sb = Product.objects.get(slug='dj-rocks-s-b')
+            sb.active = False
+            sb.save()
+            ProductPriceLookup.objects.refresh_stale(site=site)
+        finally:
+            setting.update(False)
+
+        lookup = ProductPriceLookup.objects.get(productslug='dj-rocks-s-b')
+        self.assertEqual(lookup.active, False)
+        self.assertEqual(lookup.key, 'S::B')
 
 if __name__ == "__main__":
     import doctest
@@ -2,7 +2,7 @@ from decimal import Decimal
 from django.conf import settings
 from django.db import models
 from django.utils.translation import ugettext_lazy as _
-from l10n.utils import lookup_translation
+from l10n.utils import listen_for_translation_changes, lookup_translation
 from product.models import Product, OptionGroup, get_product_quantity_price, get_product_quantity_adjustments
 from product.modules.configurable.models import get_all_options
 from satchmo_utils.fields import CurrencyField
@@ -163,3 +163,5 @@ class CustomTextFieldTranslation(models.Model):
 
     def __unicode__(self):
         return u"CustomTextFieldTranslation: [%s] (ver #%i) %s Name: %s" % (self.languagecode, self.version, self.customtextfield, self.name)
+
+listen_for_translation_changes(CustomTextFieldTranslation)
@@ -0,0 +1,184 @@
+"""Precomputed category navigation tree.
+
+The active categories of a site are loaded at once and kept in the cache as a
+`CategoryTree`, which is rendered once per language and current category to
+the html fragment used by the `category_tree` template tag.
+
+All the cache keys include a per-site version, so a change to a category or to
+a product only has to bump that version for every language to be rebuilt.
+Rebuilding is protected by a lock, so a cold cache under load triggers a
+single rebuild while the other requests keep serving the last fragment built.
+"""
+from django.contrib.sites.models import Site
+from django.core import urlresolvers
+from django.core.cache import cache
+from django.utils.translation import get_language
+from l10n.utils import lookup_translation, prefetch_translations
+from product.models import Category
+import logging
+import time
+
+try:
+    from xml.etree.ElementTree import Element, SubElement, tostring
+except ImportError:
+    from elementtree.ElementTree import Element, SubElement, tostring
+
+log = logging.getLogger('product.navigation')
+
+# seconds before an abandoned rebuild lock expires
+LOCK_TIMEOUT = 30
+# how long a request waits for another one to finish the first build
+LOCK_WAIT = 2.0
+LOCK_POLL = 0.05
+
+class CategoryNode(object):
+    """An active category in the navigation tree."""
+
+    def __init__(self, category):
+        self.category = category
+        self.id = category.id
+        self.slug = category.slug
+        self.name = category.name
+        self.children = []
+
+class CategoryTree(object):
+    """The active categories of a site."""
+
+    def __init__(self, site):
+        self.site_id = site.id
+        self.roots = []
+
+        nodes = {}
+        parents = []
+        for cat in Category.objects.filter(site=site, is_active=True).order_by('ordering', 'name'):
+            nodes[cat.id] = CategoryNode(cat)
+            parents.append((cat.id, cat.parent_id))
+
+        # categories below an inactive parent are left out, as they can't be reached
+        for cat_id, parent_id in parents:
+            if parent_id is None:
+                self.roots.append(nodes[cat_id])
+            elif parent_id in nodes:
+                nodes[parent_id].children.append(nodes[cat_id])
+
+    def _nodes(self, nodes):
+        for node in nodes:
+            yield node
+            for child in self._nodes(node.children):
+                yield child
+
+    def render(self, language_code, current_id=None):
+        """Render the tree as an unnumbered list, utf-8 encoded, with the
+        link to the category `current_id` marked as current."""
+        prefetch_translations([node.category for node in self._nodes(self.roots)], language_code)
+        root = Element('ul')
+
+        def add(parent, node, slugs):
+            li = SubElement(parent, 'li', {'id': 'category-%s' % node.id})
+            if slugs:
+                parent_slugs = '/'.join(slugs) + '/'
+            else:
+                parent_slugs = ''
+            url = urlresolvers.reverse('satchmo_category',
+                kwargs={'parent_slugs': parent_slugs, 'slug': node.slug})
+            attrs = {'href': url}
+            if node.id == current_id:
+                attrs['class'] = 'current'
+            link = SubElement(li, 'a', attrs)
+            link.text = lookup_translation(node.category, 'name', language_code)
+            if node.children:
+                child_list = SubElement(li, 'ul')
+                for child in node.children:
+                    add(child_list, child, slugs + [node.slug])
+
+        for node in self.roots:
+            add(root, node, [])
+        return tostring(root, 'utf-8')
+
+def _version_key(site_id):
+    return 'cat-%s-version' % site_id
+
+def get_tree_version(site_id):
+    """Get the current version of the navigation tree of a site."""
+    key = _version_key(site_id)
+    version = cache.get(key)
+    if version is None:
+        # start from the clock, so that an evicted version is never reused
+        cache.add(key, int(time.time() * 1000))
+        version = cache.get(key, 0)
+    return version
+
+def invalidate_category_tree(site_id):
+    """Make the cached navigation tree of a site stale."""
+    key = _version_key(site_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time() * 1000))
+
+def _build(key, builder):
+    """Build a cached value, unless another request already is building it,
+    in which case None is returned."""
+    lock = '%s-lock' % key
+    if not cache.add(lock, 1, LOCK_TIMEOUT):
+        return None
+    try:
+        value = builder()
+        cache.set(key, value)
+    finally:
+        cache.delete(lock)
+    return value
+
+def _wait_for(key):
+    waited = 0
+    while waited < LOCK_WAIT:
+        time.sleep(LOCK_POLL)
+        waited += LOCK_POLL
+        value = cache.get(key)
+        if value is not None:
+            return value
+    return None
+
+def get_category_tree(site=None):
+    """Get the `CategoryTree` of a site, from the cache if possible."""
+    if not site:
+        site = Site.objects.get_current()
+    key = 'cat-%s-tree-%s' % (site.id, get_tree_version(site.id))
+    tree = cache.get(key)
+    if tree is None:
+        tree = _build(key, lambda: CategoryTree(site))
+        if tree is None:
+            tree = _wait_for(key)
+        if tree is None:
+            log.debug('Gave up waiting for %s, building it again', key)
+            tree = CategoryTree(site)
+    return tree
+
+def render_category_tree(site=None, language_code=None, current_id=None):
+    """Get the navigation tree of a site rendered in a language, with the
+    category `current_id` marked as current, from the cache if possible."""
+    if not site:
+        site = Site.objects.get_current()
+    if not language_code:
+        language_code = get_language()
+    if current_id:
+        current_id = int(current_id)
+    else:
+        current_id = None
+
+    key = 'cat-%s-%s-%s-%s' % (site.id, language_code, current_id, get_tree_version(site.id))
+    html = cache.get(key)
+    if html is None:
+        html = _build(key, lambda: get_category_tree(site).render(language_code, current_id))
+        # the last fragment built for this page, whatever its version
+        latest_key = 'cat-%s-%s-%s' % (site.id, language_code, current_id)
+        if html is None:
+            html = cache.get(latest_key)
+            if html is None:
+                html = _wait_for(key)
+            if html is None:
+                log.debug('Gave up waiting for %s, rendering it again', key)
+                html = get_category_tree(site).render(language_code, current_id)
+        else:
+            cache.set(latest_key, html)
+    return html
@@ -1,22 +1,48 @@
 from decimal import Decimal
 from l10n.utils import moneyfmt
+from product import signals
+from threaded_multihost import threadlocals
 import datetime
 
-def get_product_quantity_adjustments(product, qty=1, parent=None):
-    """Gets a list of adjustments for the price found for a product/qty"""
+def get_products_price_lists(products):
+    """Load the current prices of several products with a single query.
 
-    qty_discounts = product.price_set.exclude(
+    Returns a dictionary of product id -> list of prices, ordered as
+    `get_product_quantity_adjustments` picks them, suitable for its
+    `price_lists` parameter.
+    """
+    from product.models import Price
+
+    price_lists = dict([(product.id, []) for product in products])
+    qry = Price.objects.filter(product__in=price_lists.keys()).exclude(
         expires__isnull=False,
-        expires__lt=datetime.date.today()).filter(quantity__lte=qty)
+        expires__lt=datetime.date.today()).order_by('price', '-quantity', 'expires')
+    for price in qry:
+        price_lists[price.product_id].append(price)
+    return price_lists
+
+def get_product_quantity_adjustments(product, qty=1, parent=None, price_lists=None):
+    """Gets a list of adjustments for the price found for a product/qty
+
+    If `price_lists` (from `get_products_price_lists`) holds the prices of
+    the product, they are used instead of querying them.
+    """
 
-    # Get the price with the quantity closest to the one specified without going over
-    adjustments = qty_discounts.order_by('price','-quantity', 'expires')[:1]
+    if price_lists is not None and product.id in price_lists:
+        adjustments = [price for price in price_lists[product.id] if price.quantity <= qty][:1]
+    else:
+        qty_discounts = product.price_set.exclude(
+            expires__isnull=False,
+            expires__lt=datetime.date.today()).filter(quantity__lte=qty)
+
+        # Get the price with the quantity closest to the one specified without going over
+        adjustments = qty_discounts.order_by('price','-quantity', 'expires')[:1]
     if adjustments:
         adjustments = adjustments[0].adjustments(product)
     else:
         adjustments = None  
         if parent:
-            adjustments = get_product_quantity_adjustments(parent, qty=qty)
+            adjustments = get_product_quantity_adjustments(parent, qty=qty, price_lists=price_lists)
 
 
     if not adjustments:
@@ -34,9 +60,108 @@ def get_product_quantity_price(product, qty=Decimal('1'), delta=Decimal("0.00"),
 
     return adjustments.final_price()+delta
 
+def _prices_cache_key(qty, user=None):
+    # prices depend on the user, such as for the prices of a group
+    if user is None:
+        user = threadlocals.get_current_user()
+    return (getattr(user, 'pk', None), qty)
+
+def get_cached_price(product, qty=Decimal('1')):
+    """Get the `ProductPrice` attached to the product by `get_prices` for
+    `qty` and the current user, or None."""
+    cache = getattr(product, '_prices_cache', None)
+    if cache:
+        return cache.get(_prices_cache_key(qty), None)
+    return None
+
+def get_prices(products, qty=Decimal('1'), user=None):
+    """Price a list of products at once, for listing pages.
+
+    Base prices, price adjustments (such as tiered prices) and the best
+    automatic discount of every product are resolved with a few queries for
+    the whole list, instead of a few per product. Products whose subtype
+    computes its own price, such as variations, are priced one by one.
+
+    Prices are computed for `user`, or for the current user. The results are
+    attached to the products, so that `Product.unit_price`,
+    `Product.get_qty_price` and the sale price filters use them while the
+    same user is current.
+
+    Returns a dictionary of product id -> `ProductPrice`.
+    """
+    from product.models import Product
+    from product.utils import find_best_auto_discounts
+
+    products = Product.objects.prefetch_subtypes(list(products))
+    if not products:
+        return {}
+
+    current_user = threadlocals.get_current_user()
+    if user is None:
+        user = current_user
+    elif user != current_user:
+        threadlocals.set_current_user(user)
+
+    try:
+        signals.satchmo_price_query_prefetch.send(Product, products=products, qty=qty, user=user)
+
+        price_lists = get_products_price_lists(products)
+        discounts = find_best_auto_discounts(products)
+
+        prices = {}
+        for product in products:
+            subtype = product.get_subtype_with_attr('get_qty_price')
+            if subtype and subtype is not product:
+                if qty == 1:
+                    price = product.unit_price
+                else:
+                    price = product.get_qty_price(qty)
+            else:
+                price = get_product_quantity_adjustments(product, qty=qty, price_lists=price_lists).final_price()
+                if not price:
+                    if qty == 1:
+                        price = Decimal("0.00")
+                    else:
+                        price = product.unit_price
+
+            prices[product.id] = ProductPrice(product, qty, price, discounts.get(product.id, None))
+            if not hasattr(product, '_prices_cache'):
+                product._prices_cache = {}
+            product._prices_cache[_prices_cache_key(qty, user)] = prices[product.id]
+
+    finally:
+        if user != current_user:
+            threadlocals.set_current_user(current_user)
+
+    return prices
+
 # -------------------------------------------
 # helper objects - not Django model objects
 
+class ProductPrice(object):
+    """The price of a product at a quantity, as found by `get_prices`, with
+    the best automatic discount for the product."""
+
+    def __init__(self, product, qty, price, discount=None):
+        self.product = product
+        self.qty = qty
+        self.price = price
+        self.discount = discount
+
+    def _sale_price(self):
+        """The price with the automatic discount applied, without taxes."""
+        from product.utils import calc_discounted_by_percentage
+
+        if self.discount and self.discount.valid_for_product(self.product):
+            return calc_discounted_by_percentage(self.price, self.discount.percentage)
+        return self.price
+
+    sale_price = property(_sale_price)
+
+    def __repr__(self):
+        return "<ProductPrice: %s x %s = %s>" % (self.product.slug, self.qty, self.price)
+
+
 class PriceAdjustmentCalc(object):
     """Helper class to handle adding up product pricing adjustments"""
 
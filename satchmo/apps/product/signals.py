@@ -71,6 +71,41 @@ index_prerender = django.dispatch.Signal()
 #: .. Note:: *price* is the same as *sender*
 satchmo_price_query = django.dispatch.Signal()
 
+#: Sent by ``product.prices.get_prices`` before pricing a list of products,
+#: so that the listeners of ``satchmo_price_query`` can load what they need
+#: for all of the products at once.
+#:
+#: :param sender: ``product.models.Product``
+#:
+#: :param products: The list of ``product.models.Product`` being priced.
+#:
+#: :param qty: The quantity the products are priced for.
+#:
+#: :param user: The user the products are priced for, may be None.
+satchmo_price_query_prefetch = django.dispatch.Signal()
+
+#: Sent when the ``product.models.ProductPriceLookup`` rows of products
+#: have been rebuilt or deleted.
+#:
+#: :param sender: ``product.models.ProductPriceLookup``
+#:
+#: :param site_id: The id of the site of the products.
+#:
+#: :param product_ids: The ids of the products whose rows changed, along with
+#:   the ids of their parents, or None if the rows of the whole site did.
+price_lookup_changed = django.dispatch.Signal()
+
+#: Sent when variations of a configurable product have been created in bulk,
+#: without the ``post_save`` signals of their products.
+#:
+#: :param sender: The ``product.modules.configurable.models.ConfigurableProduct``
+#:   the variations were created for.
+#:
+#: :param product: The ``product.models.Product`` of the configurable product.
+#:
+#: :param variation_ids: The ids of the products of the new variations.
+variations_created = django.dispatch.Signal()
+
 #: Sent when a downloadable product is successful.
 #:
 #: :param sender: The product that was successfully ordered.
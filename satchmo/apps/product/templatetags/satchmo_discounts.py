@@ -1,11 +1,40 @@
 from decimal import Decimal
 from django import template
 from livesettings import config_value
+from product.prices import get_cached_price, get_prices
 from product.utils import calc_discounted_by_percentage, find_best_auto_discount
 from tax.templatetags import satchmo_tax
 
 register = template.Library()
 
+class PrefetchPricesNode(template.Node):
+    def __init__(self, products):
+        self.products = template.Variable(products)
+
+    def render(self, context):
+        try:
+            products = self.products.resolve(context)
+        except template.VariableDoesNotExist:
+            return ''
+        user = None
+        if 'request' in context:
+            user = context['request'].user
+        get_prices(products, user=user)
+        return ''
+
+def prefetch_prices(parser, token):
+    """Price a list of products at once, before the price filters are used
+    on each of them.
+
+    Ex: {% prefetch_prices products %}
+    """
+    args = token.split_contents()
+    if len(args) != 2:
+        raise template.TemplateSyntaxError("%r tag expects a list of products" % args[0])
+    return PrefetchPricesNode(args[1])
+
+register.tag('prefetch_prices', prefetch_prices)
+
 def sale_price(product):
     """Returns the sale price, including tax if that is the default."""
     if config_value('TAX', 'DEFAULT_VIEW_TAX'):
@@ -17,6 +46,10 @@ register.filter('sale_price', sale_price)
 
 def untaxed_sale_price(product):
     """Returns the product unit price with the best auto discount applied."""
+    cached = get_cached_price(product)
+    if cached is not None:
+        return cached.sale_price
+
     discount = find_best_auto_discount(product)
     price = product.unit_price
 
@@ -1,23 +1,33 @@
 from decimal import Decimal
+from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.core import urlresolvers
 from django.forms.util import ValidationError
 from django.http import HttpResponse
 from django.test import TestCase
+from l10n.utils import prefetch_translations
 from product.forms import ProductExportForm
 from product.models import (
     Category,
+    CategoryTranslation,
     Discount,
     Option,
     OptionGroup,
     Product,
+    ProductTranslation,
     Price,
 )
+from product.navigation import get_category_tree, get_tree_version, render_category_tree
 from product.prices import (
+    get_cached_price,
+    get_prices,
     get_product_quantity_adjustments,
     PriceAdjustment,
     PriceAdjustmentCalc,
+    ProductPrice,
 )
+from product.utils import find_auto_discounts, find_best_auto_discount
+from threaded_multihost import threadlocals
 import datetime
 import keyedcache
 import signals
@@ -103,6 +113,65 @@ class CategoryTest(TestCase):
         })
         self.assertEqual(self.womens_jewelry.get_absolute_url(), exp_url)
 
+    def test_materialized_path(self):
+        rings = Category.objects.create(slug="rings", name="Rings", parent=self.womens_jewelry, site=self.site)
+        gold = Category.objects.create(slug="gold", name="Gold", parent=rings, site=self.site)
+        self.assertEqual(gold.path, '%i/%i/%i/' % (self.womens_jewelry.id, rings.id, gold.id))
+
+        gold = Category.objects.get(slug="gold")
+        self.assertEqual(gold.parents(), [self.womens_jewelry, rings])
+        self.assertEqual(unicode(gold), u"Women's Jewelry :: Rings :: Gold")
+        self.assertEqual(self.womens_jewelry.get_all_children(), [rings, gold])
+
+        # moving a category moves its whole subtree
+        rings.parent = self.pet_jewelry
+        rings.save()
+        gold = Category.objects.get(slug="gold")
+        self.assertEqual(gold.path, '%i/%i/%i/' % (self.pet_jewelry.id, rings.id, gold.id))
+        self.assertEqual([name for name, url in gold.get_url_name()], [u'Pet Jewelry', u'Rings', u'Gold'])
+        self.assertEqual(self.womens_jewelry.get_all_children(), [])
+        self.assertEqual(self.pet_jewelry.get_all_children(include_self=True), [self.pet_jewelry, rings, gold])
+
+        # the products of the subtree
+        ring = Product.objects.create(slug="gold-ring", name="Gold ring", site=self.site)
+        ring.category.add(gold)
+        self.assertEqual(list(self.pet_jewelry.active_products(include_children=True)), [ring])
+        self.assertEqual(list(self.womens_jewelry.active_products(include_children=True)), [])
+
+        # but not the products below an inactive category
+        rings.is_active = False
+        rings.save()
+        self.assertEqual(list(self.pet_jewelry.active_products(include_children=True)), [])
+        self.assertEqual(list(rings.active_products(include_children=True)), [ring])
+
+    def test_navigation_tree(self):
+        rings = Category.objects.create(slug="rings", name="Rings", parent=self.womens_jewelry, site=self.site)
+        CategoryTranslation.objects.create(category=rings, languagecode='fr', name="Bagues")
+        html = render_category_tree(self.site, 'fr')
+        self.assert_('<li id="category-%i"><a href="%s">Bagues</a></li>' % (rings.id, rings.get_absolute_url()) in html)
+        self.assertEqual(render_category_tree(self.site, 'fr'), html)
+        html = render_category_tree(self.site, 'fr', rings.id)
+        self.assert_('<li id="category-%i"><a class="current" href="%s">Bagues</a></li>' % (rings.id, rings.get_absolute_url()) in html)
+        self.assertEqual(html.count('current'), 1)
+
+        # the cached tree follows the changes to the categories
+        rings.is_active = False
+        rings.save()
+        self.assert_('Bagues' not in render_category_tree(self.site, 'fr'))
+        self.assert_('Rings' not in render_category_tree(self.site, 'en'))
+
+        # saving a product keeps the tree
+        version = get_tree_version(self.site.id)
+        product = Product.objects.create(slug="collar", name="Collar", site=self.site)
+        product.category.add(self.pet_jewelry)
+        product.items_in_stock = 3
+        product.save()
+        self.assertEqual(get_tree_version(self.site.id), version)
+
+        tree = get_category_tree(self.site)
+        self.assertEqual([node.name for node in tree.roots], [u'Pet Jewelry', u"Women's Jewelry"])
+        self.assertEqual(tree.roots[1].children, [])
+
 #    def test_infinite_loop(self):
 #        """Check that Category methods still work on a Category whose parents list contains an infinite loop."""
 #        # Create two Categories that are each other's parents. First make sure that
@@ -177,6 +246,19 @@ class DiscountTest(TestCase):
         self.assertFalse(v[0], False)
         self.assertEqual(v[1], u'This coupon is disabled.')
 
+    def testCalcShipping(self):
+        """The shipping discounts of several costs, from one calculation."""
+        costs = {'cheap': Decimal("4.00"), 'fast': Decimal("20.00")}
+        self.discount.allValid = True
+        self.discount.amount = None
+        self.discount.percentage = Decimal("10")
+        self.discount.shipping = 'APPLY'
+        self.assertEqual(self.discount.calc_shipping(None, costs, items=[]),
+            {'cheap': Decimal("0.40"), 'fast': Decimal("2.00")})
+
+        self.discount.shipping = 'FREE'
+        self.assertEqual(self.discount.calc_shipping(None, costs, items=[]), costs)
+
 
 class CalcFunctionTest(TestCase):
 
@@ -425,6 +507,111 @@ class ProductTest(TestCase):
         self.assertEqual(p.smart_attr('height'), None)
         self.assertEqual(sb.smart_attr('height'), None)
 
+    def test_prefetch_subtypes(self):
+        slugs = ['dj-rocks', 'dj-rocks-s-b', 'PY-Rocks']
+        products = Product.objects.prefetch_subtypes(list(Product.objects.filter(slug__in=slugs)))
+        subtypes = dict([(p.slug, p._sub_types) for p in products])
+        self.assertEqual(subtypes['dj-rocks'], ('ConfigurableProduct',))
+        self.assertEqual(subtypes['dj-rocks-s-b'], ('ProductVariation',))
+        self.assertEqual(subtypes['PY-Rocks'], ())
+
+        # the subtypes are cached, and forgotten when a subtype is deleted
+        sb = Product.objects.get(slug='dj-rocks-s-b')
+        self.assertEqual(sb.get_subtypes(), ('ProductVariation',))
+        sb.productvariation.delete()
+        sb = Product.objects.get(slug='dj-rocks-s-b')
+        self.assertEqual(sb.get_subtypes(), ())
+
+    def test_get_prices(self):
+        product = Product.objects.get(slug='PY-Rocks')
+        Price.objects.create(product=product, quantity=Decimal('10'), price=Decimal("10.00"))
+        today = datetime.date.today()
+        sale = Discount.objects.create(description="Sale", code="SALE", percentage=Decimal('10'),
+            automatic=True, active=True, startDate=today, endDate=today + datetime.timedelta(days=1),
+            site=Site.objects.get_current())
+        sale.valid_products.add(product)
+
+        slugs = ['dj-rocks', 'dj-rocks-s-b', 'PY-Rocks']
+        products = list(Product.objects.filter(slug__in=slugs))
+        prices = get_prices(products)
+        for product in products:
+            fresh = Product.objects.get(pk=product.pk)
+            self.assertEqual(prices[product.id].price, fresh.unit_price)
+            self.assertEqual(product.unit_price, fresh.unit_price)
+
+        pyrocks = [p for p in products if p.slug == 'PY-Rocks'][0]
+        self.assertEqual(prices[pyrocks.id].discount, sale)
+        self.assertEqual(prices[pyrocks.id].sale_price, Decimal("17.55"))
+        self.assertEqual(get_prices([pyrocks], qty=Decimal('10'))[pyrocks.id].price, Decimal("10.00"))
+
+        # the prices of another user are kept apart
+        buyer = User.objects.create_user('buyer', 'buyer@example.com', 'buyer')
+        pricer = User.objects.create_user('pricer', 'pricer@example.com', 'pricer')
+        get_prices([pyrocks], qty=Decimal('10'), user=buyer)
+        get_prices([pyrocks], qty=Decimal('10'), user=pricer)
+        pyrocks._prices_cache[(pricer.pk, Decimal('10'))].price = Decimal("5.00")
+        current = threadlocals.get_current_user()
+        threadlocals.set_current_user(buyer)
+        try:
+            self.assertEqual(get_cached_price(pyrocks, Decimal('10')).price, Decimal("10.00"))
+            self.assertEqual(pyrocks.get_qty_price(Decimal('10')), Decimal("10.00"))
+        finally:
+            threadlocals.set_current_user(current)
+
+        # the discount is only applied to the products it is valid for
+        djrocks = [p for p in products if p.slug == 'dj-rocks'][0]
+        self.assertEqual(ProductPrice(djrocks, 1, Decimal("20.00"), sale).sale_price, Decimal("20.00"))
+
+    def test_auto_discount_index(self):
+        product = Product.objects.get(slug='PY-Rocks')
+        other = Product.objects.get(slug='dj-rocks')
+        self.assertEqual(list(find_auto_discounts(product)), [])
+
+        today = datetime.date.today()
+        sale = Discount.objects.create(description="Sale", code="SALE", percentage=Decimal('10'),
+            automatic=True, active=True, startDate=today, endDate=today + datetime.timedelta(days=1),
+            site=Site.objects.get_current())
+        sale.valid_products.add(product)
+        self.assertEqual(list(find_auto_discounts(product)), [sale])
+        self.assertEqual(find_auto_discounts(product).count(), 1)
+        self.assertEqual(find_best_auto_discount(product), sale)
+        self.assertEqual(list(find_auto_discounts(other)), [])
+        self.assert_(sale.valid_for_product(product))
+        self.assertFalse(sale.valid_for_product(other))
+
+        # discounts given through a category
+        cat = Category.objects.create(slug='sale', name='Sale', site=product.site)
+        other.category.add(cat)
+        sale.valid_categories.add(cat)
+        self.assert_(sale.valid_for_product(other))
+
+        sale.active = False
+        sale.save()
+        self.assertEqual(list(find_auto_discounts(product)), [])
+
+    def test_prefetch_translations(self):
+        product = Product.objects.get(slug='PY-Rocks')
+        other = Product.objects.get(slug='dj-rocks')
+        ProductTranslation.objects.create(product=product, languagecode='fr', name='Python Rocks FR', version=1)
+        ProductTranslation.objects.create(product=product, languagecode='fr', name='Python Rocks FR 2', version=2)
+        ProductTranslation.objects.create(product=product, languagecode='de', name='Python Rocks DE')
+
+        products = dict([(p.slug, p) for p in Product.objects.filter(slug__in=['PY-Rocks', 'dj-rocks'])])
+        prefetch_translations(products.values(), 'fr-ca')
+        product, other = products['PY-Rocks'], products['dj-rocks']
+        # the short language and the most recent version are used
+        self.assertEqual(product.translated_name('fr-ca'), u'Python Rocks FR 2')
+        self.assertEqual(other.translated_name('fr-ca'), other.name)
+        self.assertEqual(product.translated_name('de'), u'Python Rocks DE')
+        self.assertEqual(product.translated_name('en'), product.name)
+
+        # the shared cache is dropped when a translation changes
+        product = Product.objects.get(slug='PY-Rocks')
+        self.assertEqual(product.translated_name('fr-ca'), u'Python Rocks FR 2')
+        ProductTranslation.objects.filter(version=2).get().delete()
+        product = Product.objects.get(slug='PY-Rocks')
+        self.assertEqual(product.translated_name('fr-ca'), u'Python Rocks FR')
+
 class PriceAdjustmentTest(TestCase):
     fixtures = ['products.yaml']
 
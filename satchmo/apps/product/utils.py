@@ -1,14 +1,16 @@
 from decimal import Decimal
 from django.contrib.sites.models import Site
-from django.db.models import Q
 from livesettings import config_value
-from l10n.utils import moneyfmt
+from l10n.utils import moneyfmt, prefetch_translations
 from product.models import Option, ProductPriceLookup, OptionGroup, Discount, Product, split_option_unique_id
 from satchmo_utils.numbers import round_decimal
+import copy
 import datetime
+import keyedcache
 import logging
 import types
 import string
+import time
 
 log = logging.getLogger('product.utils')
 
@@ -23,20 +25,141 @@ def calc_discounted_by_percentage(price, percentage):
     cents = Decimal("0.01")
     return work.quantize(cents)
 
+# the index used last by this process
+_auto_discount_index = {}
+
+class AutoDiscountIndex(object):
+    """The automatic discounts active on a date, indexed by the products they
+    are valid for, so that finding the discounts of a product doesn't query
+    the database.
+    """
+
+    def __init__(self, date, version=None):
+        self.date = date
+        self.version = version
+        discounts = list(Discount.objects.filter(automatic=True, active=True,
+            startDate__lte=date, endDate__gt=date).order_by('-percentage', 'id'))
+        # the position of each discount, best first
+        self.rank = dict([(disc.id, ix) for ix, disc in enumerate(discounts)])
+        self.discounts = discounts
+        self.all_valid = [disc.id for disc in discounts if disc.allValid]
+
+        self.by_product = {}
+        self.category_slugs = {}
+        if discounts:
+            ids = self.rank.keys()
+            links = Discount.valid_products.through.objects.filter(discount__in=ids)
+            for discount_id, product_id in links.values_list('discount', 'product'):
+                self.by_product.setdefault(product_id, []).append(discount_id)
+            for disc in discounts:
+                if not disc.allValid:
+                    self.category_slugs[disc.id] = disc._valid_products_in_categories()
+
+        for found in self.by_product.values():
+            found.sort(key=self.rank.get)
+
+    def ids_for_products(self, products):
+        """Get the ids of the discounts valid for any of the products, best
+        first."""
+        ids = list(self.all_valid)
+        for product in products:
+            ids.extend(self.by_product.get(getattr(product, 'pk', product), []))
+        ids = list(set(ids))
+        ids.sort(key=self.rank.get)
+        return ids
+
+    def for_products(self, products):
+        """Get the discounts valid for any of the products, best first."""
+        # callers may change the discounts, which are shared by all of them
+        return [copy.copy(self.discounts[self.rank[pk]])
+            for pk in self.ids_for_products(products)]
+
+    def valid_for_product(self, discount, product):
+        """Same as `Discount.valid_for_product`, for an indexed discount."""
+        if not product.is_discountable:
+            return False
+        elif discount.allValid:
+            return True
+        return (discount.id in self.by_product.get(product.id, []) or
+            product.slug in self.category_slugs.get(discount.id, ()))
+
+def _auto_discount_version():
+    try:
+        return keyedcache.cache_get('discount', 'auto', 'version')
+    except keyedcache.NotCachedError:
+        return None
+
+def invalidate_auto_discounts():
+    """Make the automatic discount index rebuild on its next use."""
+    _auto_discount_index.clear()
+    version = _auto_discount_version() or 0
+    keyedcache.cache_set('discount', 'auto', 'version',
+        value=max(version + 1, int(time.time() * 1000)))
+
+def get_auto_discount_index():
+    """Get the `AutoDiscountIndex` of today.
+
+    The index is kept in memory and in the cache, and rebuilt when the date
+    changes or `invalidate_auto_discounts` is called.
+    """
+    today = datetime.date.today()
+    index = _auto_discount_index.get('index', None)
+
+    version = _auto_discount_version()
+    if version is None:
+        if keyedcache.cache_enabled():
+            # start from the clock, so that an evicted version is never reused
+            version = int(time.time() * 1000)
+            keyedcache.cache_set('discount', 'auto', 'version', value=version)
+        elif index is not None:
+            # only this process can invalidate the index
+            version = index.version
+
+    if index is None or index.date != today or index.version != version:
+        try:
+            index = keyedcache.cache_get('discount', 'auto', today, version)
+        except keyedcache.NotCachedError, nce:
+            index = AutoDiscountIndex(today, version)
+            keyedcache.cache_set(nce.key, value=index)
+        _auto_discount_index['index'] = index
+    return index
+
 def find_auto_discounts(product):
+    """Get a QuerySet of the active automatic discounts valid for a product,
+    or for any of a list of products, best first.
+
+    The discounts are picked from the index, the QuerySet only queries them
+    once it is evaluated."""
     if not type(product) in (types.ListType, types.TupleType):
         product = (product,)
-    today = datetime.date.today()
-    discs = Discount.objects.filter(automatic=True, active=True, startDate__lte=today, endDate__gt=today)
-    return discs.filter(Q(valid_products__in=product) | Q(allValid=True)).order_by('-percentage')
+    ids = get_auto_discount_index().ids_for_products(product)
+    if not ids:
+        return Discount.objects.none()
+    return Discount.objects.filter(pk__in=ids).order_by('-percentage', 'id')
 
 def find_best_auto_discount(product):
-    discs = find_auto_discounts(product)
+    if not type(product) in (types.ListType, types.TupleType):
+        product = (product,)
+    discs = get_auto_discount_index().for_products(product)
     if len(discs) > 0:
         return discs[0]
     else:
         return None
 
+def find_best_auto_discounts(products):
+    """Find the best automatic discount of each of a list of products.
+
+    Returns a dictionary of product id -> discount, for the products which
+    have one, picked as `find_best_auto_discount` does.
+    """
+    index = get_auto_discount_index()
+    best = {}
+    for product in products:
+        discs = index.for_products([product])
+        if discs:
+            best[product.id] = discs[0]
+    return best
+
 def productvariation_details(product, include_tax, user, create=False):
     """Build the product variation details, for conversion to javascript.
 
@@ -64,12 +187,23 @@ def productvariation_details(product, include_tax, user, create=False):
 
     details = {'SALE' : use_discount}
 
-    variations = ProductPriceLookup.objects.filter(parentid=product.id).order_by("-price")
-    if variations.count() == 0:
+    # the rows of a configurable product are compiled with its variations
+    configurable = None
+    if 'ConfigurableProduct' in product.get_subtypes():
+        configurable = product.configurableproduct
+
+    if configurable is not None:
+        variations = configurable.get_variation_matrix().lookups()
+    else:
+        variations = list(ProductPriceLookup.objects.filter(parentid=product.id).order_by("-price"))
+    if not variations:
         if create:
             log.debug('Creating price lookup for %s', product)
             ProductPriceLookup.objects.smart_create_for_product(product)
-            variations = ProductPriceLookup.objects.filter(parentid=product.id).order_by("-price")
+            if configurable is not None:
+                variations = configurable.get_variation_matrix().lookups()
+            else:
+                variations = ProductPriceLookup.objects.filter(parentid=product.id).order_by("-price")
         else:
             log.warning('You must run satchmo_rebuild_pricing and add it to a cron-job to run every day, or else the product details will not work for product detail pages.')
     for detl in variations:
@@ -120,19 +254,7 @@ def productvariation_details(product, include_tax, user, create=False):
 
 def rebuild_pricing():
     site = Site.objects.get_current()
-    for lookup in ProductPriceLookup.objects.filter(siteid=site.id):
-        lookup.delete()
-
-    products = Product.objects.active_by_site(site=site, variations=False)
-
-    productct = products.count()
-    pricect = 0
-
-    for product in products:
-        prices = ProductPriceLookup.objects.smart_create_for_product(product)
-        pricect += len(prices)
-
-    return productct, pricect
+    return ProductPriceLookup.objects.bulk_rebuild(site=site)
 
 def serialize_options(product, selected_options=()):
     """
@@ -160,8 +282,14 @@ def serialize_options(product, selected_options=()):
     white/small, but you have no white/large - the customer will still see
     the options white and large.
     """
-    all_options = product.get_valid_options()
-    group_sortmap = OptionGroup.objects.get_sortmap()
+    matrix = None
+    if hasattr(product, 'get_variation_matrix'):
+        matrix = product.get_variation_matrix()
+        all_options = matrix.valid_options
+        group_sortmap = matrix.group_sortmap
+    else:
+        all_options = product.get_valid_options()
+        group_sortmap = OptionGroup.objects.get_sortmap()
 
     # first get all objects
     # right now we only have a list of option.unique_ids, and there are
@@ -174,18 +302,26 @@ def serialize_options(product, selected_options=()):
         opts = {}
         serialized = {}
 
-        for options in all_options:
-            for option in options:
-                if not opts.has_key(option):
-                    k, v = split_option_unique_id(option)
-                    vals[v] = False
-                    groups[k] = False
-                    opts[option] = None
-
-        for option in Option.objects.filter(option_group__id__in = groups.keys(), value__in = vals.keys()):
-            uid = option.unique_id
-            if opts.has_key(uid):
-                opts[uid] = option
+        if matrix is not None:
+            # copies, since the cached options are marked as selected below
+            for uid, option in matrix.options.items():
+                opts[uid] = copy.copy(option)
+        else:
+            for options in all_options:
+                for option in options:
+                    if not opts.has_key(option):
+                        k, v = split_option_unique_id(option)
+                        vals[v] = False
+                        groups[k] = False
+                        opts[option] = None
+
+            for option in Option.objects.filter(option_group__id__in = groups.keys(), value__in = vals.keys()):
+                uid = option.unique_id
+                if opts.has_key(uid):
+                    opts[uid] = option
+
+        options = [option for option in opts.values() if option is not None]
+        prefetch_translations(options + [option.option_group for option in options])
 
         # now we have all the objects in our "opts" dictionary, so build the serialization dict
 
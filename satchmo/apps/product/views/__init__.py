@@ -6,9 +6,10 @@ from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext
 from django.template.loader import select_template
 from django.utils.translation import ugettext as _
-from l10n.utils import moneyfmt
+from l10n.utils import moneyfmt, prefetch_translations
 from livesettings import config_value
 from product.models import Category, Product
+from product.prices import get_prices
 from product.modules.configurable.models import ConfigurableProduct, sorted_tuple
 from product.signals import index_prerender
 from product.utils import find_best_auto_discount
@@ -63,12 +64,14 @@ def category_view(request, slug, parent_slugs='', template='product/category.htm
     try:
         category =  Category.objects.get_by_site(slug=slug)
         products = list(category.active_products())
+        get_prices(products, user=request.user)
         sale = find_best_auto_discount(products)
 
     except Category.DoesNotExist:
         return bad_or_missing(request, _('The category you have requested does not exist.'))
 
     child_categories = category.get_all_children()
+    prefetch_translations([category] + list(category.parents()) + list(child_categories) + products)
 
     ctx = {
         'category': category,
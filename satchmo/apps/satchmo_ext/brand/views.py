@@ -6,6 +6,7 @@ from django.utils.translation import ugettext_lazy as _
 from models import Brand, BrandCategory, BrandProduct
 from product import signals
 from product.models import Product
+from product.prices import get_prices
 from product.utils import find_best_auto_discount
 
 import logging
@@ -31,6 +32,7 @@ def brand_page(request, brandname):
 
         
     products = list(brand.active_products())
+    get_prices(products, user=request.user)
     sale = find_best_auto_discount(products)
 
     ctx = {
@@ -56,7 +58,7 @@ def brand_category_page(request, brandname, catname):
     except BrandCategory.DoesNotExist:
         raise Http404(_('No category "%{category}s" in brand "%{brand}s"').format(category=catname, brand=brandname))
         
-    products = list(cat.active_products())
+    products = Product.objects.prefetch_subtypes(list(cat.active_products()))
     sale = find_best_auto_discount(products)
     
     ctx = RequestContext(request, {
@@ -0,0 +1,9 @@
+"""
+Indexed product search.
+
+Add 'satchmo_ext.product_search' to INSTALLED_APPS to replace the default
+keyword search, which scans the product table, with a search through an index
+of the words found in the products.  The index is kept up to date as products
+and categories are saved; run `manage.py satchmo_rebuild_search_index` once
+after installing the app to index the existing products.
+"""
@@ -0,0 +1,141 @@
+from django.contrib.sites.models import Site
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from livesettings import config_value
+from product.listeners import default_product_search_listener, get_priceband
+from product import signals
+from product.models import Category, CategoryTranslation, Product, ProductAttribute, ProductPriceLookup, ProductTranslation
+from satchmo_ext.product_search.models import ProductSearchTerm
+from signals_ahoy.signals import application_search
+import logging
+
+log = logging.getLogger('product_search.listeners')
+
+# in_bulk is done in chunks to keep under the query parameter limits
+FETCH_BATCH_SIZE = 500
+
+def indexed_search_listener(sender, request=None, category=None, keywords=[], results={}, **kwargs):
+    """Search the products through the `ProductSearchTerm` index, ranked by
+    relevance, and filter them by price band against the price lookup table.
+
+    Replaces `product.listeners.default_product_search_listener`.
+    """
+    log.debug('indexed product search listener')
+    site = Site.objects.get_current()
+
+    if not keywords:
+        results.update({'categories': None, 'products': None})
+        return
+
+    show_pv = config_value('PRODUCT','SEARCH_SHOW_PRODUCTVARIATIONS', False)
+    products = Product.objects.active_by_site(variations=show_pv, site=site)
+
+    #automatically assumes active categories only
+    if category:
+        categories = Category.objects.active(site=site, slug=category)
+        if categories:
+            categories = categories[0].get_active_children(include_self=True)
+        products = products.filter(category__in=categories)
+    else:
+        categories = Category.objects.by_site(site=site)
+        for keyword in keywords:
+            categories = categories.filter(
+                Q(name__icontains=keyword) |
+                Q(meta__icontains=keyword) |
+                Q(description__icontains=keyword))
+
+    ranked = ProductSearchTerm.objects.search(keywords, site=site, products=products)
+    ids = [product_id for product_id, score in ranked]
+    found = {}
+    for ix in range(0, len(ids), FETCH_BATCH_SIZE):
+        found.update(Product.objects.in_bulk(ids[ix:ix+FETCH_BATCH_SIZE]))
+    products = [found[product_id] for product_id in ids if product_id in found]
+
+    band = get_priceband(request)
+    if band:
+        low, high = band
+        priced = set(ProductPriceLookup.objects.filter(siteid=site.id, quantity=1,
+            price__gt=low, price__lte=high).values_list('productslug', flat=True))
+        products = [product for product in products if product.slug in priced]
+        if not category:
+            ids = set([product.id for product in products])
+            links = Product.category.through.objects.filter(category__in=categories)
+            priced = set([category_id for category_id, product_id
+                in links.values_list('category', 'product') if product_id in ids])
+            categories = [cat for cat in categories if cat.id in priced]
+
+    results.update({
+        'categories': categories,
+        'products': products
+        })
+
+def index_changed_product(sender, instance=None, **kwargs):
+    """Update the index of a product when it, or one of its translations or
+    attributes, is saved."""
+    if isinstance(instance, Product):
+        product = instance
+    else:
+        try:
+            product = instance.product
+        except Product.DoesNotExist:
+            # deleted along with its product
+            return
+    ProductSearchTerm.objects.index_product(product)
+
+def index_category_products(sender, instance=None, **kwargs):
+    """Update the index of the products of a category whose name changed."""
+    if isinstance(instance, CategoryTranslation):
+        try:
+            instance = instance.category
+        except Category.DoesNotExist:
+            return
+    product_ids = getattr(instance, '_search_product_ids', None)
+    if product_ids is None:
+        product_ids = _category_product_ids(instance)
+    if product_ids:
+        ProductSearchTerm.objects.index_products(site=instance.site, product_ids=product_ids)
+
+def _category_product_ids(category):
+    return list(Product.category.through.objects.filter(category=category).values_list('product', flat=True))
+
+def remember_category_products(sender, instance=None, **kwargs):
+    """Remember the products of a category before its links to them are
+    deleted, so that they can be reindexed afterwards."""
+    instance._search_product_ids = _category_product_ids(instance)
+
+def index_on_category_link(sender, instance=None, action=None, reverse=False, pk_set=None, **kwargs):
+    """Update the index of the products added to or removed from categories."""
+    if action == 'pre_clear' and reverse:
+        remember_category_products(sender, instance=instance)
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            ProductSearchTerm.objects.index_product(instance)
+        else:
+            if action == 'post_clear':
+                product_ids = instance._search_product_ids
+                del instance._search_product_ids
+            else:
+                product_ids = list(pk_set)
+            if product_ids:
+                ProductSearchTerm.objects.index_products(site=instance.site, product_ids=product_ids)
+
+def index_created_variations(sender, product=None, variation_ids=[], **kwargs):
+    """Index the variations created in bulk, which don't send `post_save`."""
+    if variation_ids:
+        ProductSearchTerm.objects.index_products(site=product.site, product_ids=variation_ids)
+
+def start_default_listening():
+    application_search.disconnect(default_product_search_listener, sender=Product)
+    application_search.connect(indexed_search_listener, sender=Product)
+
+    post_save.connect(index_changed_product, sender=Product)
+    for sender in (ProductTranslation, ProductAttribute):
+        post_save.connect(index_changed_product, sender=sender)
+        post_delete.connect(index_changed_product, sender=sender)
+    for sender in (Category, CategoryTranslation):
+        post_save.connect(index_category_products, sender=sender)
+        post_delete.connect(index_category_products, sender=sender)
+    pre_delete.connect(remember_category_products, sender=Category)
+    m2m_changed.connect(index_on_category_link, sender=Product.category.through)
+    signals.variations_created.connect(index_created_variations)
+    log.debug('Added product search listeners')
@@ -0,0 +1,37 @@
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand
+from satchmo_ext.product_search.models import ProductSearchTerm
+import time
+
+class Command(BaseCommand):
+    help = "Builds the Satchmo product search index."
+    args = ['sitename...']
+
+    requires_model_validation = True
+
+    def handle(self, *sitenames, **options):
+        verbosity = int(options.get('verbosity', 1))
+        if len(sitenames) == 0:
+            if verbosity>0:
+                print "Indexing all products for all sites"
+            sites = Site.objects.all()
+        else:
+            sites = []
+            for sitename in sitenames:
+                try:
+                    sites.append(Site.objects.get(domain__iexact=sitename))
+                except Site.DoesNotExist:
+                    print "Warning: Could not find site '%s'" % sitename
+
+        for site in sites:
+            if verbosity > 0:
+                print "Starting product search index for %s" % site.domain
+
+            start = time.time()
+            productct, ct = ProductSearchTerm.objects.index_products(site=site)
+            elapsed = time.time() - start
+
+            if verbosity > 0:
+                print "Indexed %i terms for %i products" % (ct, productct)
+            if verbosity > 1:
+                print "Built in %.2f seconds" % elapsed
@@ -0,0 +1,219 @@
+"""
+An inverted index of the words found in products, used to search the store
+without scanning the product table.
+
+Every product is indexed under the words of its name, sku, descriptions and
+meta, of its translations and attributes, and of the names of its categories.
+Each word gets a weight depending on where it was found, which is used to
+rank the results.
+"""
+from django.contrib.sites.models import Site
+from django.db import connection, models, transaction
+from django.utils.encoding import force_unicode
+from django.utils.html import strip_tags
+from django.utils.translation import ugettext_lazy as _
+from product.models import Category, CategoryTranslation, Product, ProductAttribute, ProductTranslation
+import logging
+import re
+import time
+
+log = logging.getLogger('product_search.models')
+
+TERM_MAX_LENGTH = 50
+INDEX_BATCH_SIZE = 500
+
+# the weight of a word, by the place it was found in
+SEARCH_WEIGHTS = {
+    'name': 10,
+    'sku': 10,
+    'category': 4,
+    'attribute': 3,
+    'short_description': 2,
+    'meta': 2,
+    'description': 1,
+}
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+def get_terms(text):
+    """Split a text, which may contain html, into lowercase index terms."""
+    if not text:
+        return []
+    text = strip_tags(force_unicode(text)).lower()
+    return [word[:TERM_MAX_LENGTH] for word in WORD_RE.findall(text)]
+
+class SearchIndexBuilder(object):
+    """Computes the index terms of the products of a site in memory, with one
+    query per source of text. If `product_ids` is given, only those products
+    are indexed."""
+
+    def __init__(self, site, product_ids=None):
+        self.site = site
+        self.product_ids = product_ids
+
+    def _restrict(self, qry, prefix=''):
+        qry = qry.filter(**{prefix + 'site': self.site})
+        if self.product_ids is not None:
+            qry = qry.filter(**{prefix + 'id__in': self.product_ids})
+        return qry
+
+    def build(self):
+        """Return a dictionary of {product id: {term: weight}}."""
+        terms = {}
+
+        def add(product_id, source, text):
+            weights = terms.get(product_id, None)
+            if weights is None:
+                # the product isn't in the site, or isn't being indexed
+                return
+            weight = SEARCH_WEIGHTS[source]
+            for term in set(get_terms(text)):
+                if weights.get(term, 0) < weight:
+                    weights[term] = weight
+
+        fields = ('name', 'sku', 'short_description', 'description', 'meta')
+        for row in self._restrict(Product.objects.all()).values_list('id', *fields):
+            terms[row[0]] = {}
+            for source, text in zip(fields, row[1:]):
+                add(row[0], source, text)
+
+        fields = ('name', 'short_description', 'description')
+        translations = self._restrict(ProductTranslation.objects.all(), 'product__')
+        for row in translations.values_list('product', *fields):
+            for source, text in zip(fields, row[1:]):
+                add(row[0], source, text)
+
+        attributes = self._restrict(ProductAttribute.objects.all(), 'product__')
+        for product_id, value in attributes.values_list('product', 'value'):
+            add(product_id, 'attribute', value)
+
+        categories = {}
+        links = self._restrict(Product.category.through.objects.all(), 'product__')
+        for product_id, category_id in links.values_list('product', 'category'):
+            categories.setdefault(category_id, []).append(product_id)
+        if categories:
+            names = list(Category.objects.filter(site=self.site).values_list('id', 'name'))
+            names.extend(CategoryTranslation.objects.filter(category__site=self.site).values_list('category', 'name'))
+            for category_id, name in names:
+                for product_id in categories.get(category_id, []):
+                    add(product_id, 'category', name)
+
+        return terms
+
+class ProductSearchTermManager(models.Manager):
+
+    def index_products(self, site=None, product_ids=None):
+        """Rebuild the index of a site, or only of the products in `product_ids`.
+
+        Returns a tuple of (number of products, number of terms).
+        """
+        if not site:
+            site = Site.objects.get_current()
+
+        start = time.time()
+        terms = SearchIndexBuilder(site, product_ids=product_ids).build()
+        rows = []
+        for product_id, weights in terms.items():
+            rows.extend([(site.id, product_id, term, weight) for term, weight in weights.items()])
+        self._replace_rows(site, rows, product_ids=product_ids)
+
+        log.debug('Indexed %i terms for %i products in %.2fs', len(rows), len(terms), time.time() - start)
+        return len(terms), len(rows)
+
+    def index_product(self, product):
+        """Update the index of a single product."""
+        return self.index_products(site=product.site, product_ids=[product.id])
+
+    def _replace_rows(self, site, rows, product_ids=None):
+        """Delete the index rows of the site, or of `product_ids`, and bulk
+        insert `rows`, which are (site id, product id, term, weight) tuples."""
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        fields = [opts.get_field(name) for name in ('site', 'product', 'term', 'weight')]
+        table = qn(opts.db_table)
+        insert = 'INSERT INTO %s (%s) VALUES (%s)' % (table,
+            ', '.join([qn(f.column) for f in fields]),
+            ', '.join(['%s'] * len(fields)))
+        delete = 'DELETE FROM %s WHERE %s = %%s' % (table, qn(opts.get_field('site').column))
+        params = [site.id]
+        if product_ids is not None:
+            delete += ' AND %s IN (%s)' % (qn(opts.get_field('product').column),
+                ', '.join(['%s'] * len(product_ids)))
+            params.extend(product_ids)
+
+        def replace():
+            cursor = connection.cursor()
+            cursor.execute(delete, params)
+            for ix in range(0, len(rows), INDEX_BATCH_SIZE):
+                batch = [[f.get_db_prep_save(value, connection=connection) for f, value in zip(fields, row)]
+                    for row in rows[ix:ix+INDEX_BATCH_SIZE]]
+                cursor.executemany(insert, batch)
+            transaction.set_dirty()
+
+        transaction.commit_on_success(replace)()
+
+    def search(self, keywords, site=None, products=None):
+        """Find the products containing every keyword, as a list of
+        (product id, score) tuples with the best matches first.
+
+        A keyword matches the indexed words it starts, and scores twice as
+        much when it matches a whole word. `products` optionally is a
+        queryset the matching products are restricted to.
+        """
+        if not site:
+            site = Site.objects.get_current()
+
+        terms = []
+        for keyword in keywords:
+            for term in get_terms(keyword):
+                if term not in terms:
+                    terms.append(term)
+        if not terms:
+            return []
+
+        scores = None
+        for term in terms:
+            qry = self.filter(site=site, term__startswith=term)
+            if products is not None:
+                qry = qry.filter(product__in=products)
+            if scores is not None and len(scores) <= INDEX_BATCH_SIZE:
+                qry = qry.filter(product__in=scores.keys())
+
+            found = {}
+            for product_id, indexed, weight in qry.values_list('product', 'term', 'weight'):
+                if indexed == term:
+                    weight *= 2
+                if found.get(product_id, 0) < weight:
+                    found[product_id] = weight
+
+            if scores is None:
+                scores = found
+            else:
+                scores = dict([(product_id, score + found[product_id])
+                    for product_id, score in scores.items() if product_id in found])
+            if not scores:
+                return []
+
+        ranked = scores.items()
+        ranked.sort(key=lambda item: (-item[1], item[0]))
+        return ranked
+
+class ProductSearchTerm(models.Model):
+    """A word found in a product, with the weight it has in the search results."""
+    site = models.ForeignKey(Site, verbose_name=_('Site'))
+    product = models.ForeignKey(Product, verbose_name=_('Product'), related_name='search_terms')
+    term = models.CharField(_("Term"), max_length=TERM_MAX_LENGTH, db_index=True)
+    weight = models.IntegerField(_("Weight"), default=1)
+
+    objects = ProductSearchTermManager()
+
+    def __unicode__(self):
+        return u"%s: %s (%i)" % (self.product_id, self.term, self.weight)
+
+    class Meta:
+        verbose_name = _("Product Search Term")
+        verbose_name_plural = _("Product Search Terms")
+        unique_together = ('product', 'term')
+
+import listeners
+listeners.start_default_listening()
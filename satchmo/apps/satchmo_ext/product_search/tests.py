@@ -0,0 +1,62 @@
+from django.contrib.sites.models import Site
+from django.core.urlresolvers import reverse as url
+from django.test import TestCase
+from product.models import Category, Product, ProductTranslation
+from product.utils import rebuild_pricing
+from satchmo_ext.product_search.models import ProductSearchTerm, get_terms
+import keyedcache
+
+class ProductSearchTest(TestCase):
+    fixtures = ['l10n-data.yaml', 'sample-store-data.yaml', 'products.yaml', 'test-config.yaml']
+
+    def setUp(self):
+        keyedcache.cache_delete()
+        self.site = Site.objects.get_current()
+        ProductSearchTerm.objects.index_products(site=self.site)
+
+    def tearDown(self):
+        keyedcache.cache_delete()
+
+    def _search(self, *keywords):
+        ranked = ProductSearchTerm.objects.search(keywords, site=self.site)
+        slugs = Product.objects.in_bulk([product_id for product_id, score in ranked])
+        return [slugs[product_id].slug for product_id, score in ranked]
+
+    def test_terms(self):
+        self.assertEqual(get_terms(u'<p>A <b>Neat</b> book, on tape.</p>'), [u'a', u'neat', u'book', u'on', u'tape'])
+
+    def test_search(self):
+        self.assert_('PY-Rocks' in self._search('python'))
+        # prefixes of words match too, and every keyword has to match
+        self.assert_('PY-Rocks' in self._search('pyth', 'rocks'))
+        self.assertEqual(self._search('python', 'book'), [])
+
+        # names rank above descriptions and categories
+        products = Product.objects.filter(category__slug='shirts')
+        ranked = ProductSearchTerm.objects.search(['shirt'], site=self.site, products=products)
+        self.assert_(ranked)
+        self.assertEqual(ranked[0][0], Product.objects.get(slug='dj-rocks').id)
+
+    def test_index_updates(self):
+        product = Product.objects.get(slug='PY-Rocks')
+        product.name = 'Snake shirt'
+        product.save()
+        self.assert_('PY-Rocks' in self._search('snake'))
+
+        ProductTranslation.objects.create(product=product, languagecode='fr', name='Chemise serpent')
+        self.assert_('PY-Rocks' in self._search('serpent'))
+
+        cat = Category.objects.create(slug='reptiles', name='Reptiles', site=self.site)
+        product.category.add(cat)
+        self.assert_('PY-Rocks' in self._search('reptiles'))
+        cat.delete()
+        self.assertEqual(self._search('reptiles'), [])
+
+    def test_search_view(self):
+        rebuild_pricing()
+        response = self.client.get(url('satchmo_search'), {'keywords': 'rocks'})
+        self.assertContains(response, 'Python Rocks shirt')
+        self.assertContains(response, 'Django Rocks shirt')
+
+        response = self.client.get(url('satchmo_search'), {'keywords': 'rocks', 'priceband': '0-19'})
+        self.assertNotContains(response, 'Python Rocks shirt')
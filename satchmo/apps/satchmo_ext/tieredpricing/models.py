@@ -56,6 +56,14 @@ class TieredPriceManager(models.Manager):
 
     def by_product_qty(self, tier, product, qty=Decimal('1')):
         """Get the tiered price for the specified product and quantity. If it's a product variation, we check the parent too"""
+        cache_qty, cache = getattr(product, '_tieredprices_cache', (None, None))
+        if cache is not None and qty <= cache_qty and 'ProductVariation' not in product.get_subtypes():
+            # loaded by tiered_price_prefetch_listener, best quantity first
+            for tp in cache.get(tier.id, []):
+                if tp.quantity <= qty:
+                    return tp
+            raise TieredPrice.DoesNotExist
+
 
         qty_discounts = product.tieredprices.exclude(expires__isnull=False, expires__lt=datetime.date.today()).filter(quantity__lte=qty, pricingtier=tier)
 
@@ -161,4 +169,23 @@ def tiered_price_listener(signal, adjustment=None, **kwargs):
             except PricingTier.DoesNotExist:
                 pass
 
+def tiered_price_prefetch_listener(sender, products=[], qty=Decimal('1'), user=None, **kwargs):
+    """Listens for satchmo_price_query_prefetch signals, and loads the tiered
+    prices of all of the products with one query."""
+    if not user or user.is_anonymous():
+        return
+    try:
+        tiers = PricingTier.objects.by_user(user)
+    except PricingTier.DoesNotExist:
+        return
+
+    found = dict([(product.id, {}) for product in products])
+    qry = TieredPrice.objects.filter(pricingtier__in=tiers, product__in=found.keys(),
+        quantity__lte=qty).exclude(expires__isnull=False, expires__lt=datetime.date.today())
+    for tp in qry.order_by('-quantity'):
+        found[tp.product_id].setdefault(tp.pricingtier_id, []).append(tp)
+    for product in products:
+        product._tieredprices_cache = (qty, found[product.id])
+
 signals.satchmo_price_query.connect(tiered_price_listener)
+signals.satchmo_price_query_prefetch.connect(tiered_price_prefetch_listener)
@@ -3,6 +3,7 @@ from django.contrib.auth.models import User, Group
 from django.test import TestCase
 from product.models import Product, Price
 from satchmo_ext.tieredpricing.models import *
+from threaded_multihost import threadlocals
 from threaded_multihost.threadlocals import set_current_user
 import keyedcache
 
@@ -72,3 +73,15 @@ class TieredTest(TestCase):
         set_current_user(self.stduser)
         self.assertEqual(product.unit_price, Decimal("19.50"))
 
+
+    def test_prefetch_tieredprices(self):
+        """Test that tiered prices loaded for a list of products are used"""
+        product = Product.objects.get(slug='PY-Rocks')
+        TieredPrice.objects.create(product=product, pricingtier=self.tier, quantity='1', price=Decimal('10.00'))
+        # forget the tiers found for users of earlier tests with the same id
+        threadlocals.set_thread_variable('TIER_%i' % self.tieruser.id, None)
+        tiered_price_prefetch_listener(Product, products=[product], qty=Decimal('1'), user=self.tieruser)
+
+        TieredPrice.objects.all().delete()
+        tp = TieredPrice.objects.by_product_qty(self.tier, product, Decimal('1'))
+        self.assertEqual(tp.price, Decimal('10.00'))
@@ -43,6 +43,11 @@ def recalc_total_on_contact_change(contact=None, **kwargs):
         order.copy_addresses()
         order.recalculate_total()
 
+def clear_cart_cache_on_update(sender, cart=None, **kwargs):
+    """Drop the items and prices cached on the cart when it is updated"""
+    if cart is not None:
+        cart.clear_cache()
+
 def remove_order_on_cart_update(request=None, cart=None, **kwargs):
     """Remove partially completed order when the cart is updated"""
     if request:
@@ -66,6 +71,7 @@ def start_default_listening():
     signals.order_success.connect(decrease_inventory_on_sale)
     signals.order_success.connect(notification.order_success_listener, sender=None)
     signals.order_success.connect(discount_used_listener, sender=None)
+    signals.satchmo_cart_changed.connect(clear_cart_cache_on_update, sender=None)
     signals.satchmo_cart_changed.connect(remove_order_on_cart_update, sender=None)
     application_search.connect(default_product_search_listener, sender=Product)
     signals.satchmo_order_status_changed.connect(capture_on_ship_listener)
@@ -7,7 +7,7 @@ from decimal import Decimal, ROUND_CEILING
 from django.contrib.sites.models import Site
 from django.conf import settings
 from django.core import urlresolvers
-from django.db import models
+from django.db import connection, models, transaction
 from django.utils.encoding import force_unicode
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext, ugettext_lazy as _
@@ -15,7 +15,7 @@ from l10n.models import Country
 from l10n.utils import moneyfmt
 from livesettings import ConfigurationSettings, config_value
 from product.models import Discount, Product, Price, get_product_quantity_adjustments
-from product.prices import PriceAdjustmentCalc, PriceAdjustment
+from product.prices import PriceAdjustmentCalc, PriceAdjustment, get_products_price_lists
 from satchmo_store.contact.models import Contact
 from satchmo_utils.fields import CurrencyField
 from satchmo_utils.numbers import trunc_decimal
@@ -28,6 +28,7 @@ import keyedcache
 import logging
 import operator
 import signals
+import time
 
 log = logging.getLogger('satchmo_store.shop.models')
 
@@ -178,6 +179,9 @@ class NullCart(object):
     def empty(self):
         pass
 
+    def clear_cache(self):
+        pass
+
     def __str__(self):
         return "NullCart (empty)"
 
@@ -275,6 +279,26 @@ class CartManager(models.Manager):
         return cart
 
 
+def get_cart_version(cart_id):
+    """Get the current version of the items of the cart `cart_id`, shared by
+    all the processes, so that a change to an item reaches every copy of its
+    cart."""
+    try:
+        return keyedcache.cache_get('cart', 'version', cart_id)
+    except keyedcache.NotCachedError:
+        version = 0
+        if keyedcache.cache_enabled():
+            # start from the clock, so that an evicted version is never reused
+            version = int(time.time() * 1000)
+            keyedcache.cache_set('cart', 'version', cart_id, value=version)
+        return version
+
+def clear_cart_cache(cart_id):
+    """Make the items and prices cached by every copy of the cart `cart_id`
+    stale."""
+    keyedcache.cache_set('cart', 'version', cart_id,
+        value=max(get_cart_version(cart_id) + 1, int(time.time() * 1000)))
+
 class Cart(models.Model):
     """
     Store items currently in a cart
@@ -288,11 +312,48 @@ class Cart(models.Model):
 
     objects = CartManager()
 
+    def _get_items(self):
+        """Get the cart items, loading their products, details and product
+        subtypes in bulk the first time, and reusing them afterwards."""
+        self._check_cache()
+        if not hasattr(self, '_items_cache'):
+            # read before the items, so that a change made meanwhile isn't missed
+            version = get_cart_version(self.id)
+            items = list(self.cartitem_set.select_related('product'))
+            details = {}
+            if items:
+                for detail in CartItemDetails.objects.filter(cartitem__cart=self):
+                    details.setdefault(detail.cartitem_id, []).append(detail)
+            Product.objects.prefetch_subtypes([item.product for item in items])
+            for item in items:
+                item.cart = self
+                item._details_cache = details.get(item.id, [])
+                item._unit_price_cache = {}
+            self._items_cache = items
+            self._items_version = version
+            self._totals_cache = {}
+        return self._items_cache
+
+    def _check_cache(self):
+        """Forget the cached items when the cart was changed through another
+        copy of it."""
+        if hasattr(self, '_items_cache') and self._items_version != get_cart_version(self.id):
+            self.clear_cache()
+
+    def clear_cache(self):
+        """Forget the items and prices computed for this cart."""
+        for attr in ('_items_cache', '_items_version', '_totals_cache', '_count_cache', '_parcels_cache'):
+            if hasattr(self, attr):
+                delattr(self, attr)
+
     def _get_count(self):
-        itemCount = 0
-        for item in self.cartitem_set.all():
-            itemCount += item.quantity
-        return (itemCount)
+        self._check_cache()
+        if not hasattr(self, '_count_cache'):
+            itemCount = 0
+            for item in self._get_items():
+                itemCount += item.quantity
+            self._count_cache = itemCount
+        return self._count_cache
     numItems = property(_get_count)
 
     def _get_discount(self):
@@ -301,13 +362,15 @@ class Cart(models.Model):
     discount = property(_get_discount)
 
     def _get_total(self, include_discount=True):
-        total = Decimal("0")
-        for item in self.cartitem_set.all():
-            if include_discount:
-                total += item.line_total
-            else:
-                total += item.undiscounted_line_total
-        return(total)
+        """Price every line once, then reuse the line prices and totals for
+        the life of this cart object."""
+        items = self._get_items()
+        if include_discount not in self._totals_cache:
+            total = Decimal("0")
+            for item in items:
+                total += item._get_cached_unitprice(include_discount) * item.quantity
+            self._totals_cache[include_discount] = total
+        return self._totals_cache[include_discount]
     total = property(_get_total)
 
     def _get_undiscounted_total(self):
@@ -316,10 +379,10 @@ class Cart(models.Model):
     undiscounted_total = property(_get_undiscounted_total)
 
     def __iter__(self):
-        return iter(self.cartitem_set.all())
+        return iter(self._get_items())
 
     def __len__(self):
-        return self.cartitem_set.count()
+        return len(self._get_items())
 
     def __nonzero__(self):
         """
@@ -334,13 +397,14 @@ class Cart(models.Model):
         return True
 
     def _is_empty(self):
-        return self.cartitem_set.count() == 0
+        return len(self) == 0
     is_empty = property(_is_empty)
 
     def __unicode__(self):
         return u"Shopping Cart (%s)" % self.date_time_created
 
     def add_item(self, chosen_item, number_added, details=[]):
+        self.clear_cache()
         alreadyInCart = False
         # Custom Products will not be added, they will each get their own line item
         if 'CustomProduct' in chosen_item.get_subtypes():
@@ -382,6 +446,7 @@ class Cart(models.Model):
             for data in details:
                 item_to_modify.add_detail(data)
 
+        self.clear_cache()
         return item_to_modify
 
     def remove_item(self, chosen_item_id, number_removed):
@@ -391,6 +456,7 @@ class Cart(models.Model):
             item_to_modify.delete()
         else:
             item_to_modify.save()
+        self.clear_cache()
 
 
     def merge_carts(self, src_cart):
@@ -401,11 +467,13 @@ class Cart(models.Model):
         for item in src_cart.cartitem_set.all():
             self.add_item(item.product, item.quantity, item.details.all())
             item.delete()
+        src_cart.clear_cache()
         self.save()
 
     def empty(self):
         for item in self.cartitem_set.all():
             item.delete()
+        self.clear_cache()
         self.save()
 
     def save(self, **kwargs):
@@ -420,7 +488,7 @@ class Cart(models.Model):
 
     def _get_shippable(self):
         """Return whether the cart contains shippable items."""
-        for cartitem in self.cartitem_set.all():
+        for cartitem in self._get_items():
             if cartitem.is_shippable:
                 return True
         return False
@@ -430,7 +498,7 @@ class Cart(models.Model):
         """Return a list of shippable products, where each item is split into
         multiple elements, one for each quantity."""
         items = []
-        for cartitem in self.cartitem_set.all():
+        for cartitem in self._get_items():
             if cartitem.is_shippable:
                 p = cartitem.product
                 q =  int(cartitem.quantity.quantize(Decimal('0'), ROUND_CEILING))
@@ -456,6 +524,12 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, verbose_name=_('Product'))
     quantity = models.DecimalField(_("Quantity"),  max_digits=18,  decimal_places=6)
 
+    def __init__(self, *args, **kwargs):
+        super(CartItem, self).__init__(*args, **kwargs)
+        # Unit prices keyed by include_discount. Only items loaded through
+        # their cart cache them, since the cart drops them on any change.
+        self._unit_price_cache = None
+
     def _get_line_unitprice(self, include_discount=True):
         # Get the qty discount price as the unit price for the line.
 
@@ -478,20 +552,32 @@ class CartItem(models.Model):
 
         return price
 
-    unit_price = property(_get_line_unitprice)
+    def _get_cached_unitprice(self, include_discount=True):
+        if self._unit_price_cache is None:
+            return self._get_line_unitprice(include_discount=include_discount)
+        if include_discount not in self._unit_price_cache:
+            self._unit_price_cache[include_discount] = self._get_line_unitprice(include_discount=include_discount)
+        return self._unit_price_cache[include_discount]
+
+    unit_price = property(_get_cached_unitprice)
 
     def _get_undiscounted_unitprice(self):
-        return self._get_line_unitprice(include_discount=False)
+        return self._get_cached_unitprice(include_discount=False)
 
     undiscounted_unit_price = property(_get_undiscounted_unitprice)
 
+    def _get_details(self):
+        """Get the details, preloaded by the cart if available"""
+        if hasattr(self, '_details_cache'):
+            return self._details_cache
+        return self.details.all()
+
     def get_detail_price(self):
         """Get the delta price based on detail modifications"""
         delta = Decimal("0")
-        if self.has_details:
-            for detail in self.details.all():
-                if detail.price_change and detail.value:
-                    delta += detail.price_change
+        for detail in self._get_details():
+            if detail.price_change and detail.value:
+                delta += detail.price_change
         return delta
 
     def get_qty_price(self, qty, include_discount=True):
@@ -525,12 +611,16 @@ class CartItem(models.Model):
             price_change=data['price_change'])
 
         detl.save()
+        if hasattr(self, '_details_cache'):
+            del self._details_cache
         #self.details.add(detl)
 
     def _has_details(self):
         """
         Determine if this specific item has more detail
         """
+        if hasattr(self, '_details_cache'):
+            return len(self._details_cache) > 0
         return (self.details.count() > 0)
 
     has_details = property(_has_details)
@@ -540,6 +630,25 @@ class CartItem(models.Model):
         return u'%s - %s %s' % (self.quantity, self.product.name,
             money_format)
 
+    def save(self, **kwargs):
+        if self._unit_price_cache:
+            self._unit_price_cache = {}
+        super(CartItem, self).save(**kwargs)
+        self._clear_cart_cache(self.cart_id)
+
+    def delete(self):
+        cart_id = self.cart_id
+        super(CartItem, self).delete()
+        self._clear_cart_cache(cart_id)
+
+    def _clear_cart_cache(self, cart_id):
+        # the cart object the item was loaded with, if any
+        cart = getattr(self, '_cart_cache', None)
+        if cart is not None:
+            cart.clear_cache()
+        # and the other copies of the cart
+        clear_cart_cache(cart_id)
+
     class Meta:
         verbose_name = _("Cart Item")
         verbose_name_plural = _("Cart Items")
@@ -887,22 +996,49 @@ class Order(models.Model):
             self.force_recalculate_total(save=save)
 
     def force_recalculate_total(self, save=True):
-        """Calculates sub_total, taxes and total."""
+        """Calculates sub_total, taxes and total.
+
+        The order items, their details, prices and subtypes are loaded up
+        front, everything is computed in memory, and only the items and
+        tax details which changed are written back. With `save=False`
+        nothing is written at all; the new values are left on the order,
+        and the items and tax details are available from
+        `recalculated_items` and `recalculated_taxes`. Note that the tax
+        processor still reads the stored items.
+        """
         zero = Decimal("0.0000000000")
         total_discount = Decimal("0.0000000000")
 
+        items = list(self.orderitem_set.select_related('product'))
+        details = {}
+        if items:
+            for detail in OrderItemDetail.objects.filter(item__order=self):
+                details.setdefault(detail.item_id, []).append(detail)
+        products = [lineitem.product for lineitem in items]
+        Product.objects.prefetch_subtypes(products)
+        price_lists = get_products_price_lists(products)
+        for lineitem in items:
+            lineitem.order = self
+            lineitem._details_cache = details.get(lineitem.id, [])
+
         discount = Discount.objects.by_code(self.discount_code)
-        discount.calc(self)
+        discount.calc(self, items=items, save=save)
 
         discounts = discount.item_discounts
         itemprices = []
         fullprices = []
+        changed = []
 
         qty_override = config_value('SHOP','CART_QTY')
         if qty_override:
-            itemct = self.numItems
+            itemct = Decimal("0")
+            for lineitem in items:
+                itemct += lineitem.quantity
 
-        for lineitem in self.orderitem_set.all():
+        taxProcessor = get_tax_processor(self)
+
+        for lineitem in items:
+            original = [getattr(lineitem, field) for field in ORDERITEM_PRICE_FIELDS]
             lid = lineitem.id
             if lid in discounts:
                 lineitem.discount = discounts[lid]
@@ -916,7 +1052,7 @@ class Order(models.Model):
             else:
                 qty = lineitem.quantity
 
-            adjustment = get_product_quantity_adjustments(lineitem.product, qty=qty)
+            adjustment = get_product_quantity_adjustments(lineitem.product, qty=qty, price_lists=price_lists)
 
             if adjustment and adjustment.price:
                 baseprice = adjustment.price.price
@@ -936,12 +1072,17 @@ class Order(models.Model):
                     lineitem.line_item_price = baseprice * lineitem.quantity
                     log.debug('Adjusting lineitem unit price for %s. Full price=%s, discount=%s.  Final price for qty %d is %s',
                         lineitem.product.slug, baseprice, unitdiscount, lineitem.quantity, fullydiscounted)
-            if save:
-                lineitem.save()
+            lineitem.update_tax(processor=taxProcessor)
+            if [getattr(lineitem, field) for field in ORDERITEM_PRICE_FIELDS] != original:
+                changed.append(lineitem)
 
             itemprices.append(lineitem.sub_total)
             fullprices.append(lineitem.line_item_price)
 
+        if save and changed:
+            OrderItem.objects._update_prices(changed)
+        self.recalculated_items = items
+
         shipprice = Price()
         shipprice.price = self.shipping_cost
         shipadjust = PriceAdjustmentCalc(shipprice)
@@ -968,17 +1109,13 @@ class Order(models.Model):
 
         self.sub_total = full_sub_total
 
-        taxProcessor = get_tax_processor(self)
         totaltax, taxrates = taxProcessor.process()
         self.tax = totaltax
+        self.recalculated_taxes = [OrderTaxDetail(order=self, tax=taxamt, description=taxdesc, method=taxProcessor.method)
+            for taxdesc, taxamt in taxrates.items()]
 
-        # clear old taxes
-        for taxdetl in self.taxes.all():
-            taxdetl.delete()
-
-        for taxdesc, taxamt in taxrates.items():
-            taxdetl = OrderTaxDetail(order=self, tax=taxamt, description=taxdesc, method=taxProcessor.method)
-            taxdetl.save()
+        if save:
+            self._replace_taxes(self.recalculated_taxes)
 
         log.debug("Order #%i, recalc: sub_total=%s, shipping=%s, discount=%s, tax=%s",
             self.id,
@@ -992,6 +1129,19 @@ class Order(models.Model):
         if save:
             self.save()
 
+    def _replace_taxes(self, taxes):
+        """Replace the tax details of the order, unless they are unchanged."""
+        field = OrderTaxDetail._meta.get_field('tax')
+        def key(taxdetl):
+            return (taxdetl.description, taxdetl.method, field.get_db_prep_save(taxdetl.tax, connection=connection))
+
+        if sorted([key(taxdetl) for taxdetl in self.taxes.all()]) == sorted([key(taxdetl) for taxdetl in taxes]):
+            return
+
+        self.taxes.all().delete()
+        for taxdetl in taxes:
+            taxdetl.save()
+
     def shippinglabel(self):
         url = urlresolvers.reverse('satchmo_print_shipping', None, None, {'doc' : 'shippinglabel', 'id' : self.id})
         return mark_safe(u'<a href="%s">%s</a>' % (url, ugettext('View')))
@@ -1103,6 +1253,26 @@ class Order(models.Model):
         verbose_name = _("Product Order")
         verbose_name_plural = _("Product Orders")
 
+ORDERITEM_PRICE_FIELDS = ('unit_price', 'unit_tax', 'line_item_price', 'tax', 'discount')
+
+class OrderItemManager(models.Manager):
+
+    def _update_prices(self, items):
+        """Write the `ORDERITEM_PRICE_FIELDS` of several items with a single
+        bulk update, without going through `OrderItem.save`."""
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        fields = [opts.get_field(name) for name in ORDERITEM_PRICE_FIELDS]
+        update = 'UPDATE %s SET %s WHERE %s = %%s' % (qn(opts.db_table),
+            ', '.join(['%s = %%s' % qn(f.column) for f in fields]),
+            qn(opts.pk.column))
+        params = [[f.get_db_prep_save(getattr(item, f.attname), connection=connection) for f in fields] + [item.pk]
+            for item in items]
+
+        cursor = connection.cursor()
+        cursor.executemany(update, params)
+        transaction.commit_unless_managed()
+
 class OrderItem(models.Model):
     """
     A line item on an order.
@@ -1123,6 +1293,8 @@ class OrderItem(models.Model):
     discount = CurrencyField(_("Line item discount"),
         max_digits=18, decimal_places=10, blank=True, null=True)
 
+    objects = OrderItemManager()
+
     def __unicode__(self):
         return self.product.translated_name()
 
@@ -1137,6 +1309,8 @@ class OrderItem(models.Model):
 
     def _has_details(self):
         """Determine if this specific item has more detail"""
+        if hasattr(self, '_details_cache'):
+            return len(self._details_cache) > 0
         return (self.orderitemdetail_set.count() > 0)
 
     has_details = property(_has_details)
@@ -1144,10 +1318,13 @@ class OrderItem(models.Model):
     def get_detail_price(self):
         """Get the delta price based on detail modifications"""
         delta = Decimal("0.000000")
-        if self.has_details:
-            for detail in self.orderitemdetail_set.all():
-                if detail.price_change and detail.value:
-                    delta += detail.price_change
+        if hasattr(self, '_details_cache'):
+            details = self._details_cache
+        else:
+            details = self.orderitemdetail_set.all()
+        for detail in details:
+            if detail.price_change and detail.value:
+                delta += detail.price_change
         return delta
 
     def _sub_total(self):
@@ -1177,9 +1354,10 @@ class OrderItem(models.Model):
         self.update_tax()
         super(OrderItem, self).save(**kwargs)
 
-    def update_tax(self):
+    def update_tax(self, processor=None):
         taxclass = self.product.taxClass
-        processor = get_tax_processor(order=self.order)
+        if processor is None:
+            processor = get_tax_processor(order=self.order)
 
         if self.product.taxable:
             self.unit_tax = processor.by_price(taxclass, self.unit_price)
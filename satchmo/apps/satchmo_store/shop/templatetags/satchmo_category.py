@@ -1,40 +1,16 @@
-from django.core.cache import cache
-from django.contrib.sites.models import Site
 from django.template import Library, Node, Variable
 from django.template import TemplateSyntaxError, VariableDoesNotExist
 from product.models import Category
+from product.navigation import render_category_tree
 from satchmo_utils.templatetags import get_filter_args
-from django.utils.translation import get_language
 
 import logging
 import re
 
 log = logging.getLogger('shop.templatetags')
 
-try:
-    from xml.etree.ElementTree import Element, SubElement, tostring
-except ImportError:
-    from elementtree.ElementTree import Element, SubElement, tostring
-
 register = Library()
 
-def recurse_for_children(current_node, parent_node, active_cat, show_empty=True):
-    child_count = current_node.child.active().count()
-
-    if show_empty or child_count > 0 or current_node.product_set.count() > 0:
-        li_id = 'category-%s' % current_node.id
-        li_attrs = {'id': li_id }
-        temp_parent = SubElement(parent_node, 'li', li_attrs)
-        attrs = {'href': current_node.get_absolute_url()}
-        link = SubElement(temp_parent, 'a', attrs)
-        link.text = current_node.translated_name()
-
-        if child_count > 0:
-            new_parent = SubElement(temp_parent, 'ul')
-            children = current_node.child.active()
-            for child in children:
-                recurse_for_children(child, new_parent, active_cat)
-
 @register.simple_tag
 def category_tree(id=None):
     """
@@ -55,34 +31,9 @@ def category_tree(id=None):
                 </ul>
         </ul>
     """
-    active_cat = None
-    if id:
-        try:
-            active_cat = Category.objects.active().get(id=id)
-        except Category.DoesNotExist:
-            active_cat = None
-    # We call the category on every page so we will cache
-    # The actual structure to save db hits
-    lang = get_language()
-    current_site = Site.objects.get_current()
-    cache_key = "cat-%s-%s" % (current_site.id, lang)
-    existing_tree = cache.get(cache_key, None)
-    if existing_tree is None:
-        root = Element("ul")
-        for cats in Category.objects.root_categories():
-            recurse_for_children(cats, root, active_cat)
-        existing_tree = root
-        cache.set(cache_key, existing_tree)
-    # If we have an active cat, search through and identify it
-    # This search is less expensive than the multiple db calls
-    if active_cat:
-        active_cat_id = "category-%s" % active_cat.id
-        for li in existing_tree.getiterator("li"):
-            if li.attrib["id"] == active_cat_id:
-                link = li.find("a")
-                link.attrib["class"] = "current"
-                break
-    return tostring(existing_tree, 'utf-8')
+    # We call the category on every page, so the rendered tree is
+    # precomputed and cached per site, language and active category
+    return render_category_tree(current_id=id)
 
 class CategoryListNode(Node):
     """Template Node tag which pushes the category list into the context"""
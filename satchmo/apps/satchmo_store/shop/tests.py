@@ -6,14 +6,13 @@ from django.core.urlresolvers import reverse as url
 from django.test import TestCase
 from django.test.client import Client
 from django.utils.encoding import smart_str
-from django.utils.translation import get_language
-from django.core.cache import cache
 from keyedcache import cache_delete
 from l10n.models import Country
 from l10n.utils import moneyfmt
 from livesettings import config_get
 from payment import active_gateways
 from product.models import Product
+from product.navigation import invalidate_category_tree
 from product.utils import rebuild_pricing, find_auto_discounts
 from satchmo_store.contact import CUSTOMER_ID
 from satchmo_store.contact.models import *
@@ -69,8 +68,7 @@ class ShopTest(TestCase):
         self.US = Country.objects.get(iso2_code__iexact = "US")
         rebuild_pricing()
         current_site = Site.objects.get_current()
-        cache_key = "cat-%s-%s" % (current_site.id, get_language())
-        cache.delete(cache_key)
+        invalidate_category_tree(current_site.id)
 
     def tearDown(self):
         cache_delete()
@@ -619,6 +617,39 @@ class CartTest(TestCase):
         self.assertEqual(item2.unit_price, Decimal("23.00"))
         self.assertEqual(cart.total, Decimal("43.00"))
 
+    def test_cached_totals(self):
+        sb = Product.objects.get(slug__iexact='dj-rocks-s-b')
+        lb = Product.objects.get(slug__iexact='dj-rocks-l-bl')
+
+        cart = Cart(site=Site.objects.get_current())
+        cart.save()
+        cart.add_item(sb, 2)
+        cart.add_item(lb, 1, details=[{'name': 'note', 'value': 'gift',
+            'sort_order': 1, 'price_change': Decimal("1.50")}])
+        self.assertEqual(cart.numItems, 3)
+        self.assertEqual(cart.total, Decimal("64.50"))
+        self.assertEqual([item.line_total for item in cart], [Decimal("40.00"), Decimal("24.50")])
+
+        # changing an item through the cart drops the cached prices
+        item = list(cart)[0]
+        item.quantity = Decimal('1')
+        item.save()
+        self.assertEqual(cart.numItems, 2)
+        self.assertEqual(cart.total, Decimal("44.50"))
+
+        cart.remove_item(item.id, 1)
+        self.assertEqual(len(cart), 1)
+        self.assertEqual(cart.total, Decimal("24.50"))
+
+        # and so does changing it through another copy of the cart
+        other = CartItem.objects.get(pk=list(cart)[0].pk)
+        other.quantity = Decimal('2')
+        other.save()
+        self.assertEqual(cart.numItems, 2)
+        self.assertEqual(cart.total, Decimal("49.00"))
+        other.delete()
+        self.assertEqual(len(cart), 0)
+
 class ConfigTest(TestCase):
     fixtures = ['l10n-data.yaml', 'sample-store-data.yaml', 'test-config.yaml']
 
@@ -803,6 +834,25 @@ class DiscountAmountTest(TestCase):
         self.assertEqual(discount, Decimal('12.00'))
 
 
+    def testDryRun(self):
+        """Check that recalculating without saving writes nothing."""
+        self.order.discount_code="test10"
+        self.order.recalculate_total(save=False)
+        self.assertEqual(self.order.discount, Decimal('10.00'))
+        discounts = [item.discount for item in self.order.recalculated_items]
+        self.assertEqual(sum(discounts), Decimal('10.00'))
+
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual(order.discount_code, None)
+        self.assertEqual([item.discount for item in order.orderitem_set.all()], [None, None])
+        self.assertEqual(order.taxes.count(), 0)
+
+        self.order.recalculate_total(save=True)
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual(order.total, Decimal('7.00'))
+        self.assertEqual(order.discount, Decimal('10.00'))
+        self.assertEqual([item.discount for item in order.orderitem_set.all()], discounts)
+
     def testApplyPercentSimple(self):
         self.order.discount_code="test20"
         self.order.recalculate_total(save=False)
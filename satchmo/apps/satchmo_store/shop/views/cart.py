@@ -115,7 +115,7 @@ def display(request, cart=None, error_message='', default_view_tax=None):
         cart = Cart.objects.from_request(request)
 
     if cart.numItems > 0:
-        products = [item.product for item in cart.cartitem_set.all()]
+        products = [item.product for item in cart]
         sale = find_best_auto_discount(products)
     else:
         sale = None
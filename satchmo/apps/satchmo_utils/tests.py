@@ -1,7 +1,23 @@
 from decimal import Decimal
 from django.test import TestCase
+from django.conf import settings
+from django.contrib.sites.models import Site
+from livesettings import config_get, config_value
+from satchmo_store.shop.satchmo_settings import get_satchmo_setting, set_satchmo_setting
 from satchmo_utils.numbers import round_decimal, trunc_decimal
-from satchmo_utils.unique_id import slugify
+from satchmo_utils.thumbnail.bulk import generate_thumbnails, lookup_manifest, write_manifest
+from satchmo_utils.thumbnail.service import image_size, thumbnail_url, workers
+from satchmo_utils.thumbnail.utils import get_image_info, get_image_size, make_thumbnail
+from satchmo_utils.unique_id import SlugAllocator, slugify
+import keyedcache
+import os
+import shutil
+import tempfile
+
+try:
+    import Image
+except ImportError:
+    from PIL import Image
 
 class TestRoundedDecimals(TestCase):
 
@@ -80,3 +96,138 @@ class TestSlugify(TestCase):
         self.assertEqual(val, '')
         # arguments instance, slug_field and filter_dict can be better tested in 'product' tests
 
+    def testAllocator(self):
+        from product.models import Category
+        site = Site.objects.get_current()
+        Category.objects.create(name='T-shirt', slug='t-shirt', site=site)
+        Category.objects.create(name='T-shirt', slug='t-shirt-1', site=site)
+        self.assertEqual(slugify('T-shirt', instance=Category(site=site)), 't-shirt-2')
+        self.assertEqual(slugify('Tie', instance=Category(site=site)), 'tie')
+
+        # a batch reserves its slugs until it is released
+        batch = SlugAllocator(Category)
+        batch.prefetch(['t-shirt', 'tie'])
+        self.assert_(batch._fetched('t-shirt-5'))
+        self.assert_(not batch._fetched('hat'))
+        self.assertEqual([batch.allocate('t-shirt'), batch.allocate('t-shirt'), batch.allocate('tie')],
+            ['t-shirt-2', 't-shirt-3', 'tie'])
+        other = SlugAllocator(Category)
+        self.assertEqual(other.allocate('t-shirt'), 't-shirt-4')
+        self.assertEqual(slugify('Tie', instance=Category(site=site)), 'tie-1')
+        other.release()
+        batch.release()
+        self.assertEqual(slugify('T-shirt', instance=Category(site=site)), 't-shirt-2')
+
+
+class TestThumbnails(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        Image.new('RGB', (40, 20)).save(os.path.join(self.root, 'photo.jpg'))
+        self.path = os.path.join(self.root, 'photo.jpg')
+        # read in this thread, the workers get it from the cache
+        config_value('THUMBNAIL', 'IMAGE_QUALITY')
+
+    def tearDown(self):
+        config_get('THUMBNAIL', 'ASYNC').update(False)
+        shutil.rmtree(self.root)
+        keyedcache.cache_delete()
+
+    def testIndex(self):
+        url = make_thumbnail('/media/photo.jpg', width=10, root=self.root, url_root='/media/')
+        self.assertEqual(url, '/media/photo_t10.jpg')
+        self.assertEqual(Image.open(os.path.join(self.root, 'photo_t10.jpg')).size, (10, 5))
+        info = get_image_info(self.path)
+        self.assertEqual(info['size'], (40, 20))
+        self.assertEqual(info['thumbnails'], {(10, None): 'photo_t10.jpg'})
+
+        # the size comes from the index
+        os.utime(self.path, (info['mtime'], info['mtime']))
+        self.assertEqual(get_image_size('/media/photo.jpg', root=self.root, url_root='/media/'), (40, 20))
+
+    def testAsync(self):
+        config_get('THUMBNAIL', 'ASYNC').update(True)
+        self.assertEqual(image_size('/media/photo.jpg', root=self.root, url_root='/media/'), (None, None))
+        url = thumbnail_url('/media/photo.jpg', height=10, root=self.root, url_root='/media/')
+        # unless the thumbnail was generated in the meantime
+        self.assert_(url in ('/media/photo.jpg', '/media/photo_t_h10.jpg'))
+
+        workers.join()
+        self.assert_(os.path.isfile(os.path.join(self.root, 'photo_t_h10.jpg')))
+        self.assertEqual(image_size('/media/photo.jpg', root=self.root, url_root='/media/'), (40, 20))
+        url = thumbnail_url('/media/photo.jpg', height=10, root=self.root, url_root='/media/')
+        self.assertEqual(url, '/media/photo_t_h10.jpg')
+        url = thumbnail_url('photo.jpg', height=10, root=self.root, url_root='/media/')
+        self.assertEqual(url, 'photo_t_h10.jpg')
+
+    def testAsyncChanged(self):
+        config_get('THUMBNAIL', 'ASYNC').update(True)
+        image_size('/media/photo.jpg', root=self.root, url_root='/media/')
+        thumbnail_url('/media/photo.jpg', height=10, root=self.root, url_root='/media/')
+        workers.join()
+        self.assertEqual(image_size('/media/photo.jpg', root=self.root, url_root='/media/'), (40, 20))
+
+        # the index isn't trusted once the image file changed
+        Image.new('RGB', (20, 40)).save(self.path)
+        mtime = get_image_info(self.path)['mtime'] + 10
+        os.utime(self.path, (mtime, mtime))
+        self.assertEqual(image_size('/media/photo.jpg', root=self.root, url_root='/media/'), (None, None))
+        url = thumbnail_url('/media/photo.jpg', height=10, root=self.root, url_root='/media/')
+        self.assert_(url in ('/media/photo.jpg', '/media/photo_t_h10.jpg'))
+        workers.join()
+        self.assertEqual(image_size('/media/photo.jpg', root=self.root, url_root='/media/'), (20, 40))
+        self.assertEqual(Image.open(os.path.join(self.root, 'photo_t_h10.jpg')).size, (5, 10))
+
+    def testPregenerateChanged(self):
+        from product.models import CategoryImage
+        from satchmo_utils.thumbnail import field as field_module
+        queued = []
+        old_pregenerate = field_module.pregenerate_thumbnails
+        field_module.pregenerate_thumbnails = queued.append
+        try:
+            image = CategoryImage(picture='images/photo.jpg')
+            field = image._meta.get_field('picture')
+            # saving the object again doesn't pregenerate the thumbnails
+            field._pregenerate_thumbnails(image)
+            self.assertEqual(queued, [])
+            image.picture = 'images/other.jpg'
+            field._pregenerate_thumbnails(image)
+            field._pregenerate_thumbnails(image)
+            self.assertEqual(queued, ['images/other.jpg'])
+        finally:
+            field_module.pregenerate_thumbnails = old_pregenerate
+
+    def testManifest(self):
+        old_path = get_satchmo_setting('THUMBNAIL_MANIFEST')
+        set_satchmo_setting('THUMBNAIL_MANIFEST', os.path.join(self.root, 'manifest.json'))
+        folder = tempfile.mkdtemp(dir=settings.MEDIA_ROOT)
+        try:
+            name = os.path.join(os.path.basename(folder), 'photo.jpg')
+            Image.new('RGB', (40, 20)).save(os.path.join(folder, 'photo.jpg'))
+            sizes = [(10, None), (40, 20)]
+            result = generate_thumbnails((name, sizes))
+            self.assertEqual(result[0], name)
+            self.assertEqual(result[1]['thumbnails'], {'10x': name.replace('.jpg', '_t10.jpg'), '40x20': None})
+            self.assertEqual(result[1]['mtime'], os.path.getmtime(os.path.join(folder, 'photo.jpg')))
+            self.assertEqual(result[2], 1)
+            # fresh thumbnails are kept
+            self.assertEqual(generate_thumbnails((name, sizes))[2], 0)
+            self.assertEqual(generate_thumbnails(('missing.jpg', sizes)), ('missing.jpg', None, 0))
+
+            write_manifest({name: result[1]})
+            os.remove(os.path.join(folder, 'photo_t10.jpg'))
+            self.assertEqual(lookup_manifest(settings.MEDIA_URL + name, 10, None),
+                (True, settings.MEDIA_URL + name.replace('.jpg', '_t10.jpg')))
+            self.assertEqual(lookup_manifest(name, 40, 20), (True, None))
+            self.assertEqual(lookup_manifest(name, 20, None), (False, None))
+            # the manifest is trusted without checking the files
+            self.assertEqual(thumbnail_url(name, width=10), name.replace('.jpg', '_t10.jpg'))
+
+            # but not for an image uploaded again under the same name
+            Image.new('RGB', (60, 30)).save(os.path.join(folder, 'photo.jpg'))
+            mtime = result[1]['mtime'] + 10
+            os.utime(os.path.join(folder, 'photo.jpg'), (mtime, mtime))
+            self.assertEqual(lookup_manifest(name, 10, None), (False, None))
+            self.assertEqual(lookup_manifest(name, 40, 20), (False, None))
+        finally:
+            set_satchmo_setting('THUMBNAIL_MANIFEST', old_path)
+            shutil.rmtree(folder)
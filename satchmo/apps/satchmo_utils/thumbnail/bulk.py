@@ -0,0 +1,169 @@
+"""
+Generates the thumbnails of all the images of the store ahead of time, such
+as before a catalog launch, with a pool of processes. See the
+`satchmo_make_thumbnails` command.
+
+The thumbnails generated can be saved to a manifest, the file named by the
+`THUMBNAIL_MANIFEST` satchmo setting::
+
+    SATCHMO_SETTINGS = {
+        ...
+        'THUMBNAIL_MANIFEST': '/var/lib/satchmo/thumbnails.json',
+    }
+
+The thumbnail filters look the thumbnails up in the manifest before anything
+else, so that the thumbnails it lists are shown without checking their files.
+The manifest keeps the modification time of each image, and an image uploaded
+again since is looked up as usual. Each process loads the file once, and
+again when it is replaced.
+"""
+from django.conf import settings
+from django.db import models
+from django.utils import simplejson
+from satchmo_store.shop.satchmo_settings import get_satchmo_setting
+from satchmo_utils.thumbnail.utils import _get_path_from_url, _get_thumbnail_path, make_thumbnail
+import logging
+import os
+import time
+
+log = logging.getLogger('satchmo_utils.thumbnail.bulk')
+
+# how often a process checks whether the manifest was replaced, in seconds
+CHECK_INTERVAL = 60
+
+def image_fields():
+    """Get the (model, field name) of the image fields with thumbnails of
+    the installed models."""
+    from satchmo_utils.thumbnail.field import ImageWithThumbnailField
+    fields = []
+    for model in models.get_models():
+        for field in model._meta.fields:
+            if isinstance(field, ImageWithThumbnailField):
+                fields.append((model, field.name))
+    return fields
+
+def image_names():
+    """Get the names of all the images with thumbnails, sorted."""
+    names = set()
+    for model, name in image_fields():
+        names.update(model._default_manager.values_list(name, flat=True).distinct().iterator())
+    names.discard(None)
+    names.discard('')
+    names = list(names)
+    names.sort()
+    return names
+
+def size_key(width, height):
+    """The key of a thumbnail size in the manifest, such as '85x' or '85x85'."""
+    return '%sx%s' % (width or '', height or '')
+
+def generate_thumbnails(task):
+    """Generate the missing or stale thumbnails of an image, in a worker
+    process.
+
+    `task` is the name of the image, relative to the media root, and the
+    list of sizes to generate. Returns the name, the entry of the image in
+    the manifest, {'mtime': modification time of the image, 'thumbnails':
+    {size key: thumbnail name}}, or None if the image file is missing, and
+    how many thumbnails were generated.
+    """
+    name, sizes = task
+    photo_path = _get_path_from_url(name)
+    try:
+        mtime = os.path.getmtime(photo_path)
+    except OSError:
+        return name, None, 0
+
+    thumbnails = {}
+    generated = 0
+    for width, height in sizes:
+        th_path = _get_path_from_url(_get_thumbnail_path(name, width, height))
+        try:
+            fresh = os.path.getmtime(th_path) >= mtime
+        except OSError:
+            fresh = False
+        th_name = make_thumbnail(name, width, height)
+        if th_name == name:
+            # the thumbnail couldn't be generated
+            continue
+        if not fresh and th_name is not None:
+            generated += 1
+        thumbnails[size_key(width, height)] = th_name
+    return name, {'mtime': mtime, 'thumbnails': thumbnails}, generated
+
+def get_manifest_path():
+    return get_satchmo_setting('THUMBNAIL_MANIFEST', None)
+
+def write_manifest(images):
+    """Save the thumbnails, a dictionary of {image name: entry} with the
+    entries returned by `generate_thumbnails`, to the manifest for all the
+    processes to use."""
+    path = get_manifest_path()
+    manifest = {'root': settings.MEDIA_ROOT, 'images': images}
+    # write it next to its final place, so that readers never see half a file
+    work = '%s.%i' % (path, os.getpid())
+    out = open(work, 'wb')
+    try:
+        simplejson.dump(manifest, out)
+    finally:
+        out.close()
+    os.rename(work, path)
+    _loaded.update({'manifest': manifest, 'mtime': os.path.getmtime(path), 'checked': time.time()})
+
+# the manifest loaded by this process
+_loaded = {'manifest': None, 'mtime': None, 'checked': 0}
+
+def _load(path):
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        _loaded.update({'manifest': None, 'mtime': None})
+        return
+    if mtime != _loaded['mtime']:
+        manifest = None
+        try:
+            infile = open(path, 'rb')
+            try:
+                manifest = simplejson.load(infile)
+            finally:
+                infile.close()
+        except Exception, e:
+            log.error('Could not load the thumbnail manifest from %s: %s', path, e)
+        _loaded.update({'manifest': manifest, 'mtime': mtime})
+
+def lookup_manifest(photo_url, width, height, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
+    """Look up a thumbnail in the manifest, returns whether it is there, and
+    its url. The thumbnails of an image changed since the manifest was
+    written aren't there."""
+    path = get_manifest_path()
+    if not path:
+        return False, None
+
+    now = time.time()
+    if now - _loaded['checked'] > CHECK_INTERVAL:
+        _loaded['checked'] = now
+        _load(path)
+
+    manifest = _loaded['manifest']
+    if manifest is None or manifest['root'] != root:
+        return False, None
+
+    name = photo_url
+    if name.startswith(url_root):
+        name = name[len(url_root):]
+    entry = manifest['images'].get(name, None)
+    if not isinstance(entry, dict) or 'mtime' not in entry:
+        return False, None
+    thumbnails = entry['thumbnails']
+    key = size_key(width, height)
+    if key not in thumbnails:
+        return False, None
+    try:
+        if os.path.getmtime(_get_path_from_url(photo_url, root, url_root)) != entry['mtime']:
+            return False, None
+    except OSError:
+        return False, None
+    th_url = thumbnails[key]
+    if th_url is not None and photo_url.startswith(url_root):
+        th_url = url_root + th_url
+    return True, th_url
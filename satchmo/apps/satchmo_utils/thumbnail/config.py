@@ -1,4 +1,4 @@
-from livesettings import ConfigurationGroup, config_register_list, IntegerValue, BooleanValue
+from livesettings import ConfigurationGroup, config_register_list, IntegerValue, BooleanValue, StringValue
 from django.utils.translation import ugettext_lazy as _
 
 THUMB_GROUP = ConfigurationGroup('THUMBNAIL', _('Thumbnail Settings'))
@@ -15,5 +15,23 @@ config_register_list(
         'RENAME_IMAGES',
         description=_("Rename product images?"),
         help_text=_("Automatically rename product images on upload?"),
-        default=True)
+        default=True),
+
+    BooleanValue(THUMB_GROUP,
+        'ASYNC',
+        description=_("Generate thumbnails in the background?"),
+        help_text=_("Pages show the original image until its thumbnail is generated, instead of waiting for it."),
+        default=False),
+
+    IntegerValue(THUMB_GROUP,
+        'THREADS',
+        description=_("Thumbnail threads"),
+        help_text=_("How many thumbnails each process may generate at the same time in the background."),
+        default=2),
+
+    StringValue(THUMB_GROUP,
+        'PREGENERATE_SIZES',
+        description=_("Thumbnails generated on upload"),
+        help_text=_("The sizes of the thumbnails to generate in the background when an image is uploaded, as in the thumbnail filter and separated by semicolons, such as \"width=85;width=120\". Leave empty to only generate them when they are shown."),
+        default="width=85;width=120")
 )
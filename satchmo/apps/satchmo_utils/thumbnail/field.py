@@ -1,6 +1,7 @@
 from django.db.models import signals
 from django.db.models.fields.files import ImageField
 from livesettings import config_value, SettingNotSet
+from satchmo_utils.thumbnail.service import pregenerate_thumbnails
 from satchmo_utils.thumbnail.utils import remove_file_thumbnails, rename_by_field
 from satchmo_utils import normalize_dir
 import logging
@@ -82,6 +83,26 @@ class ImageWithThumbnailField(ImageField):
             instance.save()
             self._renaming = False
 
+    def _saved_name_attname(self):
+        return '_%s_saved_name' % self.attname
+
+    def _remember_name(self, instance, **kwargs):
+        image = getattr(instance, self.attname)
+        setattr(instance, self._saved_name_attname(), image and image.name or None)
+
+    def _pregenerate_thumbnails(self, instance, **kwargs):
+        if getattr(self, '_renaming', False):
+            # the thumbnails are made for the renamed image
+            return
+        image = getattr(instance, self.attname)
+        name = image and image.name or None
+        if name == getattr(instance, self._saved_name_attname(), None):
+            # the same file is saved again with the rest of the object
+            return
+        setattr(instance, self._saved_name_attname(), name)
+        if name:
+            pregenerate_thumbnails(name)
+
     def _delete_thumbnail(self, sender, instance=None, **kwargs):
         image = getattr(instance, self.attname)
         if hasattr(image, 'path'):
@@ -91,6 +112,8 @@ class ImageWithThumbnailField(ImageField):
         super(ImageWithThumbnailField, self).contribute_to_class(cls, name)
         signals.pre_delete.connect(self._delete_thumbnail, sender=cls)
         signals.post_save.connect(self._save_rename, sender=cls)
+        signals.post_init.connect(self._remember_name, sender=cls)
+        signals.post_save.connect(self._pregenerate_thumbnails, sender=cls)
 
 try:
     # South introspection rules for our custom field.
@@ -0,0 +1,112 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import simplejson
+from livesettings import config_value
+from optparse import make_option
+from satchmo_utils.thumbnail.bulk import generate_thumbnails, get_manifest_path, image_names, write_manifest
+from satchmo_utils.thumbnail.service import parse_sizes
+import multiprocessing
+import os
+import time
+
+class Command(BaseCommand):
+    '''Generate the missing or stale thumbnails of all the product, category
+    and brand images, such as before a catalog launch.
+
+    With --progress, the images done are written to a file as they are, and
+    skipped when the command is run again with the same file, so that an
+    interrupted run can be resumed. Remove the file to start again.'''
+
+    help = "Generates the thumbnails of all the images with a pool of processes."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', dest='processes', default=None,
+            help='How many processes generate the thumbnails, the number of CPUs by default.'),
+        make_option('--sizes', dest='sizes', default=None,
+            help='The sizes to generate, such as "width=85;width=120", the THUMBNAIL PREGENERATE_SIZES setting by default.'),
+        make_option('--progress', dest='progress', default=None,
+            help='A file to resume from, and to write the images done to.'),
+        make_option('--manifest', action='store_true', dest='manifest', default=False,
+            help='Save the thumbnails to the manifest named by the THUMBNAIL_MANIFEST satchmo setting.'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        manifest = options.get('manifest', False)
+        if manifest and not get_manifest_path():
+            raise CommandError("The THUMBNAIL_MANIFEST satchmo setting is not set")
+
+        try:
+            sizes = parse_sizes(options.get('sizes') or config_value('THUMBNAIL', 'PREGENERATE_SIZES'))
+        except ValueError:
+            raise CommandError("Invalid sizes")
+        if not sizes:
+            raise CommandError("No thumbnail sizes to generate")
+
+        thumbnails = {}
+        progress = options.get('progress')
+        if progress and os.path.isfile(progress):
+            for line in open(progress):
+                if line.strip():
+                    name, done = simplejson.loads(line)
+                    thumbnails[name] = done
+            if verbosity > 0:
+                print "Resuming after %i images" % len(thumbnails)
+
+        names = image_names()
+        tasks = [(name, sizes) for name in names if name not in thumbnails]
+        total = len(tasks)
+        if verbosity > 0:
+            print "Generating %i sizes of thumbnails for %i images" % (len(sizes), total)
+
+        processes = options.get('processes') or multiprocessing.cpu_count()
+        if processes > 1:
+            # each process opens its own connection
+            connection.close()
+            pool = multiprocessing.Pool(processes)
+            results = pool.imap_unordered(generate_thumbnails, tasks, 10)
+        else:
+            pool = None
+            results = (generate_thumbnails(task) for task in tasks)
+
+        out = progress and open(progress, 'a') or None
+        start = time.time()
+        done = generated = missing = 0
+        try:
+            for name, done_thumbnails, count in results:
+                done += 1
+                generated += count
+                if done_thumbnails is None:
+                    missing += 1
+                else:
+                    thumbnails[name] = done_thumbnails
+                if out:
+                    out.write(simplejson.dumps([name, done_thumbnails]) + '\n')
+                    out.flush()
+                if verbosity > 1 and done % 100 == 0:
+                    elapsed = time.time() - start
+                    print "%i/%i images, %i thumbnails generated (%.1f images/sec)" % (
+                        done, total, generated, done / max(elapsed, 0.001))
+            if pool:
+                pool.close()
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+            if out:
+                out.close()
+
+        elapsed = time.time() - start
+        if verbosity > 0:
+            print "Generated %i thumbnails for %i images in %.2f seconds (%.1f images/sec)" % (
+                generated, done, elapsed, done / max(elapsed, 0.001))
+            if missing:
+                print "Warning: %i image files are missing" % missing
+
+        if manifest:
+            # the missing images of an earlier run are left out
+            images = dict([(name, done_thumbnails) for name, done_thumbnails in thumbnails.items()
+                if done_thumbnails is not None])
+            write_manifest(images)
+            if verbosity > 0:
+                print "Saved %i images to the manifest" % len(images)
@@ -0,0 +1,188 @@
+"""
+Generates the thumbnails in the background, so that showing an image never
+waits for PIL.
+
+What is known of the images, their size and the urls of their thumbnails,
+is kept in the image index of `satchmo_utils.thumbnail.utils`, shared by all
+the processes through the cache. With the THUMBNAIL ASYNC setting, a
+thumbnail which isn't in the index yet is queued for the worker threads of
+the process, and the page shows the original image meanwhile.
+
+The sizes of the THUMBNAIL PREGENERATE_SIZES setting are queued when an
+image is uploaded, so that they are usually ready before the image is shown.
+The thumbnails generated ahead of time by `satchmo_make_thumbnails` are
+looked up in its manifest first.
+"""
+from django.conf import settings
+from django.db import connection
+from livesettings import config_value
+from satchmo_utils.thumbnail.bulk import lookup_manifest
+from satchmo_utils.thumbnail.utils import (
+    _get_path_from_url,
+    _get_thumbnail_path,
+    _has_thumbnail,
+    forget_image,
+    get_current_image_info,
+    get_image_size,
+    make_thumbnail,
+)
+from threaded_multihost import threadlocals
+import logging
+import os
+import Queue
+import threading
+
+#ensure config is loaded
+import satchmo_utils.thumbnail.config
+
+log = logging.getLogger('satchmo_utils.thumbnail.service')
+
+class ThumbnailWorkers(object):
+    """A queue of thumbnails to generate, and the threads generating them.
+    A task queued again before it runs is only run once."""
+
+    def __init__(self):
+        self.tasks = Queue.Queue()
+        self.pending = set()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def put(self, func, *args):
+        task = (func, args)
+        self.lock.acquire()
+        try:
+            if task in self.pending:
+                return False
+            self.pending.add(task)
+            self.tasks.put((task, self._thread_variables()))
+            self._start()
+        finally:
+            self.lock.release()
+        return True
+
+    def join(self):
+        """Wait for the queued thumbnails to be generated."""
+        self.tasks.join()
+
+    def _thread_variables(self):
+        # the tasks run for the site of the request which queued them
+        variables = {}
+        for key in ('request', 'user'):
+            value = threadlocals.get_thread_variable(key, None)
+            if value is not None:
+                variables[key] = value
+        return variables
+
+    def _start(self):
+        self.threads = [thread for thread in self.threads if thread.isAlive()]
+        count = max(1, config_value('THUMBNAIL', 'THREADS'))
+        while len(self.threads) < count and len(self.threads) < len(self.pending):
+            thread = threading.Thread(target=self._run)
+            # the queue is lost with the process, and generated again on demand
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _run(self):
+        while True:
+            task, variables = self.tasks.get()
+            func, args = task
+            try:
+                for key, value in variables.items():
+                    threadlocals.set_thread_variable(key, value)
+                try:
+                    func(*args)
+                except Exception, e:
+                    log.error('Could not run thumbnail task %s%r: %s', func.__name__, args, e)
+            finally:
+                connection.close()
+                self.lock.acquire()
+                try:
+                    self.pending.discard(task)
+                finally:
+                    self.lock.release()
+                self.tasks.task_done()
+
+workers = ThumbnailWorkers()
+
+def thumbnail_url(photo_url, width=None, height=None, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
+    """ return the url of a thumbnail of photo_url, as make_thumbnail does.
+
+        with the THUMBNAIL ASYNC setting, a thumbnail which isn't in the
+        image index is generated in the background, and the url of the
+        original image is returned until it is ready.
+    """
+
+    # one of width/height is required
+    assert (width is not None) or (height is not None)
+
+    if not photo_url: return None
+
+    found, th_url = lookup_manifest(photo_url, width, height, root, url_root)
+    if found:
+        return th_url
+
+    if not config_value('THUMBNAIL', 'ASYNC'):
+        return make_thumbnail(photo_url, width, height, root, url_root)
+
+    info = get_current_image_info(_get_path_from_url(photo_url, root, url_root))
+    if info is not None and (width, height) in info['thumbnails']:
+        th_url = info['thumbnails'][(width, height)]
+        if th_url is not None and photo_url.startswith(url_root):
+            th_url = url_root + th_url
+        return th_url
+
+    workers.put(make_thumbnail, photo_url, width, height, root, url_root)
+    if _has_thumbnail(photo_url, width, height, root, url_root):
+        return _get_thumbnail_path(photo_url, width, height)
+    return photo_url
+
+def image_size(photo_url, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
+    """ return the size of an image, as get_image_size does.
+
+        with the THUMBNAIL ASYNC setting, the size of an image which isn't in
+        the image index is read in the background, and (None, None) returned
+        until it is.
+    """
+    if not config_value('THUMBNAIL', 'ASYNC'):
+        return get_image_size(photo_url, root, url_root)
+
+    info = get_current_image_info(_get_path_from_url(photo_url, root, url_root))
+    if info is not None and info['size'] is not None:
+        return info['size']
+
+    workers.put(get_image_size, photo_url, root, url_root)
+    return None, None
+
+def parse_sizes(value):
+    """ parse sizes such as "width=85;width=120,height=120", returns a list
+        of (width, height).
+    """
+    sizes = []
+    for size in value.split(';'):
+        kwargs = {}
+        for arg in size.split(','):
+            arg = arg.strip()
+            if not arg: continue
+            kw, val = arg.split('=', 1)
+            kwargs[kw.strip().lower()] = int(val)
+        if kwargs:
+            sizes.append((kwargs.get('width', None), kwargs.get('height', None)))
+    return sizes
+
+def pregenerate_thumbnails(photo_url, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
+    """ queue the thumbnails of the THUMBNAIL PREGENERATE_SIZES setting for
+        an uploaded image, whose previous thumbnails are forgotten.
+    """
+    path = _get_path_from_url(photo_url, root, url_root)
+    if not os.path.isfile(path):
+        return
+    forget_image(path)
+
+    try:
+        sizes = parse_sizes(config_value('THUMBNAIL', 'PREGENERATE_SIZES'))
+    except ValueError:
+        log.warn('Invalid THUMBNAIL PREGENERATE_SIZES setting')
+        return
+    for width, height in sizes:
+        workers.put(make_thumbnail, photo_url, width, height, root, url_root)
@@ -6,7 +6,7 @@
 from django import template
 from django.conf import settings
 from django.template import TemplateSyntaxError
-from satchmo_utils.thumbnail.utils import make_thumbnail, get_image_size
+from satchmo_utils.thumbnail.service import image_size, thumbnail_url
 register = template.Library()
 ##################################################
 ## FILTERS ##
@@ -16,6 +16,8 @@ def thumbnail(url, args=''):
 
 .. note:: requires PIL_,
     if PIL_ is not found or thumbnail can not be created returns original URL.
+    With the THUMBNAIL ASYNC setting, the original URL is also returned
+    while the thumbnail is generated in the background.
 
 .. _PIL: http://www.pythonware.com/products/pil/
 
@@ -65,7 +67,7 @@ or if only a width is requested (to be compatibile with admin interface)::
     if ('width' not in kwargs) and ('height' not in kwargs):
         raise template.TemplateSyntaxError, "thumbnail filter requires arguments (width and/or height)"
     
-    ret = make_thumbnail(url, **kwargs)
+    ret = thumbnail_url(url, **kwargs)
     if ret is None:
         ret = url
 
@@ -84,7 +86,7 @@ Usage:
     {{ url|image_width }}
 """
     
-    width, height = get_image_size(url)
+    width, height = image_size(url)
     return width
 #
 
@@ -97,7 +99,7 @@ Usage:
     {{ url|image_width }}
 """
     
-    width, height = get_image_size(url)
+    width, height = image_size(url)
     return height
 #
 
@@ -1,6 +1,7 @@
 from django.conf import settings
-from django.core.cache import get_cache
 from django.db.models.fields.files import ImageField
+from django.utils.encoding import smart_str
+from keyedcache import cache_delete, cache_get, cache_key, cache_set, NotCachedError
 from livesettings import config_value
 from satchmo_utils.thumbnail.text import URLify
 
@@ -18,13 +19,67 @@ try:
 except ImportError:
     from PIL import Image
 
-log = logging.getLogger('satchmo_utils.thumbnail')
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
 
-image_cache = get_cache('locmem:///')
+log = logging.getLogger('satchmo_utils.thumbnail')
 
-_FILE_CACHE_TIMEOUT = 60 * 60 * 60 * 24 * 31 # 1 month
+# memcached takes anything longer than 30 days for a timestamp
+_FILE_CACHE_TIMEOUT = 60 * 60 * 24 * 30 # 1 month
 _THUMBNAIL_GLOB = '%s_t*%s'
 
+def _index_key(path):
+    return cache_key('THUMBNAIL_INDEX', md5(smart_str(path)).hexdigest())
+
+def get_image_info(path):
+    """ get what the image index knows of the image file at path, shared by
+        all the processes through the cache.
+
+        returns a dictionary of the 'mtime' of the file, its 'size' if known,
+        and its 'thumbnails', the urls of its thumbnails by (width, height),
+        or None.
+    """
+    try:
+        return cache_get(_index_key(path))
+    except NotCachedError:
+        return None
+
+def get_current_image_info(path):
+    """ get the index entry of the image file at path as get_image_info does,
+        or None if the file changed since it was indexed.
+    """
+    info = get_image_info(path)
+    if info is not None:
+        try:
+            if os.path.getmtime(path) == info['mtime']:
+                return info
+        except OSError:
+            pass
+    return None
+
+def _update_image_info(path, **values):
+    """ update the index entry of an image, which is started again when the
+        image file changed.
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return
+    info = get_image_info(path)
+    if info is None or info['mtime'] != mtime:
+        info = {'mtime' : mtime, 'size' : None, 'thumbnails' : {}}
+    thumbnail = values.pop('thumbnail', None)
+    if thumbnail is not None:
+        info['thumbnails'][thumbnail[0]] = thumbnail[1]
+    info.update(values)
+    cache_set(_index_key(path), value=info, length=_FILE_CACHE_TIMEOUT)
+
+def forget_image(path):
+    """ remove an image file from the index """
+    cache_delete(_index_key(path))
+
 def _get_thumbnail_path(path, width=None, height=None):
     """ create thumbnail path from path and required width and/or height.
 
@@ -76,7 +131,7 @@ def _has_thumbnail(photo_url, width=None, height=None, root=settings.MEDIA_ROOT,
     return os.path.isfile(_get_path_from_url(_get_thumbnail_path(photo_url, width, height), root, url_root))
 
 def make_thumbnail(photo_url, width=None, height=None, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
-    """ create thumbnail """
+    """ create thumbnail, and add it to the image index """
 
     # one of width/height is required
     assert (width is not None) or (height is not None)
@@ -91,7 +146,7 @@ def make_thumbnail(photo_url, width=None, height=None, root=settings.MEDIA_ROOT,
         # thumbnail already exists
         if not (os.path.getmtime(photo_path) > os.path.getmtime(th_path)):
             # if photo mtime is newer than thumbnail recreate thumbnail
-            return th_url
+            return _indexed(photo_path, width, height, th_url, url_root)
 
     # make thumbnail
 
@@ -105,17 +160,17 @@ def make_thumbnail(photo_url, width=None, height=None, root=settings.MEDIA_ROOT,
     if (width is not None) and (height is not None):
         if (orig_w == width) and (orig_h == height):
             # same dimensions
-            return None
+            return _indexed(photo_path, width, height, None, url_root)
         size = (width, height)
     elif width is not None:
         if orig_w == width:
             # same dimensions
-            return None
+            return _indexed(photo_path, width, height, None, url_root)
         size = (width, orig_h)
     elif height is not None:
         if orig_h == height:
             # same dimensions
-            return None
+            return _indexed(photo_path, width, height, None, url_root)
         size = (orig_w, height)
 
     try:
@@ -128,6 +183,14 @@ def make_thumbnail(photo_url, width=None, height=None, root=settings.MEDIA_ROOT,
         print >>sys.stderr, '[MAKE THUMBNAIL] error %s for file %r' % (err, photo_url)
         return photo_url
 
+    return _indexed(photo_path, width, height, th_url, url_root)
+
+def _indexed(photo_path, width, height, th_url, url_root):
+    # the index keeps the urls relative to the media url
+    url = th_url
+    if url is not None and url.startswith(url_root):
+        url = url[len(url_root):]
+    _update_image_info(photo_path, thumbnail=((width, height), url))
     return th_url
 
 def remove_file_thumbnails(file_name_path):
@@ -142,7 +205,7 @@ def remove_file_thumbnails(file_name_path):
         except OSError:
             # no reason to crash due to bad paths.
             log.warn("Could not delete image thumbnail: %s", path)
-        image_cache.delete(path) # delete from cache
+    forget_image(file_name_path)
 
 def make_admin_thumbnail(url):
     """ make thumbnails for admin interface """
@@ -170,59 +233,27 @@ def _get_thumbnail_url(photo_url, width=None, height=None, root=settings.MEDIA_R
     else:
         return photo_url
 
-def _set_cached_file(path, value):
-    """ Store file dependent data in cache.
-        Timeout is set to _FILE_CACHE_TIMEOUT (1month).
-    """
-
-    mtime = os.path.getmtime(path)
-    image_cache.set(path, (mtime, value,), _FILE_CACHE_TIMEOUT)
-
-def _get_cached_file(path, default=None):
-    """ Get file content from cache.
-        If modification time differ return None and delete
-        data from cache.
-    """
-
-    cached = image_cache.get(path, default)
-    if cached is None:
-        return None
-    mtime, value = cached
-
-    if (not os.path.isfile(path)) or (os.path.getmtime(path) != mtime): # file is changed or deleted
-        image_cache.delete(path) # delete from cache
-        # remove thumbnails if exists
-        base, ext = os.path.splitext(os.path.basename(path))
-        basedir = os.path.dirname(path)
-        for file in fnmatch.filter(os.listdir(basedir), _THUMBNAIL_GLOB % (base, ext)):
-            os.remove(os.path.join(basedir, file))
-        return None
-    else:
-        return value
-
 def get_image_size(photo_url, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
     """ returns image size.
 
-        image sizes are cached (using separate locmem:/// cache instance)
+        image sizes are kept in the image index, until the image file changes
     """
 
     path = _get_path_from_url(photo_url, root, url_root)
 
-    size = _get_cached_file(path)
-    if size is None:
-        try:
-            size = Image.open(path).size
-        except Exception, err:
-            # this goes to webserver error log
-            import sys
-            print >>sys.stderr, '[GET IMAGE SIZE] error %s for file %r' % (err, photo_url)
-            return None, None
-
-        if size is not None:
-            _set_cached_file(path, size)
-        else:
-            return None, None
+    info = get_current_image_info(path)
+    if info is not None and info['size'] is not None:
+        return info['size']
+
+    try:
+        size = Image.open(path).size
+    except Exception, err:
+        # this goes to webserver error log
+        import sys
+        print >>sys.stderr, '[GET IMAGE SIZE] error %s for file %r' % (err, photo_url)
+        return None, None
 
+    _update_image_info(path, size=size)
     return size
 
 
@@ -5,10 +5,13 @@ If that doesn't work, we add random numbers to the name
 """
 
 from django.contrib.auth.models import User
+from django.db.models import Q
 from django.utils.encoding import smart_unicode
 from htmlentitydefs import name2codepoint
 from satchmo_utils import random_string
+import os
 import re
+import threading
 import unicodedata
 
 _is_alnum_re = re.compile(r'\w+')
@@ -85,16 +88,141 @@ def slugify(s, entities=True, decimal=True, hexadecimal=True,
 
     slug = s
     if instance:
-        def get_query():
-            query = instance.__class__.objects.filter(**{slug_field: slug})
-            if filter_dict:
-                query = query.filter(**filter_dict)
-            if instance.pk:
-                query = query.exclude(pk=instance.pk)
-            return query
-        counter = 1
-        while get_query():
-            slug = "%s-%s" % (s, counter)
-            counter += 1
+        allocator = SlugAllocator(instance.__class__, slug_field=slug_field,
+            filter_dict=filter_dict, exclude_pk=instance.pk)
+        slug = allocator.allocate(s, reserve=False)
     return slug
 
+# the slugs reserved by the allocators of this process, by table and field
+_reserved = {}
+_reserved_lock = threading.RLock()
+
+class SlugAllocator(object):
+    """Finds free slugs for the objects of a model, reading the slugs in use
+    with one query per prefix instead of one query per candidate.
+
+    In batch mode, such as for an import, the slugs allocated are reserved
+    until `release` is called, once the objects are saved, so that the
+    other allocators of the process don't hand them out meanwhile::
+
+        allocator = SlugAllocator(Product, filter_dict={'site': site})
+        allocator.prefetch([name for name, sku in rows])
+        try:
+            for name, sku in rows:
+                Product.objects.create(site=site, name=name,
+                    slug=allocator.allocate(slugify(name)), sku=sku)
+        finally:
+            allocator.release()
+
+    The slugs are expected to be slugified already.
+    """
+
+    # how many prefixes are looked up in one query
+    BATCH_SIZE = 200
+
+    def __init__(self, model, slug_field='slug', filter_dict=None, exclude_pk=None):
+        self.model = model
+        self.slug_field = slug_field
+        self.filter_dict = filter_dict
+        self.exclude_pk = exclude_pk
+        self.key = (model._meta.db_table, slug_field)
+        self.prefixes = set()
+        self.empty_fetched = False
+        self.taken = set()
+        self.reserved = set()
+
+    def _query(self):
+        query = self.model._default_manager.all()
+        if self.filter_dict:
+            query = query.filter(**self.filter_dict)
+        if self.exclude_pk:
+            query = query.exclude(pk=self.exclude_pk)
+        return query
+
+    def _fetched(self, slug):
+        if not slug:
+            return self.empty_fetched
+        # the prefixes read are looked up by the beginnings of the slug
+        for end in range(1, len(slug) + 1):
+            if slug[:end] in self.prefixes:
+                return True
+        return False
+
+    def prefetch(self, slugs):
+        """Read the slugs in use starting with any of `slugs`, with one query
+        for their common prefix, or one query per batch if they have none."""
+        slugs = [slug for slug in slugs if not self._fetched(slug)]
+        field = '%s__startswith' % self.slug_field
+        if '' in slugs:
+            # the empty slug is followed by '-1', '-2'...
+            query = Q(**{self.slug_field: ''}) | Q(**{field: '-'})
+            self.taken.update(self._query().filter(query).values_list(self.slug_field, flat=True))
+            self.prefixes.add('-')
+            self.empty_fetched = True
+            slugs = [slug for slug in slugs if slug]
+        if not slugs:
+            return
+        prefix = os.path.commonprefix(slugs)
+        if prefix:
+            batches = [[prefix]]
+        else:
+            slugs = list(set(slugs))
+            batches = [slugs[ix:ix+self.BATCH_SIZE] for ix in range(0, len(slugs), self.BATCH_SIZE)]
+        for batch in batches:
+            query = Q()
+            for slug in batch:
+                query |= Q(**{field: slug})
+            self.taken.update(self._query().filter(query).values_list(self.slug_field, flat=True))
+            self.prefixes.update(batch)
+
+    def is_free(self, slug):
+        if not self._fetched(slug):
+            self.prefetch([slug])
+        if slug in self.taken:
+            return False
+        return slug not in _reserved.get(self.key, ())
+
+    def reserve(self, slug):
+        """Hold `slug` until `release`, for this allocator and the others."""
+        self.taken.add(slug)
+        _reserved_lock.acquire()
+        try:
+            _reserved.setdefault(self.key, set()).add(slug)
+        finally:
+            _reserved_lock.release()
+        self.reserved.add(slug)
+
+    def allocate(self, slug, reserve=True):
+        """Get `slug`, or the first of `slug-1`, `slug-2`... which is free."""
+        # the suffixed slugs start with the slug, so they are read at once,
+        # and only the reservations are checked under the lock
+        if not self._fetched(slug):
+            self.prefetch([slug])
+        _reserved_lock.acquire()
+        try:
+            reserved = _reserved.get(self.key, ())
+            candidate = slug
+            counter = 1
+            while candidate in self.taken or candidate in reserved:
+                candidate = "%s-%s" % (slug, counter)
+                counter += 1
+            if reserve:
+                self.reserve(candidate)
+        finally:
+            _reserved_lock.release()
+        return candidate
+
+    def release(self):
+        """Release the slugs reserved, once their objects are saved or the
+        batch is abandoned."""
+        _reserved_lock.acquire()
+        try:
+            reserved = _reserved.get(self.key, None)
+            if reserved is not None:
+                reserved.difference_update(self.reserved)
+                if not reserved:
+                    del _reserved[self.key]
+        finally:
+            _reserved_lock.release()
+        self.reserved = set()
+
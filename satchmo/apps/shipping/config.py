@@ -1,3 +1,4 @@
+from decimal import Decimal
 from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from livesettings import *
@@ -37,6 +38,62 @@ config_register(
         ))
 
 
+config_register(
+    PositiveIntegerValue(SHIPPING_GROUP,
+        'QUOTE_TIMEOUT',
+        description = _("Carrier timeout"),
+        help_text = _("Seconds to wait for the quotes of a carrier such as UPS or FedEx before leaving its options out."),
+        default=10,
+        ordering=20
+        ))
+
+config_register(
+    PositiveIntegerValue(SHIPPING_GROUP,
+        'QUOTE_THREADS',
+        description = _("Concurrent carrier quotes"),
+        help_text = _("How many carriers can be asked for quotes at the same time."),
+        default=4,
+        ordering=25
+        ))
+
+config_register(
+    PositiveIntegerValue(SHIPPING_GROUP,
+        'QUOTE_CACHE_TTL',
+        description = _("Carrier quote cache"),
+        help_text = _("Seconds to reuse the quote of a carrier for an identical shipment to the same postal code. 0 asks the carrier every time."),
+        default=600,
+        ordering=30
+        ))
+
+config_register(
+    PositiveIntegerValue(SHIPPING_GROUP,
+        'QUOTE_ERROR_TTL',
+        description = _("Carrier error cache"),
+        help_text = _("Seconds to wait before asking a carrier which failed or answered with an error to quote the same shipment again."),
+        default=60,
+        ordering=35
+        ))
+
+config_register(
+    DecimalValue(SHIPPING_GROUP,
+        'PACKING_MAX_WEIGHT',
+        description = _("Maximum box weight"),
+        help_text = _("Pack the products in as few boxes of at most this weight as possible, for the carriers quoting each box. 0 ships every item in its own box."),
+        default=Decimal("0"),
+        ordering=40
+        ))
+
+config_register(
+    StringValue(SHIPPING_GROUP,
+        'PACKING_WEIGHT_UNITS',
+        description = _("Maximum box weight units"),
+        default='lb',
+        ordering=45,
+        choices = (
+            ('lb', _('lb')),
+            ('kg', _('kg'))
+        )))
+
 # --- Load default shipping modules.  Ignore import errors, user may have deleted them. ---
 # DO NOT ADD 'tiered' or 'no' to this list.  
 # 'no' is used internally
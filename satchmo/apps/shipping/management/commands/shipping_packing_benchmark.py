@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from optparse import make_option
+from satchmo_store.shop.models import Cart
+from shipping.packing import pack_cart, count_boxes
+import time
+
+# We don't actually need it, but otherwise livesettings chokes.
+import shipping.config
+
+class Command(BaseCommand):
+    '''Compare the time taken to pack carts with `shipping.packing` to the time
+    taken to expand them with `Cart.get_shipment_list` and read the weight of
+    every unit, as the carriers did.'''
+
+    help = "Benchmarks the packing of carts against Cart.get_shipment_list."
+    args = '[cart_id ...]'
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat', dest='repeat', type='int', default=10,
+            help='How many times to pack each cart.'),
+    )
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        if args:
+            ids = [int(arg) for arg in args]
+        else:
+            # the carts with the most lines
+            carts = Cart.objects.annotate(lines=Count('cartitem')).order_by('-lines')
+            ids = list(carts.values_list('id', flat=True)[:10])
+
+        print "%8s %6s %8s %10s %10s %8s" % ('cart', 'lines', 'units', 'list (ms)', 'pack (ms)', 'boxes')
+        for pk in ids:
+            cart = Cart.objects.get(pk=pk)
+            units = len(cart.get_shipment_list())
+
+            start = time.time()
+            for ix in range(repeat):
+                for product in Cart.objects.get(pk=pk).get_shipment_list():
+                    product.smart_attr('weight')
+                    product.smart_attr('weight_units')
+            listed = (time.time() - start) / repeat
+
+            start = time.time()
+            for ix in range(repeat):
+                parcels = pack_cart(Cart.objects.get(pk=pk))
+            packed = (time.time() - start) / repeat
+
+            print "%8i %6i %8i %10.2f %10.2f %8i" % (pk, len(cart), units,
+                listed * 1000, packed * 1000, count_boxes(parcels))
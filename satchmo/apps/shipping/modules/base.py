@@ -1,18 +1,180 @@
+"""
+The base class of the shippers, and the quote cache shared by the carriers
+asking a remote service for their quotes.
+
+The responses of the carriers are cached by a fingerprint of the shipment
+they quote: where it ships from and to, its parcels, the service asked for
+and the carrier settings which change the rates. Identical carts shipped to
+the same postal code share the response, whoever the customer is. A carrier
+which can't be reached, or which answers with an error, isn't asked again for
+the same shipment until the shorter SHIPPING QUOTE_ERROR_TTL has passed.
+"""
+from decimal import Decimal, ROUND_CEILING
+from keyedcache import cache_key, cache_get, cache_set, NotCachedError
+from livesettings import config_value
+from shipping.packing import pack_cart
+import logging
+import sys
+import threading
+import urllib2
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+log = logging.getLogger('shipping.modules.base')
+
+# cached in place of the response of a carrier which couldn't be reached
+QUOTE_ERROR = '__quote_error__'
+
+class QuoteError(Exception):
+    """The carrier couldn't be reached for this shipment, recently."""
+
+# the hits, misses and errors of the quote cache in this process, by carrier
+_quote_stats = {}
+_quote_stats_lock = threading.Lock()
+
+def _count_quote(carrier, event):
+    _quote_stats_lock.acquire()
+    try:
+        stats = _quote_stats.setdefault(carrier, {'hits': 0, 'misses': 0, 'errors': 0})
+        stats[event] += 1
+    finally:
+        _quote_stats_lock.release()
+
+def get_quote_stats(reset=False):
+    """Get the quote cache metrics of this process, as a dictionary of
+    {carrier: {'hits': n, 'misses': n, 'errors': n}}."""
+    _quote_stats_lock.acquire()
+    try:
+        stats = dict([(carrier, counts.copy()) for carrier, counts in _quote_stats.items()])
+        if reset:
+            _quote_stats.clear()
+    finally:
+        _quote_stats_lock.release()
+    return stats
+
+def _canonical(value):
+    if value is None:
+        return u''
+    if isinstance(value, Decimal):
+        # 1.50 and 1.5 weigh the same
+        value = value.normalize()
+    return unicode(value).strip().upper()
+
+def parcels_fingerprint(parcels):
+    """The weight, dimensions and count of packed parcels, as a sorted tuple."""
+    fingerprint = []
+    for parcel in parcels:
+        fingerprint.append(tuple([_canonical(value) for value in (parcel.weight, parcel.weight_units,
+            parcel.length, parcel.width, parcel.height, parcel.length_units)]) + (parcel.count,))
+    fingerprint.sort()
+    return tuple(fingerprint)
+
 class BaseShipper(object):
+    # set by the shippers which ask a remote service for their quotes, so
+    # that they are calculated concurrently
+    remote_quotes = False
+    # seconds to wait for the quotes, when not the SHIPPING QUOTE_TIMEOUT setting
+    quote_timeout = None
+
     def __init__(self, cart=None, contact=None):
         self._calculated = False
         self.cart = cart
-        self.contact = contact 
+        self.contact = contact
         self._calculated = False
-        
+
         if cart or contact:
             self.calculate(cart, contact)
-        
+
     def calculate(self, cart, contact):
         """
-        Perform shipping calculations, separated from __init__ so that the object can be 
+        Perform shipping calculations, separated from __init__ so that the object can be
         used for keys and labels more easily.
         """
         self.cart = cart
         self.contact = contact
-        self._calculated = True
\ No newline at end of file
+        self._calculated = True
+
+    def open_url(self, request):
+        """
+        Open `request` with urllib2, giving up when the service of the carrier
+        doesn't answer within the quote timeout, so that a carrier which hangs
+        doesn't hold a quoting thread forever.
+        """
+        timeout = self.quote_timeout or config_value('SHIPPING', 'QUOTE_TIMEOUT')
+        return urllib2.urlopen(request, timeout=timeout)
+
+    def pack(self, cart, single_box=False, weight_units=None, length_units=None):
+        """
+        Get the parcels to ship `cart` in, as packed by `shipping.packing.pack_cart`.
+        """
+        return pack_cart(cart, single_box=single_box, weight_units=weight_units,
+            length_units=length_units)
+
+    def quote_fingerprint(self, cart, contact, service=None, parcels=None, **options):
+        """
+        Describe the shipment of `cart` to `contact` for the quote cache.
+
+        `parcels` defaults to the parcels the cart is packed in, and the
+        other keyword arguments are the values sent to the carrier which
+        change its rates, such as the declared value or the packaging.
+        """
+        from satchmo_store.shop.models import Config
+        shop_details = Config.objects.get_current()
+        address = contact.shipping_address
+        if parcels is None:
+            parcels = parcels_fingerprint(self.pack(cart))
+        options = [(name, _canonical(value)) for name, value in options.items()]
+        options.sort()
+        return (
+            (shop_details.country.iso2_code, _canonical(shop_details.postal_code).replace(' ', '')),
+            (address.country.iso2_code, _canonical(address.state),
+                _canonical(address.postal_code).replace(' ', '')),
+            tuple(parcels),
+            _canonical(service),
+            tuple(options))
+
+    def cached_quote(self, fingerprint, fetch, ok=None):
+        """
+        Get the response of the carrier for the shipment described by
+        `fingerprint` from the quote cache, or by calling `fetch()`.
+
+        `ok(response)` tells whether the carrier answered with a quote or
+        with an error, which is only kept for the SHIPPING QUOTE_ERROR_TTL.
+        Raises `QuoteError` when the carrier recently couldn't be reached.
+        """
+        carrier = self.__module__
+        key = cache_key('SHIPPING_QUOTE', carrier, md5(repr(fingerprint)).hexdigest())
+        try:
+            response = cache_get(key)
+        except NotCachedError:
+            response = None
+
+        if response is not None:
+            _count_quote(carrier, 'hits')
+            log.debug('Got quote from cache [%s]', key)
+            if response == QUOTE_ERROR:
+                raise QuoteError('%s could not be reached' % carrier)
+            return response
+
+        _count_quote(carrier, 'misses')
+        try:
+            response = fetch()
+        except Exception:
+            exc_info = sys.exc_info()
+            _count_quote(carrier, 'errors')
+            length = config_value('SHIPPING', 'QUOTE_ERROR_TTL')
+            if length:
+                cache_set(key, value=QUOTE_ERROR, length=length)
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        if ok is None or ok(response):
+            length = config_value('SHIPPING', 'QUOTE_CACHE_TTL')
+        else:
+            _count_quote(carrier, 'errors')
+            length = config_value('SHIPPING', 'QUOTE_ERROR_TTL')
+        if length:
+            cache_set(key, value=response, length=length)
+        return response
@@ -5,7 +5,6 @@ v0.1.1
 
 # Note, make sure you use decimal math everywhere!
 from decimal import Decimal
-from django.core.cache import cache
 from django.template import loader, Context
 from django.utils.safestring import mark_safe 
 from django.utils.translation import ugettext as _
@@ -23,7 +22,14 @@ except ImportError:
 
 log = logging.getLogger('canadapost.shipper')
 
+def _response_ok(raw):
+    try:
+        return fromstring(raw).find('.//statusCode').text == '1'
+    except (AttributeError, SyntaxError):
+        return False
+
 class Shipper(BaseShipper):
+    remote_quotes = True
     
     def __init__(self, cart=None, contact=None, service_type=None):
 
@@ -102,7 +108,7 @@ class Shipper(BaseShipper):
           Post the data and return the XML response
         '''
         conn = urllib2.Request(url=connection, data=request.encode("utf-8"))
-        f = urllib2.urlopen(conn)
+        f = self.open_url(conn)
         all_results = f.read()
         self.raw = all_results
         return(fromstring(all_results))
@@ -146,27 +152,30 @@ class Shipper(BaseShipper):
         c = Context({
                 'config': configuration,
                 'cart': cart,
-                'contact': contact
+                'contact': contact,
+                # Canada Post weighs in kilograms and measures in centimeters
+                'parcels': self.pack(cart, weight_units='kg', length_units='cm'),
             })
         
         t = loader.get_template('shipping/canadapost/request.xml')
         request = t.render(c)
         self.is_valid = False
         
-        cache_key_response = "canadapost-cart-%s-response" % int(cart.id)
-        cache_key_request = "canadapost-cart-%s-request" % int(cart.id)
-        last_request = cache.get(cache_key_request)
-        tree = cache.get(cache_key_response)
-        
-        if (last_request != request) or tree is None:
-            self.verbose_log("Requesting from Canada Post [%s]\n%s", cache_key_request, request)
-            cache.set(cache_key_request, request, 60)
-            tree = self._process_request(connection, request)
-            self.verbose_log("Got from Canada Post [%s]:\n%s", cache_key_response, self.raw)
-            needs_cache = True
-        else:
-            needs_cache = False
-            
+        # all the services are quoted by the same request
+        fingerprint = self.quote_fingerprint(cart, contact, value=cart.total,
+            cpcid=settings.CPCID.value,
+            turn_around_time=settings.TURN_AROUND_TIME.value,
+            connection=connection)
+
+        def fetch():
+            self.verbose_log("Requesting from Canada Post\n%s", request)
+            self._process_request(connection, request)
+            self.verbose_log("Got from Canada Post:\n%s", self.raw)
+            return self.raw
+
+        self.raw = self.cached_quote(fingerprint, fetch, ok=_response_ok)
+        tree = fromstring(self.raw)
+
         try:
             status_code = tree.getiterator('statusCode')
             status_val = status_code[0].text
@@ -11,9 +11,8 @@ from decimal import Decimal
 from django.utils.translation import ugettext as _
 from django.utils.safestring import mark_safe 
 from django.template import loader, Context
-from django.core.cache import cache
 
-from shipping.modules.base import BaseShipper
+from shipping.modules.base import BaseShipper, QuoteError
 from shipping import signals
 from livesettings import config_get_group
 
@@ -24,6 +23,7 @@ import logging
 log = logging.getLogger('fedex.shipper')
 
 class Shipper(BaseShipper):
+    remote_quotes = True
     
     def __init__(self, cart=None, contact=None, service_type=None):
 
@@ -123,13 +123,19 @@ class Shipper(BaseShipper):
             # all clear.
             return False
 
+    def _response_ok(self, raw):
+        try:
+            return not self._check_for_error(minidom.parseString(raw))
+        except Exception:
+            return False
+
     def _process_request(self, connection, request):
         '''
           Post the data and return the XML response
         '''
 
         conn = urllib2.Request(url=connection, data=request)
-        f = urllib2.urlopen(conn)
+        f = self.open_url(conn)
         all_results = f.read()
         self.raw_response = all_results
         return(minidom.parseString(all_results))
@@ -191,6 +197,17 @@ class Shipper(BaseShipper):
         
         box_weight_units = "LB"
 
+        # the options of the requests which change the rates
+        quote_options = {
+            'account': settings.ACCOUNT.value,
+            'packaging': self.packaging,
+            'connection': connection,
+        }
+
+        def fetch():
+            self._process_request(connection, request)
+            return self.raw_response
+
         # FedEx requires that the price be formatted to 2 decimal points.
         # e.g., 1.00, 10.40, 3.50
 
@@ -201,16 +218,13 @@ class Shipper(BaseShipper):
             if verbose:
                 log.debug("Using single-box method for fedex calculations.")
                 
-            box_price = Decimal("0.00")
-            box_weight = Decimal("0.00")
-            for product in cart.get_shipment_list():
-                box_price += product.unit_price
-                if product.weight is None:
-                    log.warn("No weight on product (skipping for ship calculations): %s", product)
-                else:
-                    box_weight += product.weight
-                if product.weight_units and product.weight_units != "":
-                    box_weight_units = product.weight_units
+            box = self.pack(cart, single_box=True)[0]
+            if not box.has_full_weight:
+                log.warn("No weight on some products (skipping for ship calculations): %s", box.name)
+            box_price = box.value
+            box_weight = box.weight
+            if box.weight_units:
+                box_weight_units = box.weight_units
             
             if box_weight < Decimal("0.1"):
                 log.debug("Total box weight too small, defaulting to 0.1")
@@ -232,8 +246,12 @@ class Shipper(BaseShipper):
             t = loader.get_template('shipping/fedex/request.xml')
             request = t.render(c)
 
+            fingerprint = self.quote_fingerprint(cart, contact, service=self.service_type_code,
+                parcels=[(shippingdata['box_weight'], shippingdata['box_weight_units'])],
+                value=shippingdata['box_price'], **quote_options)
+
             try:
-                response = self._process_request(connection, request)
+                response = minidom.parseString(self.cached_quote(fingerprint, fetch, ok=self._response_ok))
                 error = self._check_for_error(response)
             
                 if verbose:
@@ -247,7 +265,7 @@ class Shipper(BaseShipper):
 
                     total_cost = this_charge + this_discount
                     self.charges += total_cost
-            except urllib2.URLError:
+            except (urllib2.URLError, QuoteError):
                 log.warn("Error opening url: %s", connection)
                 error = True
                 
@@ -263,19 +281,23 @@ class Shipper(BaseShipper):
             # So, to simulate this functionality, and return a total 
             # price, we have to loop through all of our items, and 
             # pray the customer isn't ordering a thousand boxes of bagels.
-            for product in cart.get_shipment_list():
+            # Identical boxes are only asked for once.
+            for parcel in self.pack(cart):
                 c = Context({
                   'config': configuration,
-                  'box_weight' : '%.1f' % (product.weight or 0.0),
-                  'box_weight_units' : product.weight_units and product.weight_units.upper() or 'LB',
-                  'box_price' : '%.2f' % product.unit_price,
+                  'box_weight' : '%.1f' % (parcel.weight or 0),
+                  'box_weight_units' : parcel.weight_units and parcel.weight_units.upper() or 'LB',
+                  'box_price' : '%.2f' % parcel.value,
                   'contact': contact,
                 })
     
                 t = loader.get_template('shipping/fedex/request.xml')
                 request = t.render(c)
 
-                response = self._process_request(connection, request)
+                fingerprint = self.quote_fingerprint(cart, contact, service=self.service_type_code,
+                    parcels=[(c['box_weight'], c['box_weight_units'])],
+                    value=c['box_price'], **quote_options)
+                response = minidom.parseString(self.cached_quote(fingerprint, fetch, ok=self._response_ok))
                 error = self._check_for_error(response)
                 
                 if verbose:
@@ -287,7 +309,7 @@ class Shipper(BaseShipper):
                     this_discount = float(response.documentElement.getElementsByTagName('TotalDiscount')[0].firstChild.nodeValue)
                     self.delivery_days = response.documentElement.getElementsByTagName('TimeInTransit')[0].firstChild.nodeValue
                     total_cost = this_charge + this_discount
-                    self.charges += total_cost
+                    self.charges += total_cost * parcel.count
                     
                 else:
                     break
@@ -4,9 +4,9 @@ Tiered shipping models
 from decimal import Decimal
 from django.conf import settings
 from django.db import models
-from django.utils.translation import get_language, ugettext_lazy as _
+from django.utils.translation import ugettext_lazy as _
 from shipping.modules.base import BaseShipper
-import datetime
+from shipping.tiers import get_compiled_tiers, listen_for_tier_changes
 import logging
 import operator
 
@@ -41,7 +41,7 @@ class Shipper(BaseShipper):
         """
         assert(self._calculated)
         total = Decimal("0.00")
-        for cartitem in self.cart.cartitem_set.all():
+        for cartitem in self.cart:
             if cartitem.product.is_shippable:
                 total += cartitem.line_total
         return self.carrier.price(total)
@@ -93,38 +93,7 @@ class Carrier(models.Model):
     active = models.BooleanField(_('Active'), default=True)
 
     def _find_translation(self, language_code=None):
-        if not language_code:
-            language_code = get_language()
-            
-        c = self.translations.filter(languagecode__exact = language_code)
-        ct = c.count()
-
-        if not c or ct == 0:
-            pos = language_code.find('-')
-            if pos>-1:
-                short_code = language_code[:pos]
-                log.debug("Carrier: Trying to find root language content for: [%s]", short_code)
-                c = self.translations.filter(languagecode__exact = short_code)
-                ct = c.count()
-                if ct>0:
-                    log.debug("Carrier: Found root language content for: [%s]", short_code)
-
-        if not c or ct == 0:
-            #log.debug("Trying to find default language content for: %s", self)
-            c = self.translations.filter(languagecode__istartswith = settings.LANGUAGE_CODE)
-            ct = c.count()
-
-        if not c or ct == 0:
-            #log.debug("Trying to find *any* language content for: %s", self)
-            c = self.translations.all()
-            ct = c.count()
-
-        if ct > 0:
-            trans = c[0]
-        else:
-            trans = None
-
-        return trans
+        return _compiled_tiers().translation(self.pk, language_code)
 
     def delivery(self):
         """Get the delivery, looking up by language code, falling back intelligently.
@@ -176,23 +145,12 @@ class Carrier(models.Model):
     
     def price(self, total):
         """Get a price for this total."""
-        if total == 0:
-            total = Decimal('0.00')# total was "0E-8", which breaks mysql
-
-        # first check for special discounts
-        prices = self.tiers.filter(expires__isnull=False, min_total__lte=total).exclude(expires__lt=datetime.date.today())
-
-        if not prices.count() > 0:
-            prices = self.tiers.filter(expires__isnull=True, min_total__lte=total)
-
-        if prices.count() > 0:
-            # Get the price with the quantity closest to the one specified without going over
-            return Decimal(prices.order_by('-min_total')[0].price)
-
-        else:
+        # special discounts, which expire, come first
+        price = _compiled_tiers().table(self.pk).floor(total)
+        if price is None:
             log.debug("No tiered price found for %s: total=%s", self, total)
             raise TieredPriceException('No price available')
-            
+        return price
             
     def __unicode__(self):
         return u"Carrier: %s" % self.name
@@ -225,4 +183,16 @@ class ShippingTier(models.Model):
     class Meta:
         ordering = ('carrier','price')
 
+def _build_tiers(compiled):
+    for carrier, min_total, price, expires in ShippingTier.objects.values_list(
+        'carrier', 'min_total', 'price', 'expires'):
+        compiled.add_tier(carrier, min_total, Decimal(price), expires)
+    for translation in CarrierTranslation.objects.all():
+        compiled.add_translation(translation.carrier_id, translation.languagecode, translation)
+
+def _compiled_tiers():
+    return get_compiled_tiers('tiered', _build_tiers)
+
+listen_for_tier_changes('tiered', Carrier, CarrierTranslation, ShippingTier)
+
 import config
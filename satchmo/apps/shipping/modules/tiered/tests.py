@@ -1,7 +1,8 @@
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal
 from django.test import TestCase
 from models import Carrier, ShippingTier, Shipper
+from shipping.tiers import CompiledTiers
 
 def make_tiers(carrier, prices, expires=None):
     for min_total, price in prices:
@@ -122,4 +123,28 @@ class TieredCarrierExpiringTest(TestCase):
 
         
         
-        
\ No newline at end of file
+        
+
+    def testCompiled(self):
+        self.assertEqual(self.carrier.price(Decimal("25.00")), Decimal("15.00"))
+
+        # the tiers are compiled until one of them is saved
+        ShippingTier.objects.filter(carrier=self.carrier).update(price=Decimal("99.00"))
+        self.assertEqual(self.carrier.price(Decimal("25.00")), Decimal("15.00"))
+        make_tiers(self.carrier, [(50, 18)])
+        self.assertEqual(self.carrier.price(Decimal("25.00")), Decimal("99.00"))
+
+    def testExpiryDate(self):
+        compiled = CompiledTiers(date(2010, 6, 1), 1)
+        compiled.add_tier(1, Decimal("0.00"), 'base')
+        compiled.add_tier(1, Decimal("0.00"), 'sale', expires=date(2010, 6, 30))
+        compiled.add_tier(1, Decimal("0.00"), 'past sale', expires=date(2010, 5, 31))
+        compiled.add_tier(2, Decimal("10.00"), 'other')
+        compiled.compile()
+
+        self.assertEqual(compiled.table(1).floor(Decimal("5.00")), 'sale')
+        self.assertEqual(compiled.table(2).floor(Decimal("5.00")), None)
+        self.assertEqual(compiled.table(2).ceiling(Decimal("5.00")), 'other')
+        # compiled again once the sale is over
+        self.assert_(compiled.covers(date(2010, 6, 30)))
+        self.failIf(compiled.covers(date(2010, 7, 1)))
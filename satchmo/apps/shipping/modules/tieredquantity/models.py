@@ -4,9 +4,9 @@ Tiered shipping models
 from decimal import Decimal
 from django.conf import settings
 from django.db import models
-from django.utils.translation import get_language, ugettext_lazy as _
+from django.utils.translation import ugettext_lazy as _
 from shipping.modules.base import BaseShipper
-import datetime
+from shipping.tiers import get_compiled_tiers, listen_for_tier_changes
 import logging
 import operator
 
@@ -41,7 +41,7 @@ class Shipper(BaseShipper):
         """
         assert(self._calculated)
         qty = Decimal('0')
-        for cartitem in self.cart.cartitem_set.all():
+        for cartitem in self.cart:
             if cartitem.product.is_shippable:
                 qty += cartitem.quantity
         return self.carrier.price(qty)
@@ -87,38 +87,7 @@ class Carrier(models.Model):
     active = models.BooleanField(_('Active'), default=True)
 
     def _find_translation(self, language_code=None):
-        if not language_code:
-            language_code = get_language()
-            
-        c = self.translations.filter(languagecode__exact = language_code)
-        ct = c.count()
-
-        if not c or ct == 0:
-            pos = language_code.find('-')
-            if pos>-1:
-                short_code = language_code[:pos]
-                log.debug("%s: Trying to find root language content for: [%s]", self.id, short_code)
-                c = self.translations.filter(languagecode__exact = short_code)
-                ct = c.count()
-                if ct>0:
-                    log.debug("%s: Found root language content for: [%s]", self.id, short_code)
-
-        if not c or ct == 0:
-            #log.debug("Trying to find default language content for: %s", self)
-            c = self.translations.filter(languagecode__istartswith = settings.LANGUAGE_CODE)
-            ct = c.count()
-
-        if not c or ct == 0:
-            #log.debug("Trying to find *any* language content for: %s", self)
-            c = self.translations.all()
-            ct = c.count()
-
-        if ct > 0:
-            trans = c[0]
-        else:
-            trans = None
-
-        return trans
+        return _compiled_tiers().translation(self.pk, language_code)
 
     def delivery(self):
         """Get the delivery, looking up by language code, falling back intelligently.
@@ -171,20 +140,13 @@ class Carrier(models.Model):
     def price(self, qty):
         """Get a price for this qty."""
         # first check for special discounts
-        prices = self.tiers.filter(expires__isnull=False, quantity__lte=qty).exclude(expires__lt=datetime.date.today())
-        
-        if not prices.count() > 0:
-            prices = self.tiers.filter(expires__isnull=True, quantity__lte=qty)
-
-        if prices.count() > 0:
-            # Get the price with the quantity closest to the one specified without going over
-            return Decimal(prices.order_by('-quantity')[0].calculate_price(qty))
-
-        else:
+        tier = _compiled_tiers().table(self.pk).floor(qty)
+        if tier is None:
             log.debug("No quantity tier found for %s: qty=%d", self.id, qty)
             raise TieredPriceException('No price available')
-            
-            
+        handling, price = tier
+        return Decimal(handling + price * qty)
+
     def __unicode__(self):
         return u"Carrier: %s" % self.name
         
@@ -224,4 +186,16 @@ class QuantityTier(models.Model):
     class Meta:
         pass
 
+def _build_tiers(compiled):
+    for carrier, quantity, handling, price, expires in QuantityTier.objects.values_list(
+        'carrier', 'quantity', 'handling', 'price', 'expires'):
+        compiled.add_tier(carrier, quantity, (handling, price), expires)
+    for translation in CarrierTranslation.objects.all():
+        compiled.add_translation(translation.carrier_id, translation.languagecode, translation)
+
+def _compiled_tiers():
+    return get_compiled_tiers('tieredquantity', _build_tiers)
+
+listen_for_tier_changes('tieredquantity', Carrier, CarrierTranslation, QuantityTier)
+
 import config
@@ -3,12 +3,12 @@ TieredWeight shipping models
 """
 import logging
 
-from datetime import date
 from django.db import models
 from django.conf import settings
-from django.utils.translation import get_language, ugettext_lazy as _
+from django.utils.translation import ugettext_lazy as _
 from l10n.models import Country
 from shipping.modules.base import BaseShipper
+from shipping.tiers import get_compiled_tiers, listen_for_tier_changes
 
 try:
     from decimal import Decimal
@@ -25,7 +25,7 @@ class TieredWeightException(Exception):
 
 def _get_cart_weight(cart):
     weight = Decimal('0.0')
-    for item in cart.cartitem_set.all():
+    for item in cart:
         if item.is_shippable and item.product.smart_attr('weight'):
             weight = weight + (item.product.smart_attr('weight') * item.quantity)
     return weight
@@ -129,11 +129,11 @@ class Carrier(models.Model):
 
 
     def get_zone(self, country):
-        try:
-            return self.zones.filter(countries=country).get()
-        except Zone.DoesNotExist:
-            if self.default_zone:
-                return self.default_zone
+        compiled = _compiled_tiers()
+        zone = compiled.country_zones.get((self.pk, country.pk), None)
+        if zone is None and self.default_zone_id:
+            zone = compiled.zones.get(self.default_zone_id, None)
+        return zone
 
 
 class Zone(models.Model):
@@ -156,36 +156,7 @@ class Zone(models.Model):
 
 
     def _find_translation(self, language_code=None):
-        if not language_code:
-            language_code = get_language()
-    
-        c = self.translations.filter(lang_code__exact=language_code)
-        ct = c.count()
-    
-        if not c or ct == 0:
-            pos = language_code.find('-')
-            if pos > -1:
-                short_code = language_code[:pos]
-                log.debug("%s: Trying to find root language content for: [%s]", self, short_code)
-                c = self.translations.filter(lang_code__exact=short_code)
-                ct = c.count()
-                if ct > 0:
-                    log.debug("%s: Found root language content for: [%s]", self, short_code)
-    
-        if not c or ct == 0:
-            #log.debug("Trying to find default language content for: %s", self)
-            c = self.translations.filter(lang_code__istartswith=settings.LANGUAGE_CODE)
-            ct = c.count()
-    
-        if not c or ct == 0:
-            #log.debug("Trying to find *any* language content for: %s", self)
-            c = self.translations.all()
-            ct = c.count()
-    
-        if ct > 0:
-            return c[0]
-        else:
-            return None
+        return _compiled_tiers().translation(self.pk, language_code)
 
 
     def delivery(self):
@@ -228,15 +199,11 @@ class Zone(models.Model):
         """
         Get a price for this weight
         """
-        tiers_tmp = self.tiers.filter(min_weight__gte=weight).order_by('min_weight')
-        tiers = tiers_tmp.filter(expires__gte=date.today())[:1]
-        if tiers.count() is 0:
-            tiers = tiers_tmp.filter(expires__isnull=True)[:1]
-        if tiers.count() is not 0:
-            return tiers[0].cost
-        else:
+        cost = _compiled_tiers().table(self.pk).ceiling(weight)
+        if cost is None:
             log.debug("No tiered price found for %s: weight=%s", self, weight)
             raise TieredWeightException
+        return cost
 
 
 class ZoneTranslation(models.Model):
@@ -290,4 +257,26 @@ class WeightTier(models.Model):
     cost = property(cost)
 
 
+def _build_tiers(compiled):
+    # the zones are compiled along with their tiers, handling included
+    compiled.zones = dict([(zone.pk, zone) for zone in Zone.objects.all()])
+    compiled.country_zones = {}
+    for zone, country in Zone.countries.through.objects.values_list('zone', 'country'):
+        zone = compiled.zones[zone]
+        compiled.country_zones.setdefault((zone.carrier_id, country), zone)
+    for zone, min_weight, handling, price, expires in WeightTier.objects.values_list(
+        'zone', 'min_weight', 'handling', 'price', 'expires'):
+        cost = Decimal(price) + (handling or 0) + (compiled.zones[zone].handling or 0)
+        compiled.add_tier(zone, min_weight, cost, expires)
+    for translation in ZoneTranslation.objects.all():
+        compiled.add_translation(translation.zone_id, translation.lang_code, translation)
+
+
+def _compiled_tiers():
+    return get_compiled_tiers('tieredweight', _build_tiers)
+
+
+listen_for_tier_changes('tieredweight', Carrier, Zone, ZoneTranslation, WeightTier)
+
+
 import config
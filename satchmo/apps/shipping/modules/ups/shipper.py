@@ -53,7 +53,14 @@ TRANSIT_CODE_MAP = {
     '2DM' : '59'  #guessing, I've never seen this code come back
     }
 
+def _response_ok(raw):
+    try:
+        return fromstring(raw).find('.//ResponseStatusCode').text == '1'
+    except (AttributeError, SyntaxError):
+        return False
+
 class Shipper(BaseShipper):
+    remote_quotes = True
 
     def __init__(self, cart=None, contact=None, service_type=None):
         self._calculated = False
@@ -121,7 +128,7 @@ class Shipper(BaseShipper):
         Post the data and return the XML response
         """
         conn = urllib2.Request(url=connection, data=request.encode("utf-8"))
-        f = urllib2.urlopen(conn)
+        f = self.open_url(conn)
         all_results = f.read()
         self.raw = all_results
         return(fromstring(all_results))
@@ -166,31 +173,22 @@ class Shipper(BaseShipper):
         if settings.SINGLE_BOX.value:
             log.debug("Using single-box method for ups calculations.")
 
-            box_weight = Decimal("0.00")
-            for product in cart.get_shipment_list():
-                if product.smart_attr('weight') is None:
-                    log.warn("No weight on product (skipping for ship calculations): %s", product)
-                else:
-                    box_weight += product.smart_attr('weight')
-                if product.smart_attr('weight_units') and product.smart_attr('weight_units') != "":
-                    box_weight_units = product.smart_attr('weight_units')
-                else:
-                    log.warn("No weight units for product")
-
+            box = self.pack(cart, single_box=True)[0]
+            if not box.has_full_weight:
+                log.warn("No weight on some products (skipping for ship calculations): %s", box.name)
+            box_weight = box.weight
             if box_weight < Decimal("0.1"):
                 log.debug("Total box weight too small, defaulting to 0.1")
                 box_weight = Decimal("0.1")
 
             shippingdata['single_box'] = True
             shippingdata['box_weight'] = '%.1f' % box_weight
-            shippingdata['box_weight_units'] = box_weight_units.upper()
-
-        total_weight = 0
-        for product in cart.get_shipment_list():
-            try:
-                total_weight += product.smart_attr('weight')
-            except TypeError:
-                pass
+            shippingdata['box_weight_units'] = (box.weight_units or 'lb').upper()
+        else:
+            boxes = []
+            for parcel in self.pack(cart):
+                boxes.extend(parcel.boxes)
+            shippingdata['boxes'] = boxes
 
         signals.shipping_data_query.send(Shipper, shipper=self, cart=cart, shippingdata=shippingdata)
         c = Context(shippingdata)
@@ -202,26 +200,22 @@ class Shipper(BaseShipper):
         else:
             connection = settings.CONNECTION_TEST.value
 
-        cachekey = cache_key(
-            'UPS_SHIP',
-            #service_type = self.service_type_code,
-            weight = str(total_weight),
-            country = shop_details.country.iso2_code,
-            zipcode = contact.shipping_address.postal_code)
+        # all the services are quoted by the same request
+        fingerprint = self.quote_fingerprint(cart, contact,
+            account=settings.ACCOUNT.value,
+            container=container,
+            pickup=settings.PICKUP_TYPE.value,
+            single_box=shippingdata['single_box'],
+            connection=connection)
 
-        try:
-            tree = cache_get(cachekey)
-        except NotCachedError:
-            tree = None
+        def fetch():
+            self.verbose_log("Requesting from UPS\n%s", request)
+            self._process_request(connection, request)
+            self.verbose_log("Got from UPS:\n%s", self.raw)
+            return self.raw
 
-        if tree is not None:
-            self.verbose_log('Got UPS info from cache [%s]', cachekey)
-        else:
-            self.verbose_log("Requesting from UPS [%s]\n%s", cachekey, request)
-            cache_set(cachekey, value=request, length=600)
-            tree = self._process_request(connection, request)
-            self.verbose_log("Got from UPS [%s]:\n%s", cachekey, self.raw)
-            cache_set(cachekey, value=tree)
+        self.raw = self.cached_quote(fingerprint, fetch, ok=_response_ok)
+        tree = fromstring(self.raw)
 
         try:
             status_code = tree.getiterator('ResponseStatusCode')
@@ -333,7 +327,7 @@ class Shipper(BaseShipper):
         if ups is None:
             log.debug('Requesting from UPS: %s\n%s', connection, request)
             conn = urllib2.Request(url=connection, data=request.encode("utf-8"))
-            f = urllib2.urlopen(conn)
+            f = self.open_url(conn)
             all_results = f.read()
 
             self.verbose_log("Received from UPS:\n%s", all_results)
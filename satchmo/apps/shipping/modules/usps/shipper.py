@@ -14,7 +14,6 @@ unique needs.
 
 # Note, make sure you use decimal math everywhere!
 from decimal import Decimal
-from django.core.cache import cache
 from django.template import Context, loader
 from django.utils.translation import ugettext as _
 from l10n.models import Country
@@ -98,7 +97,15 @@ APIS = {'PRIORITY': 'PriorityMail',
        }
 
 log = logging.getLogger('usps.shipper')
+
+def _response_ok(raw):
+    try:
+        return len(fromstring(raw).getiterator('Error')) == 0
+    except SyntaxError:
+        return False
+
 class Shipper(BaseShipper):
+    remote_quotes = True
 
     def __init__(self, cart=None, contact=None, service_type=None):
         self._calculated = False
@@ -179,11 +186,9 @@ class Shipper(BaseShipper):
         data = 'API=%s&XML=%s' % (api, request.encode('utf-8'))
 
         conn = urllib2.Request(url=connection, data=data)
-        f = urllib2.urlopen(conn)
+        f = self.open_url(conn)
         all_results = f.read()
-
-        log.error(all_results)
-
+        self.raw = all_results
         return (fromstring(all_results))
 
     def render_template(self, template, cart=None, contact=None):
@@ -203,11 +208,8 @@ class Shipper(BaseShipper):
             mail_type = None
             self.api = None
         
-        # calculate the weight of the entire order
-        weight = Decimal('0.0')
-        for item in cart.cartitem_set.all():
-            if item.product.smart_attr('weight'):
-                weight += item.product.smart_attr('weight') * item.quantity
+        # calculate the weight of the entire order, in pounds
+        weight = self.pack(cart, single_box=True, weight_units='lb')[0].weight
         self.verbose_log('WEIGHT: %s' % weight)
 
         # I don't know why USPS made this one API different this way...
@@ -264,20 +266,23 @@ class Shipper(BaseShipper):
         else:
             connection = settings.CONNECTION_TEST.value
 
-        cache_key_response = "usps-cart-%s-response" % int(cart.id)
-        cache_key_request = "usps-cart-%s-request" % int(cart.id)
-        last_request = cache.get(cache_key_request)
+        # the domestic services of a mail type, and all the international
+        # services, are quoted by the same request
+        if self.is_intl:
+            fingerprint = self.quote_fingerprint(cart, contact, value=cart.total,
+                container=settings.SHIPPING_CONTAINER.value, connection=connection)
+        else:
+            fingerprint = self.quote_fingerprint(cart, contact, service=CODES[self.service_type_code],
+                container=settings.SHIPPING_CONTAINER.value, connection=connection)
 
-        tree = cache.get(cache_key_response)
+        def fetch():
+            self.verbose_log("Requesting from USPS\n%s", request)
+            self._process_request(connection, request)
+            self.verbose_log("Got from USPS:\n%s", self.raw)
+            return self.raw
 
-        if (last_request != request) or tree is None:
-            self.verbose_log("Requesting from USPS [%s]\n%s", cache_key_request, request)
-            cache.set(cache_key_request, request, 60)
-            tree = self._process_request(connection, request)
-            self.verbose_log("Got from USPS [%s]:\n%s", cache_key_response, self.raw)
-            needs_cache = True
-        else:
-            needs_cache = False
+        self.raw = self.cached_quote(fingerprint, fetch, ok=_response_ok)
+        tree = fromstring(self.raw)
 
         errors = tree.getiterator('Error')
 
@@ -302,8 +307,6 @@ class Shipper(BaseShipper):
                             self._calculated = True
                             self.exact_date = True
 
-                            #if needs_cache:
-                            #    cache.set(cache_key_response, tree, 60)
             else:
                 for package in all_packages:
                     for postage in package.getiterator('Postage'):
@@ -314,7 +317,14 @@ class Shipper(BaseShipper):
                             # Now try to figure out how long it would take for this delivery
                             if self.api:
                                 delivery = self.render_template('shipping/usps/delivery.xml', cart, contact)
-                                del_tree = self._process_request(connection, delivery, self.api)
+                                fingerprint = self.quote_fingerprint(cart, contact, service=self.api,
+                                    connection=connection)
+
+                                def fetch_delivery():
+                                    self._process_request(connection, delivery, self.api)
+                                    return self.raw
+
+                                del_tree = fromstring(self.cached_quote(fingerprint, fetch_delivery, ok=_response_ok))
                                 parent = '%sResponse' % self.api
                                 del_iter = del_tree.getiterator(parent)
 
@@ -333,8 +343,6 @@ class Shipper(BaseShipper):
                             self.is_valid = True
                             self._calculated = True
 
-                            #if needs_cache:
-                            #    cache.set(cache_key_response, tree, 60)
         else:
             error = errors[0]
             err_num = error.find('.//Number').text
@@ -0,0 +1,273 @@
+"""
+Packs the shippable products of a cart into parcels for the shippers.
+
+The weight and dimensions of a product are read once per cart line, and
+converted to the units of the packing. A `Parcel` stands for `count`
+identical boxes, so that a line of 500 units is packed as one parcel of 500
+boxes instead of 500 list entries as by `Cart.get_shipment_list`.
+
+There are three ways to pack a cart:
+
+- `pack_each`: every unit in its own box, as the carriers always did
+- `pack_single`: everything in a single box
+- `pack_boxes`: first-fit decreasing bin packing into boxes weighing at most
+  a given weight
+
+`pack_cart` picks between them from the SHIPPING PACKING_MAX_WEIGHT setting,
+and reuses the parcels of a cart for all of its shippers.
+"""
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR
+from livesettings import config_value
+import logging
+
+log = logging.getLogger('shipping.packing')
+
+# the size of the units, in kilograms and centimeters
+WEIGHT_UNITS = {
+    'kg': Decimal('1'),
+    'g': Decimal('0.001'),
+    'lb': Decimal('0.45359237'),
+    'oz': Decimal('0.028349523125'),
+}
+LENGTH_UNITS = {
+    'cm': Decimal('1'),
+    'mm': Decimal('0.1'),
+    'm': Decimal('100'),
+    'in': Decimal('2.54'),
+    'ft': Decimal('30.48'),
+}
+PRECISION = Decimal('0.01')
+
+def _units(units, table):
+    if not units:
+        return None
+    units = units.strip().lower()
+    if units not in table and units.endswith('s') and units[:-1] in table:
+        units = units[:-1]
+    return units
+
+def _convert(value, units, to_units, table):
+    units = _units(units, table)
+    to_units = _units(to_units, table)
+    if value is None or not units or not to_units or units == to_units:
+        return value
+    try:
+        factor = table[units] / table[to_units]
+    except KeyError:
+        log.warn('Cannot convert from %s to %s', units, to_units)
+        return value
+    return (value * factor).quantize(PRECISION)
+
+def convert_weight(value, units, to_units):
+    """Convert a weight from `units` to `to_units`, such as 'kg' or 'lb'."""
+    return _convert(value, units, to_units, WEIGHT_UNITS)
+
+def convert_length(value, units, to_units):
+    """Convert a length from `units` to `to_units`, such as 'cm' or 'in'."""
+    return _convert(value, units, to_units, LENGTH_UNITS)
+
+class PackedItem(object):
+    """A shippable cart line, with the weight and dimensions of its product
+    read once."""
+
+    def __init__(self, cartitem):
+        product = cartitem.product
+        self.product = product
+        self.name = product.name
+        self.quantity = int(cartitem.quantity.quantize(Decimal('0'), ROUND_CEILING))
+        self.unit_price = cartitem.unit_price
+        self.weight = product.smart_attr('weight')
+        self.weight_units = _units(product.smart_attr('weight_units'), WEIGHT_UNITS)
+        self.length_units = _units(product.smart_attr('length_units'), LENGTH_UNITS)
+        self.dimensions = []
+        for attr in ('length', 'width', 'height'):
+            value = product.smart_attr(attr)
+            if value is None:
+                self.dimensions = None
+                break
+            units = product.smart_attr('%s_units' % attr) or self.length_units
+            self.dimensions.append((value, units))
+
+    def convert(self, weight_units, length_units):
+        """Convert the weight and dimensions to the units of the packing."""
+        self.weight = convert_weight(self.weight, self.weight_units, weight_units)
+        self.weight_units = weight_units
+        if self.dimensions is not None:
+            self.dimensions = [convert_length(value, units, length_units)
+                for value, units in self.dimensions]
+        self.length_units = length_units
+
+class Parcel(object):
+    """`count` identical boxes, each holding `items`, a list of
+    (`PackedItem`, quantity) pairs. The weight, value and dimensions are the
+    ones of each box."""
+
+    def __init__(self, weight_units, length_units, count=1):
+        self.weight_units = weight_units
+        self.length_units = length_units
+        self.count = count
+        self.items = []
+        self.weight = Decimal('0')
+        self.value = Decimal('0')
+        self.missing_weight = False
+        # only known for the boxes holding a single product
+        self.length = self.width = self.height = None
+
+    def add(self, item, quantity):
+        self.items.append((item, quantity))
+        if item.weight is None:
+            self.missing_weight = True
+        else:
+            self.weight += item.weight * quantity
+        self.value += item.unit_price * quantity
+        if len(self.items) == 1 and quantity == 1 and item.dimensions:
+            self.length, self.width, self.height = item.dimensions
+        else:
+            self.length = self.width = self.height = None
+
+    def split(self, count):
+        """Take `count` of the boxes of the parcel apart, as a new parcel."""
+        other = Parcel(self.weight_units, self.length_units, count=count)
+        other.items = list(self.items)
+        other.weight = self.weight
+        other.value = self.value
+        other.missing_weight = self.missing_weight
+        other.length, other.width, other.height = self.length, self.width, self.height
+        self.count -= count
+        return other
+
+    def _has_full_weight(self):
+        return not self.missing_weight and self.weight_units is not None
+    has_full_weight = property(_has_full_weight)
+
+    def _has_full_dimensions(self):
+        return self.length is not None and self.length_units is not None
+    has_full_dimensions = property(_has_full_dimensions)
+
+    def _get_name(self):
+        return u', '.join([item.name for item, quantity in self.items])
+    name = property(_get_name)
+
+    def _get_boxes(self):
+        """The parcel repeated for each of its boxes, for the carriers which
+        need a line per box."""
+        return [self] * self.count
+    boxes = property(_get_boxes)
+
+    def __repr__(self):
+        return '<Parcel: %i x %s %s>' % (self.count, self.weight, self.weight_units)
+
+def shipment_items(cart, weight_units=None, length_units=None):
+    """Get the shippable lines of a cart as `PackedItem` objects, converted
+    to `weight_units` and `length_units`, which default to the units of the
+    first product which has them."""
+    items = [PackedItem(cartitem) for cartitem in cart if cartitem.is_shippable]
+    for item in items:
+        weight_units = weight_units or item.weight_units
+        length_units = length_units or item.length_units
+    for item in items:
+        item.convert(weight_units, length_units)
+    return items
+
+def _units_of(items):
+    if items:
+        return items[0].weight_units, items[0].length_units
+    return None, None
+
+def pack_each(items):
+    """Pack every unit in its own box."""
+    parcels = []
+    weight_units, length_units = _units_of(items)
+    for item in items:
+        parcel = Parcel(weight_units, length_units, count=item.quantity)
+        parcel.add(item, 1)
+        parcels.append(parcel)
+    return parcels
+
+def pack_single(items):
+    """Pack everything in a single box."""
+    parcel = Parcel(*_units_of(items))
+    for item in items:
+        parcel.add(item, item.quantity)
+    return [parcel]
+
+def pack_boxes(items, max_weight):
+    """Pack the items in as few boxes weighing at most `max_weight` as it
+    can, by first-fit decreasing: the heaviest items first, each unit in the
+    first box it fits in. An item heavier than `max_weight` has a box of its
+    own.
+
+    The boxes filled with the same number of units of an item are grouped in
+    one parcel, which keeps the packing linear in the number of lines."""
+    weight_units, length_units = _units_of(items)
+    boxes = []
+    items = list(items)
+    items.sort(key=lambda item: item.weight or 0, reverse=True)
+    for item in items:
+        remaining = item.quantity
+        weight = item.weight or 0
+        ix = 0
+        while remaining and ix < len(boxes):
+            parcel = boxes[ix]
+            if weight:
+                fits = int(((max_weight - parcel.weight) / weight).to_integral_value(ROUND_FLOOR))
+            else:
+                fits = remaining
+            if fits > 0:
+                # the identical boxes of the parcel are filled one after the
+                # other, the last one with what is left
+                filled = min(parcel.count, remaining // fits)
+                if filled:
+                    if filled < parcel.count:
+                        boxes.insert(ix + 1, parcel.split(parcel.count - filled))
+                    parcel.add(item, fits)
+                    remaining -= filled * fits
+                else:
+                    if parcel.count > 1:
+                        boxes.insert(ix + 1, parcel.split(parcel.count - 1))
+                    parcel.add(item, remaining)
+                    remaining = 0
+            ix += 1
+        if not remaining:
+            continue
+
+        if weight:
+            per_box = max(1, int((max_weight / weight).to_integral_value(ROUND_FLOOR)))
+        else:
+            per_box = remaining
+        if remaining >= per_box:
+            parcel = Parcel(weight_units, length_units, count=remaining // per_box)
+            parcel.add(item, per_box)
+            boxes.append(parcel)
+            remaining = remaining % per_box
+        if remaining:
+            parcel = Parcel(weight_units, length_units)
+            parcel.add(item, remaining)
+            boxes.append(parcel)
+    return boxes
+
+def pack_cart(cart, single_box=False, weight_units=None, length_units=None):
+    """Get the parcels of a cart, in `weight_units` and `length_units`,
+    packed as set in the SHIPPING settings or in a single box.
+
+    The parcels are reused by all the shippers for the life of the cart
+    object."""
+    cache = getattr(cart, '_parcels_cache', None)
+    if cache is None:
+        cache = cart._parcels_cache = {}
+    key = (single_box, weight_units, length_units)
+    if key not in cache:
+        items = shipment_items(cart, weight_units=weight_units, length_units=length_units)
+        max_weight = config_value('SHIPPING', 'PACKING_MAX_WEIGHT')
+        if single_box:
+            parcels = pack_single(items)
+        elif max_weight:
+            max_units = config_value('SHIPPING', 'PACKING_WEIGHT_UNITS')
+            parcels = pack_boxes(items, convert_weight(max_weight, max_units, _units_of(items)[0]))
+        else:
+            parcels = pack_each(items)
+        cache[key] = parcels
+    return cache[key]
+
+def count_boxes(parcels):
+    return sum([parcel.count for parcel in parcels])
@@ -0,0 +1,185 @@
+"""
+Calculates the shipping methods offered for a cart.
+
+The methods of carriers quoting through a remote service (UPS, USPS, FedEx,
+Canada Post...) are calculated concurrently, by a bounded pool of threads
+shared by the requests of the process, so that checkout waits for the
+slowest carrier instead of for all of them in turn. The service types of a
+carrier are calculated one after the other by the same thread, which sends
+identical requests to the carrier only once. A carrier which fails, or which
+doesn't answer within its timeout, is dropped from the choices.
+
+Other methods are calculated in the calling thread.
+"""
+from django.db import connection
+from django.utils import translation
+from livesettings import config_value
+from threaded_multihost import threadlocals
+import logging
+import Queue
+import threading
+import time
+
+log = logging.getLogger('shipping.quoting')
+
+# how often the coordinator checks on the running carriers, in seconds
+POLL_INTERVAL = 0.05
+
+class CarrierQuote(object):
+    """The methods of a carrier, calculated by a single thread."""
+
+    def __init__(self, carrier, methods, timeout):
+        self.carrier = carrier
+        self.methods = methods
+        self.timeout = timeout
+        self.started = None
+        self.failed = False
+        self.cancelled = False
+        self.done = threading.Event()
+
+    def _share_requests(self, method):
+        """Make the identical requests the service types of the carrier send
+        to its service answered by a single call."""
+        process = getattr(method, '_process_request', None)
+        if process is None:
+            return
+
+        def shared(*args, **kwargs):
+            key = args + tuple(sorted(kwargs.items()))
+            if key not in self.responses:
+                self.responses[key] = (process(*args, **kwargs), getattr(method, 'raw', None))
+            response, method.raw = self.responses[key]
+            return response
+
+        method._process_request = shared
+
+    def calculate(self, cart, contact):
+        self.started = time.time()
+        self.responses = {}
+        try:
+            for method in self.methods:
+                self._share_requests(method)
+                try:
+                    method.calculate(cart, contact)
+                finally:
+                    method.__dict__.pop('_process_request', None)
+        except Exception, e:
+            log.error('Could not get shipping quotes from %s: %s', self.carrier, e)
+            self.failed = True
+        self.done.set()
+
+    def expired(self, now, begin):
+        """Whether the carrier didn't answer within its timeout, counted from
+        the time it started, or from `begin` while it waits for a thread."""
+        return now > (self.started or begin) + self.timeout
+
+class QuoteWorkers(object):
+    """A queue of carrier quotes, and the threads calculating them, reused
+    by all the requests.
+
+    A carrier which doesn't answer keeps its thread busy until its requests
+    time out, after the quote timeout (see `BaseShipper.open_url`), so the
+    threads are bounded by the QUOTE_THREADS setting, and the quotes queued
+    meanwhile wait for a free thread within their timeout.
+    """
+
+    def __init__(self):
+        self.tasks = Queue.Queue()
+        self.threads = []
+        self.idle = 0
+        self.lock = threading.Lock()
+
+    def put(self, quote, cart, contact):
+        # run with the language and the request of the thread which queued it
+        variables = {}
+        for key in ('request', 'user'):
+            variables[key] = threadlocals.get_thread_variable(key, None)
+        self.lock.acquire()
+        try:
+            self.tasks.put((quote, cart, contact, translation.get_language(), variables))
+            self._start()
+        finally:
+            self.lock.release()
+
+    def _start(self):
+        self.threads = [thread for thread in self.threads if thread.isAlive()]
+        count = max(1, config_value('SHIPPING', 'QUOTE_THREADS'))
+        while len(self.threads) < count and self.idle < self.tasks.qsize():
+            thread = threading.Thread(target=self._run)
+            # a carrier which doesn't answer can't hold the process
+            thread.setDaemon(True)
+            self.idle += 1
+            thread.start()
+            self.threads.append(thread)
+
+    def _run(self):
+        while True:
+            quote, cart, contact, language, variables = self.tasks.get()
+            self.lock.acquire()
+            self.idle -= 1
+            self.lock.release()
+            try:
+                if not quote.cancelled:
+                    translation.activate(language)
+                    for key, value in variables.items():
+                        threadlocals.set_thread_variable(key, value)
+                    quote.calculate(cart, contact)
+            finally:
+                translation.deactivate()
+                connection.close()
+                self.lock.acquire()
+                self.idle += 1
+                self.lock.release()
+
+workers = QuoteWorkers()
+
+def calculate_methods(methods, cart, contact):
+    """Calculate the shipping methods for a cart and contact.
+
+    Returns the methods which could be calculated, in their original order.
+    Whether they are valid for the cart has to be checked by the caller.
+    """
+    carriers = {}
+    local = []
+    for method in methods:
+        if getattr(method, 'remote_quotes', False):
+            # every carrier has its own shipper class
+            carriers.setdefault(method.__class__, []).append(method)
+        else:
+            local.append(method)
+
+    quotes = []
+    if carriers:
+        begin = time.time()
+        default_timeout = config_value('SHIPPING', 'QUOTE_TIMEOUT')
+        for carrier, carrier_methods in carriers.items():
+            timeout = getattr(carrier_methods[0], 'quote_timeout', None) or default_timeout
+            quote = CarrierQuote(carrier, carrier_methods, timeout)
+            quotes.append(quote)
+            workers.put(quote, cart, contact)
+
+    # the other methods are calculated while waiting for the carriers
+    for method in local:
+        method.calculate(cart, contact)
+
+    dropped = set()
+    waiting = quotes
+    while waiting:
+        now = time.time()
+        running = []
+        for quote in waiting:
+            if quote.done.isSet():
+                if quote.failed:
+                    dropped.update([id(method) for method in quote.methods])
+            elif quote.expired(now, begin):
+                quote.cancelled = True
+                log.warning('Gave up waiting for shipping quotes from %s after %s seconds',
+                    quote.carrier, quote.timeout)
+                dropped.update([id(method) for method in quote.methods])
+            else:
+                running.append(quote)
+        waiting = running
+        if waiting:
+            waiting[0].done.wait(POLL_INTERVAL)
+
+    return [method for method in methods if id(method) not in dropped]
@@ -1,11 +1,23 @@
 from decimal import Decimal
 from django.contrib.sites.models import Site
 from django.test import TestCase
+from l10n.models import Country
+from livesettings import config_value
 from product.models import Product
+from satchmo_store.contact.models import AddressBook, Contact
 from satchmo_store.shop.models import Cart
 from shipping.modules.flat.shipper import Shipper as flat
+from shipping.modules.base import BaseShipper, QuoteError, get_quote_stats
 from shipping.modules.per.shipper import Shipper as per
+from shipping.packing import count_boxes, pack_boxes, pack_cart, pack_each, pack_single, shipment_items
+from shipping import quoting
+from shipping.quoting import calculate_methods
+from shipping.utils import ShippingCosts
 import keyedcache
+import socket
+import threading
+import time
+import urllib2
 
 class ShippingBaseTest(TestCase):
 
@@ -28,3 +40,196 @@ class ShippingBaseTest(TestCase):
         self.assert_(self.cart1.is_shippable)
         self.assertEqual(flat(self.cart1, None).cost(), Decimal("4.00"))
         self.assertEqual(per(self.cart1, None).cost(), Decimal("12.00"))
+
+    def test_shipping_costs(self):
+        costs = ShippingCosts()
+        for method in (per(self.cart1, None), flat(self.cart1, None)):
+            costs.add(method, method.cost(), Decimal("1.00"), method.cost() - Decimal("1.00"))
+        self.assertEqual(costs.sorted_keys(), ['FlatRate', 'PerItem'])
+        self.assertEqual(costs['PerItem'], {'cost': Decimal("12.00"), 'discount': Decimal("1.00"),
+            'final': Decimal("11.00")})
+
+        self.assertEqual(costs.labels['FlatRate']['method'], flat().method())
+
+        cheapest = costs.only(['FlatRate'])
+        self.assertEqual(cheapest.keys(), ['FlatRate'])
+        self.assertEqual(cheapest.labels.keys(), ['FlatRate'])
+
+    def test_quote_cache(self):
+        get_quote_stats(reset=True)
+        us = Country.objects.get(iso2_code='US')
+        contacts = []
+        for name, postal_code in (('one', '44113'), ('two', '44113 '), ('three', '44114')):
+            contact = Contact.objects.create(first_name=name, last_name='Customer')
+            AddressBook.objects.create(contact=contact, addressee=name, street1='1 %s St' % name,
+                city='Cleveland', state='OH', postal_code=postal_code, country=us,
+                is_default_shipping=True)
+            contacts.append(contact)
+        cart2 = Cart.objects.create(site=self.site)
+        cart2.add_item(self.product1, 3)
+
+        carrier = CachedCarrier('ground')
+        carrier.calculate(self.cart1, contacts[0])
+        # an identical cart shipped to the same postal code
+        carrier.calculate(cart2, contacts[1])
+        self.assertEqual(carrier.requests, 1)
+        carrier.calculate(cart2, contacts[2])
+        cart2.add_item(self.product1, 1)
+        carrier.calculate(cart2, contacts[1])
+        self.assertEqual(carrier.requests, 3)
+
+        # a carrier which is down isn't asked again for a while
+        down = CachedDownCarrier('air')
+        self.assertRaises(IOError, down.calculate, self.cart1, contacts[0])
+        self.assertRaises(QuoteError, down.calculate, self.cart1, contacts[0])
+        self.assertEqual(down.requests, 1)
+
+        stats = get_quote_stats()
+        self.assertEqual(stats['shipping.tests'], {'hits': 2, 'misses': 4, 'errors': 1})
+
+class PackingTest(TestCase):
+
+    fixtures = ['l10n-data.yaml','test_shop.yaml']
+
+    def setUp(self):
+        site = Site.objects.get_current()
+        heavy = Product.objects.create(slug='heavy', name='heavy', site=site,
+            weight=Decimal('4'), weight_units='kg',
+            length=Decimal('10'), width=Decimal('10'), height=Decimal('10'), length_units='cm')
+        light = Product.objects.create(slug='light', name='light', site=site,
+            weight=Decimal('2.2'), weight_units='lb')
+        self.cart = Cart.objects.create(site=site)
+        self.cart.add_item(heavy, 3)
+        self.cart.add_item(light, 500)
+
+    def tearDown(self):
+        keyedcache.cache_delete()
+
+    def test_pack_each(self):
+        parcels = pack_each(shipment_items(self.cart))
+        self.assertEqual([(p.count, p.weight, p.weight_units) for p in parcels],
+            [(3, Decimal('4'), 'kg'), (500, Decimal('1.00'), 'kg')])
+        self.assertEqual(count_boxes(parcels), 503)
+        self.assert_(parcels[0].has_full_dimensions)
+        self.failIf(parcels[1].has_full_dimensions)
+        self.assert_(pack_cart(self.cart) is pack_cart(self.cart))
+
+    def test_pack_single(self):
+        parcels = pack_single(shipment_items(self.cart, weight_units='lb'))
+        self.assertEqual(len(parcels), 1)
+        self.assertEqual(parcels[0].weight, Decimal('1126.46'))
+        self.failIf(parcels[0].has_full_dimensions)
+
+    def test_pack_boxes(self):
+        parcels = pack_boxes(shipment_items(self.cart), Decimal('10'))
+        self.assertEqual([(p.count, p.weight) for p in parcels],
+            [(1, Decimal('10.00')), (1, Decimal('10.00')), (49, Decimal('10.00')), (1, Decimal('2.00'))])
+        self.assertEqual(count_boxes(parcels), 52)
+
+        # the items heavier than a box are shipped alone
+        parcels = pack_boxes(shipment_items(self.cart), Decimal('3'))
+        self.assertEqual([p.count for p in parcels], [3, 166, 1])
+
+    def test_pack_boxes_mixed(self):
+        site = Site.objects.get_current()
+        cart = Cart.objects.create(site=site)
+        for slug, weight, quantity in (('six', '6', 2), ('four', '4', 2), ('three', '3', 3), ('one', '1', 3)):
+            product = Product.objects.create(slug=slug, name=slug, site=site,
+                weight=Decimal(weight), weight_units='lb')
+            cart.add_item(product, quantity)
+
+        # the lighter items fill the room left in the boxes of the heavier ones
+        parcels = pack_boxes(shipment_items(cart), Decimal('10'))
+        self.assertEqual([(p.count, p.weight) for p in parcels],
+            [(2, Decimal('10')), (1, Decimal('10')), (1, Decimal('2'))])
+        self.assertEqual([[(item.name, quantity) for item, quantity in p.items] for p in parcels],
+            [[('six', 1), ('four', 1)], [('three', 3), ('one', 1)], [('one', 2)]])
+
+class FakeCarrier(BaseShipper):
+    remote_quotes = True
+    quote_timeout = 1
+    fails = False
+
+    def __init__(self, service):
+        self.service = service
+        self.id = '%s-%s' % (self.__class__.__name__, service)
+        self.requests = 0
+
+    def _process_request(self, connection, request):
+        self.requests += 1
+        if self.fails:
+            raise IOError('Carrier is down')
+        return 'rates for %s' % request
+
+    def calculate(self, cart, contact):
+        self.response = self._process_request('http://example.com', 'cart %s' % cart)
+        self._calculated = True
+
+class FastCarrier(FakeCarrier):
+    pass
+
+class SlowCarrier(FakeCarrier):
+    """A carrier which only answers once it is released."""
+    quote_timeout = 0.1
+    released = threading.Event()
+
+    def _process_request(self, connection, request):
+        self.released.wait()
+        return super(SlowCarrier, self)._process_request(connection, request)
+
+class DownCarrier(FakeCarrier):
+    fails = True
+
+class CachedCarrier(FakeCarrier):
+
+    def calculate(self, cart, contact):
+        fingerprint = self.quote_fingerprint(cart, contact, service=self.service)
+        fetch = lambda: self._process_request('http://example.com', 'cart')
+        self.response = self.cached_quote(fingerprint, fetch)
+        self._calculated = True
+
+class CachedDownCarrier(CachedCarrier):
+    fails = True
+
+class QuotingTest(TestCase):
+
+    def tearDown(self):
+        SlowCarrier.released.set()
+
+    def test_calculate_methods(self):
+        SlowCarrier.released.clear()
+        fast = [FastCarrier('ground'), FastCarrier('air')]
+        methods = fast + [SlowCarrier('ground'), DownCarrier('ground')]
+        # the slow carrier, which can't answer yet, is given up, the failing one dropped
+        calculated = calculate_methods(methods, 'A', None)
+        self.assertEqual([method.id for method in calculated], ['FastCarrier-ground', 'FastCarrier-air'])
+        self.assertEqual([method.response for method in calculated], ['rates for cart A'] * 2)
+
+        # identical requests of the service types were sent once
+        self.assertEqual(sum([method.requests for method in fast]), 1)
+
+        # the threads are reused by the next quotes
+        SlowCarrier.released.set()
+        fast = [FastCarrier('ground')]
+        calculated = calculate_methods(fast + [DownCarrier('ground')], 'B', None)
+        self.assertEqual([method.response for method in calculated], ['rates for cart B'])
+        self.assert_(len(quoting.workers.threads) <= config_value('SHIPPING', 'QUOTE_THREADS'))
+
+    def test_open_url_timeout(self):
+        # a carrier service which accepts the connection, but never answers
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        try:
+            carrier = SlowCarrier('ground')
+            url = 'http://127.0.0.1:%i/rates' % server.getsockname()[1]
+            start = time.time()
+            try:
+                carrier.open_url(urllib2.Request(url=url, data='cart')).read()
+            except (IOError, socket.error):
+                pass
+            else:
+                self.fail('The request should have timed out')
+            self.assert_(time.time() - start < 5)
+        finally:
+            server.close()
@@ -0,0 +1,181 @@
+"""
+Compiled tier tables for the tiered shipping carriers.
+
+Each tier module compiles the tiers and translations of all of its carriers
+in memory, so that quoting a cart doesn't query the database. The tiers are
+sorted by their threshold and searched by bisection.
+
+The compiled tiers are rebuilt when a tier, carrier or translation is saved
+or deleted in any process, through a version kept in the cache, and when one
+of the tiers expires.
+"""
+from bisect import bisect_left, bisect_right
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, m2m_changed
+from django.utils.translation import get_language
+import datetime
+import keyedcache
+import logging
+import time
+
+log = logging.getLogger('shipping.tiers')
+
+class TierTable(object):
+    """The tiers of a carrier, each a threshold and a value. The tiers which
+    expire take precedence over the others until they do."""
+
+    def __init__(self, today):
+        self.today = today
+        self.expiring = []
+        self.permanent = []
+        # the last day the table is valid for
+        self.valid_until = None
+
+    def add(self, threshold, value, expires=None):
+        if expires is None:
+            self.permanent.append((threshold, value))
+        elif expires >= self.today:
+            self.expiring.append((threshold, value))
+            if self.valid_until is None or expires < self.valid_until:
+                self.valid_until = expires
+
+    def compile(self):
+        """Sort the tiers, once they are all added."""
+        for attr in ('expiring', 'permanent'):
+            rows = getattr(self, attr)
+            rows.sort(key=lambda row: row[0])
+            setattr(self, attr, ([row[0] for row in rows], [row[1] for row in rows]))
+
+    def floor(self, key):
+        """Get the value of the tier with the highest threshold at most `key`,
+        or None."""
+        for thresholds, values in (self.expiring, self.permanent):
+            ix = bisect_right(thresholds, key)
+            if ix:
+                return values[ix - 1]
+        return None
+
+    def ceiling(self, key):
+        """Get the value of the tier with the lowest threshold at least `key`,
+        or None."""
+        for thresholds, values in (self.expiring, self.permanent):
+            ix = bisect_left(thresholds, key)
+            if ix < len(thresholds):
+                return values[ix]
+        return None
+
+class CompiledTiers(object):
+    """The tier tables and translations of the carriers of a module, by the
+    primary key of the object they belong to."""
+
+    def __init__(self, today, version):
+        self.date = today
+        self.version = version
+        self.tables = {}
+        self.translations = {}
+
+    def add_tier(self, pk, threshold, value, expires=None):
+        table = self.tables.get(pk, None)
+        if table is None:
+            table = self.tables[pk] = TierTable(self.date)
+        table.add(threshold, value, expires)
+
+    def add_translation(self, pk, language_code, translation):
+        self.translations.setdefault(pk, []).append((language_code, translation))
+
+    def compile(self):
+        self.valid_until = None
+        for table in self.tables.values():
+            table.compile()
+            if table.valid_until and (self.valid_until is None or table.valid_until < self.valid_until):
+                self.valid_until = table.valid_until
+
+    def covers(self, today):
+        return self.date <= today and (self.valid_until is None or today <= self.valid_until)
+
+    def table(self, pk):
+        table = self.tables.get(pk, None)
+        if table is None:
+            table = self.tables[pk] = TierTable(self.date)
+            table.compile()
+        return table
+
+    def translation(self, pk, language_code=None):
+        """Get the translation of an object, looking up by language code,
+        falling back to the root language, to the default language, and to
+        any translation."""
+        translations = self.translations.get(pk, None)
+        if not translations:
+            return None
+        if not language_code:
+            language_code = get_language()
+
+        codes = [language_code]
+        pos = language_code.find('-')
+        if pos > -1:
+            codes.append(language_code[:pos])
+        for code in codes:
+            for translation_code, translation in translations:
+                if translation_code == code:
+                    return translation
+
+        default = settings.LANGUAGE_CODE.lower()
+        for translation_code, translation in translations:
+            if translation_code.lower().startswith(default):
+                return translation
+        return translations[0][1]
+
+# the compiled tiers of each module in this process
+_compiled = {}
+
+def _version(name):
+    try:
+        return keyedcache.cache_get('shipping', 'tiers', name, 'version')
+    except keyedcache.NotCachedError:
+        return None
+
+def invalidate_tiers(name):
+    """Make the tiers of the `name` module compile again on their next use,
+    in all the processes."""
+    _compiled.pop(name, None)
+    version = _version(name) or 0
+    keyedcache.cache_set('shipping', 'tiers', name, 'version',
+        value=max(version + 1, int(time.time() * 1000)))
+
+def get_compiled_tiers(name, build):
+    """Get the `CompiledTiers` of the `name` module, filled by `build(compiled)`
+    when they have to be compiled again."""
+    today = datetime.date.today()
+    compiled = _compiled.get(name, None)
+
+    version = _version(name)
+    if version is None:
+        if keyedcache.cache_enabled():
+            # start from the clock, so that an evicted version is never reused
+            version = int(time.time() * 1000)
+            keyedcache.cache_set('shipping', 'tiers', name, 'version', value=version)
+        elif compiled is not None:
+            # only this process can invalidate the tiers
+            version = compiled.version
+
+    if compiled is None or compiled.version != version or not compiled.covers(today):
+        compiled = CompiledTiers(today, version)
+        build(compiled)
+        compiled.compile()
+        log.debug('Compiled %i %s tier tables', len(compiled.tables), name)
+        _compiled[name] = compiled
+    return compiled
+
+def listen_for_tier_changes(name, *models):
+    """Compile the tiers of the `name` module again when any of `models`, or
+    their many to many relations, change."""
+    def invalidate_listener(sender, **kwargs):
+        invalidate_tiers(name)
+
+    for model in models:
+        uid = 'shipping.tiers.%s.%s' % (name, model.__name__)
+        post_save.connect(invalidate_listener, sender=model, weak=False, dispatch_uid=uid)
+        post_delete.connect(invalidate_listener, sender=model, weak=False, dispatch_uid=uid)
+        for field in model._meta.many_to_many:
+            m2m_changed.connect(invalidate_listener, sender=field.rel.through, weak=False,
+                dispatch_uid='%s.%s' % (uid, field.name))
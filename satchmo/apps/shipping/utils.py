@@ -13,3 +13,34 @@ def update_shipping(order, shipping, contact, cart):
     order.shipping_method = shipper.method()
     order.shipping_cost = shipper.cost()
     order.shipping_model = shipping
+
+class ShippingCosts(dict):
+    """The costs of the shipping methods offered for a cart, as a dictionary
+    of {method id: {'cost', 'discount', 'final'[, 'taxedcost', 'tax']}}, which
+    also remembers the labels of the methods."""
+
+    def __init__(self, *args, **kwargs):
+        super(ShippingCosts, self).__init__(*args, **kwargs)
+        self.labels = {}
+
+    def add(self, method, cost, discount, final):
+        self[method.id] = {'cost' : cost, 'discount' : discount, 'final' : final}
+        self.labels[method.id] = {
+            'description' : method.description(),
+            'method' : method.method(),
+            'expected_delivery' : method.expectedDelivery(),
+        }
+        return self[method.id]
+
+    def only(self, keys):
+        """Get the costs of the methods in `keys`."""
+        costs = ShippingCosts([(key, self[key]) for key in keys])
+        costs.labels = dict([(key, self.labels[key]) for key in keys if key in self.labels])
+        return costs
+
+    def sorted_keys(self):
+        """The method ids, from the lowest cost to the highest."""
+        costs = [(value['cost'], key) for key, value in self.items()]
+        costs.sort()
+        return [key for cost, key in costs]
+
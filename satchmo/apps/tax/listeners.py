@@ -0,0 +1,20 @@
+from django.db.models.signals import post_delete, post_save
+from product.models import TaxClass
+from tax.utils import invalidate_tax_rates
+import logging
+
+log = logging.getLogger('tax.listeners')
+
+def invalidate_rates_listener(sender, **kwargs):
+    """Make the tax processors resolve their rates again after a change to
+    the tax classes or rates."""
+    invalidate_tax_rates()
+
+def listen_for_rate_changes(*models):
+    """Forget the cached tax rates when any of `models` is changed."""
+    for model in models:
+        post_save.connect(invalidate_rates_listener, sender=model)
+        post_delete.connect(invalidate_rates_listener, sender=model)
+
+def start_default_listening():
+    listen_for_rate_changes(TaxClass)
@@ -1 +1,4 @@
 import config
+
+import listeners
+listeners.start_default_listening()
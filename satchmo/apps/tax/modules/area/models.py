@@ -38,3 +38,5 @@ class TaxRate(models.Model):
         
 import config
 
+from tax.listeners import listen_for_rate_changes
+listen_for_rate_changes(TaxRate)
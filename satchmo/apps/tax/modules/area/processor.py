@@ -7,6 +7,7 @@ from models import TaxRate
 from product.models import TaxClass
 from satchmo_store.contact.models import Contact
 from satchmo_utils import is_string_like
+from tax.utils import cached_location, cached_rate, taxclass_key
 import logging
 
 log = logging.getLogger('tax.area')
@@ -24,6 +25,19 @@ class Processor(object):
         self.user = user
         
     def _get_location(self):
+        calc_by_ship_address = bool(config_value('TAX','TAX_AREA_ADDRESS') == 'ship')
+        if self.order:
+            if calc_by_ship_address:
+                source = ('order', self.order.ship_country, self.order.ship_state)
+            else:
+                source = ('order', self.order.bill_country, self.order.bill_state)
+        elif self.user and self.user.is_authenticated():
+            source = ('user', self.user.pk, calc_by_ship_address)
+        else:
+            source = ('default',)
+        return cached_location(self, source, self._find_location)
+
+    def _find_location(self):
         area=country=None
         calc_by_ship_address = bool(config_value('TAX','TAX_AREA_ADDRESS') == 'ship')
         if self.order:
@@ -87,10 +101,23 @@ class Processor(object):
     def get_rate(self, taxclass=None, area=None, country=None, get_object=False, **kwargs):
         if not taxclass:
             taxclass = "Default"
-        rate = None
         if not (area or country):
             area, country = self._get_location()
-            
+
+        key = (area and area.pk, country and country.pk, taxclass_key(taxclass))
+        rate = cached_rate(self, key, lambda: self._find_rate(taxclass, area, country))
+
+        log.debug("Got rate [%s] = %s", taxclass, rate)
+        if get_object:
+            return rate
+        else:
+            if rate:
+                return rate.percentage
+            else:
+                return Decimal("0.00")
+
+    def _find_rate(self, taxclass, area, country):
+        rate = None
         if is_string_like(taxclass):
             try:
                 taxclass = TaxClass.objects.get(title__iexact=taxclass)
@@ -111,15 +138,8 @@ class Processor(object):
                 
             except TaxRate.DoesNotExist:
                 rate = None
-        
-        log.debug("Got rate [%s] = %s", taxclass, rate)
-        if get_object:
-            return rate
-        else:
-            if rate:
-                return rate.percentage
-            else:
-                return Decimal("0.00")
+
+        return rate
 
     def by_price(self, taxclass, price):
         rate = self.get_rate(taxclass)
@@ -153,8 +173,7 @@ class Processor(object):
             rate = None
             if config_value('TAX','TAX_SHIPPING'):
                 try:
-                    tc = TaxClass.objects.get(title=config_value('TAX', 'TAX_CLASS'))
-                    rate = self.get_rate(taxclass=tc)
+                    rate = self.get_rate(taxclass=config_value('TAX', 'TAX_CLASS'))
                 except:
                     log.error("'Shipping' TaxClass doesn't exist.")
 
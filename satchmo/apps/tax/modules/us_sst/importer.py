@@ -0,0 +1,292 @@
+"""
+Bulk importers for the SST boundary and rate files.
+
+The files are streamed, and each row is compared against the rows already
+imported through its natural key: every field of the row but its end date.
+The existing keys are loaded in a single query before the file is read, so
+the only other queries are the batched inserts of the new rows and updates
+of the changed end dates, all done in one transaction.
+"""
+from datetime import date
+from decimal import Decimal
+from django.db import connection, transaction
+from django.utils.encoding import force_unicode
+from tax.modules.us_sst.models import TaxBoundry, TaxRate
+from tax.utils import invalidate_tax_rates
+import logging
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+log = logging.getLogger('tax.us_sst.importer')
+
+BATCH_SIZE = 1000
+
+def parse_date(value):
+    """Parse a YYYYMMDD date."""
+    return date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+
+def ash_split(arg, qty):
+    """Unfortunately, states don't alwys publish the full SST fields in the
+    boundry files like they are required to. It's a shame really. So this function
+    will force a string to split to 'qty' fields, adding None values as needed to
+    get there.
+    """
+    l = arg.split(',')
+    if len(l) < qty:
+        l.extend([None for x in xrange(qty-len(l))])
+    return l
+
+class ImportStats(object):
+    """What an import did, or would do."""
+
+    def __init__(self):
+        self.total = 0
+        self.new = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.skipped = 0
+
+    def __str__(self):
+        return "New: %d. End date changed: %d. Unchanged: %d" % (self.new, self.updated, self.unchanged)
+
+class BulkImporter(object):
+    """Base class of the importers, which define:
+
+    - `model`
+    - `key_fields`: the fields of the natural key of a row
+    - `parse(line)`: which returns a tuple of the values of `key_fields`
+      followed by the end date, or None to skip the line.
+    """
+    model = None
+    key_fields = ()
+
+    def __init__(self, batch_size=BATCH_SIZE, progress=None):
+        self.batch_size = batch_size
+        # called with the stats every `batch_size` rows
+        self.progress = progress
+        self.fields = [self.model._meta.get_field(name) for name in self.key_fields]
+
+    def key(self, values):
+        return tuple(values)
+
+    def load_keys(self, min_id=None):
+        """Get the existing rows, as a dictionary of {key: (id, end date)},
+        or only the rows after `min_id`."""
+        keys = {}
+        rows = self.model.objects.values_list('id', 'endDate', *self.key_fields)
+        if min_id is not None:
+            rows = rows.filter(id__gt=min_id)
+        for row in rows.order_by('id').iterator():
+            keys[self.key(row[2:])] = (row[0], row[1])
+        return keys
+
+    def run(self, lines, dry_run=False):
+        """Import the lines of a file, returns an `ImportStats`. Nothing is
+        saved if `dry_run` is true."""
+        if dry_run:
+            return self._import(lines, dry_run)
+        stats = transaction.commit_on_success(self._import)(lines, dry_run)
+        # the rows are saved without sending signals
+        invalidate_tax_rates()
+        return stats
+
+    def _import(self, lines, dry_run):
+        stats = ImportStats()
+        existing = self.load_keys()
+        last_id = max([found[0] for found in existing.values()] or [0])
+        # the new rows not inserted yet, by key, in the order of the file
+        inserts = {}
+        order = []
+        # the end dates of the new rows changed after they were inserted
+        late = {}
+        updates = {}
+
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            row = self.parse(line)
+            if row is None:
+                stats.skipped += 1
+                continue
+            values, end = row[:-1], row[-1]
+            key = self.key(values)
+
+            stats.total += 1
+            found = existing.get(key, None)
+            if found is None:
+                stats.new += 1
+                inserts[key] = row
+                order.append(key)
+                # a row repeated in the file is only added once
+                existing[key] = (None, end)
+            elif found[1] != end:
+                # Over time, end dates can change. A new row with a new start
+                # date will also appear. This way, loading a new file correctly
+                # updates the map.
+                stats.updated += 1
+                if found[0] is not None:
+                    updates[found[0]] = end
+                elif key in inserts:
+                    inserts[key] = row
+                else:
+                    late[key] = end
+                existing[key] = (found[0], end)
+            else:
+                stats.unchanged += 1
+
+            if stats.total % self.batch_size == 0:
+                if not dry_run:
+                    self._insert([inserts[k] for k in order])
+                    inserts = {}
+                    order = []
+                if self.progress:
+                    self.progress(stats)
+
+        if not dry_run:
+            self._insert([inserts[k] for k in order])
+            if late:
+                # the ids of the rows inserted by this import
+                for key, found in self.load_keys(min_id=last_id).items():
+                    if key in late:
+                        updates[found[0]] = late[key]
+            self._update(updates)
+            transaction.set_dirty()
+        return stats
+
+    def _insert(self, rows):
+        if not rows:
+            return
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        fields = self.fields + [opts.get_field('endDate')]
+        sql = 'INSERT INTO %s (%s) VALUES (%s)' % (qn(opts.db_table),
+            ', '.join([qn(f.column) for f in fields]),
+            ', '.join(['%s'] * len(fields)))
+        values = [[f.get_db_prep_save(value, connection=connection) for f, value in zip(fields, row)]
+            for row in rows]
+        connection.cursor().executemany(sql, values)
+
+    def _update(self, updates):
+        """Change the end dates of rows, `updates` being {id: end date}."""
+        by_end = {}
+        for pk, end in updates.items():
+            by_end.setdefault(end, []).append(pk)
+        for end, ids in by_end.items():
+            for ix in range(0, len(ids), self.batch_size):
+                self.model.objects.filter(id__in=ids[ix:ix+self.batch_size]).update(endDate=end)
+
+CSV_MAP = (
+    'recordType', 'startDate', 'endDate',
+    'lowAddress', 'highAddress', 'oddEven',
+    'streetPreDirection', 'streetName', 'streetSuffix', 'streetPostDirection',
+    'addressSecondaryAbbr', 'addressSecondaryLow', 'addressSecondaryHigh', 'addressSecondaryOddEven',
+    'cityName', 'zipCode', 'plus4',
+    'zipCodeLow', 'zipExtensionLow', 'zipCodeHigh', 'zipExtensionHigh',
+    'serCode',
+    'fipsStateCode', 'fipsStateIndicator', 'fipsCountyCode', 'fipsPlaceCode', 'fipsPlaceType',
+    'long', 'lat',
+    'special_1_source', 'special_1_code', 'special_1_type',
+    'special_2_source', 'special_2_code', 'special_2_type',
+    'special_3_source', 'special_3_code', 'special_3_type',
+    'special_4_source', 'special_4_code', 'special_4_type',
+    'special_5_source', 'special_5_code', 'special_5_type',
+    'special_6_source', 'special_6_code', 'special_6_type',
+    'special_7_source', 'special_7_code', 'special_7_type',
+    'special_8_source', 'special_8_code', 'special_8_type',
+    'special_9_source', 'special_9_code', 'special_9_type',
+    'special_10_source', 'special_10_code', 'special_10_type',
+    'special_11_source', 'special_11_code', 'special_11_type',
+    'special_12_source', 'special_12_code', 'special_12_type',
+    'special_13_source', 'special_13_code', 'special_13_type',
+    'special_14_source', 'special_14_code', 'special_14_type',
+    'special_15_source', 'special_15_code', 'special_15_type',
+    'special_16_source', 'special_16_code', 'special_16_type',
+    'special_17_source', 'special_17_code', 'special_17_type',
+    'special_18_source', 'special_18_code', 'special_18_type',
+    'special_19_source', 'special_19_code', 'special_19_type',
+    'special_20_source', 'special_20_code', 'special_20_type',
+)
+# Some fields we're not using.
+DELETE_FIELDS = (
+    'long', 'lat',
+    'special_1_source',
+    'special_2_source',
+    'special_3_source',
+    'special_4_source',
+    'special_5_source',
+    'special_6_source',
+    'special_7_source',
+    'special_8_source',
+    'special_9_source',
+    'special_10_source',
+    'special_11_source',
+    'special_12_source',
+    'special_13_source',
+    'special_14_source',
+    'special_15_source',
+    'special_16_source',
+    'special_17_source',
+    'special_18_source',
+    'special_19_source',
+    'special_20_source',
+)
+
+class BoundryImporter(BulkImporter):
+    """Imports a CSV boundary file from the SST website.
+
+    Address records are skipped, Zip+4 is the best way always.
+    """
+    model = TaxBoundry
+    key_fields = tuple([name for name in CSV_MAP if name not in DELETE_FIELDS and name != 'endDate'])
+
+    def __init__(self, *args, **kwargs):
+        super(BoundryImporter, self).__init__(*args, **kwargs)
+        self.positions = [CSV_MAP.index(name) for name in self.key_fields]
+        self.end_position = CSV_MAP.index('endDate')
+        self.integers = [f.get_internal_type() == 'IntegerField' for f in self.fields]
+
+    def key(self, values):
+        # the keys of a whole state take much less memory hashed
+        key = u'\x1f'.join([value is not None and force_unicode(value) or u'' for value in values])
+        return md5(key.encode('utf-8')).digest()
+
+    def parse(self, line):
+        #Z,20080701,99991231,,,,,,,,,,,,,,,00073,,00073,,EXTRA
+        fields = ash_split(line, len(CSV_MAP))
+        record_type = fields[0].upper()
+        if record_type not in ('Z', '4'):
+            return None
+        row = []
+        for position, integer in zip(self.positions, self.integers):
+            value = fields[position]
+            # Empty strings are nulls.
+            if value == '' or value is None:
+                value = None
+            elif integer:
+                value = int(value)
+            row.append(value)
+        row[0] = record_type
+        row[1] = parse_date(row[1])
+        row.append(parse_date(fields[self.end_position]))
+        return tuple(row)
+
+class RateImporter(BulkImporter):
+    """Imports a CSV rate file from the SST website."""
+    model = TaxRate
+    key_fields = ('state', 'jurisdictionType', 'jurisdictionFipsCode', 'startDate',
+        'generalRateIntrastate', 'generalRateInterstate', 'foodRateIntrastate', 'foodRateInterstate')
+
+    def key(self, values):
+        # the rates of a row are only set when it is created
+        return tuple(values[:4])
+
+    def parse(self, line):
+        (state, type, code, rate_intra, rate_inter, food_intra, food_inter,
+         start, end) = line.split(',')
+        return (int(state), int(type), code, parse_date(start),
+            Decimal(rate_intra), Decimal(rate_inter), Decimal(food_intra), Decimal(food_inter),
+            parse_date(end))
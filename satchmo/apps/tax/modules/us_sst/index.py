@@ -0,0 +1,252 @@
+"""
+A compact index of the SST boundaries and rates in effect on a date, so that
+a tax quote doesn't have to query the (very large) boundary table.
+
+The ZIP and ZIP+4 ranges are kept in sorted arrays searched by bisection, and
+the rates in a dictionary keyed by (state, FIPS code). The index is built by
+the import commands, or by `sst_build_index` which should run daily from a
+cron-job, and saved to the file named by the `US_SST_INDEX` satchmo setting::
+
+    SATCHMO_SETTINGS = {
+        ...
+        'US_SST_INDEX': '/var/lib/satchmo/sst-index',
+    }
+
+Each process loads the file once, and again when it is replaced. Without the
+setting, or for a date outside of the period the index was built for, the
+lookups fall back to querying the database.
+"""
+from array import array
+from bisect import bisect_right
+from datetime import date as _date, timedelta
+from django.db.models import Min
+from satchmo_store.shop.satchmo_settings import get_satchmo_setting
+from tax.modules.us_sst.models import TaxBoundry, TaxRate
+import cPickle as pickle
+import logging
+import os
+import time
+
+log = logging.getLogger('tax.us_sst.index')
+
+# seconds between two checks that the index file has been replaced
+CHECK_INTERVAL = 60
+
+# the TaxBoundry fields needed to find its rates
+CODE_FIELDS = (
+    'serCode', 'fipsStateCode', 'fipsStateIndicator', 'fipsCountyCode', 'fipsPlaceCode',
+) + tuple(['special_%i_code' % ix for ix in range(1, 21)])
+
+class IntervalIndex(object):
+    """Ranges of integer keys, sorted by their low end, each with a row of
+    integer values.
+
+    `reach` holds the highest end of the ranges up to each position, so that
+    the search can stop as soon as no range before it can contain the key.
+    """
+
+    def __init__(self, ranges, width=1):
+        """`ranges` is a list of (low, high, value, ...) tuples, with `width`
+        values each."""
+        ranges.sort()
+        self.lows = array('l')
+        self.highs = array('l')
+        self.reach = array('l')
+        self.columns = [array('l') for ix in range(width)]
+        reach = None
+        for row in ranges:
+            reach = max(reach, row[1])
+            self.lows.append(row[0])
+            self.highs.append(row[1])
+            self.reach.append(reach)
+            for column, value in zip(self.columns, row[2:]):
+                column.append(value)
+
+    def __len__(self):
+        return len(self.lows)
+
+    def __getstate__(self):
+        # arrays pickle as lists, their raw content is much faster to load
+        return [values.tostring() for values in [self.lows, self.highs, self.reach] + self.columns]
+
+    def __setstate__(self, state):
+        arrays = []
+        for data in state:
+            arrays.append(array('l'))
+            arrays[-1].fromstring(data)
+        self.lows, self.highs, self.reach = arrays[:3]
+        self.columns = arrays[3:]
+
+    def find(self, key, match=None):
+        """Get the position of the last range containing `key`, and for
+        which `match(position)` is true, or None."""
+        ix = bisect_right(self.lows, key) - 1
+        while ix >= 0 and self.reach[ix] >= key:
+            if self.highs[ix] >= key and (match is None or match(ix)):
+                return ix
+            ix -= 1
+        return None
+
+class SSTIndex(object):
+    """The boundaries and rates in effect from `date` through `last_date`."""
+
+    def __init__(self, date=None):
+        if not date:
+            date = _date.today()
+        self.date = date
+        self.last_date = self._last_date(date)
+        self.built = time.time()
+
+        # the distinct sets of codes, shared by the boundaries
+        self.codes = []
+        seen = {}
+        zips = []
+        plus4 = []
+        boundries = TaxBoundry.objects.filter(recordType__in=('Z', '4'),
+            startDate__lte=date, endDate__gte=date)
+        fields = ('id', 'recordType', 'zipCodeLow', 'zipExtensionLow',
+            'zipCodeHigh', 'zipExtensionHigh') + CODE_FIELDS
+        for row in boundries.values_list(*fields).iterator():
+            pk, record_type, zip_low, ext_low, zip_high, ext_high = row[:6]
+            codes = row[6:]
+            ix = seen.get(codes, None)
+            if ix is None:
+                ix = seen[codes] = len(self.codes)
+                self.codes.append(codes)
+            if record_type == 'Z':
+                zips.append((zip_low, zip_high, pk, ix))
+            else:
+                plus4.append((zip_low * 10000 + ext_low, zip_high * 10000 + ext_high, pk, ix))
+
+        # the values of the ranges are the boundary id and its codes
+        self.zips = IntervalIndex(zips, width=2)
+        self.plus4 = IntervalIndex(plus4, width=2)
+
+        self.rates = {}
+        rates = TaxRate.objects.filter(startDate__lte=date, endDate__gte=date)
+        for row in rates.values_list('state', 'jurisdictionFipsCode', 'id', 'jurisdictionType',
+            'generalRateIntrastate', 'generalRateInterstate',
+            'foodRateIntrastate', 'foodRateInterstate').order_by('startDate', 'id').iterator():
+            self.rates[(row[0], row[1])] = row[2:]
+
+        log.debug('Built SST index for %s: %i zip, %i zip+4 ranges, %i rates',
+            date, len(self.zips), len(self.plus4), len(self.rates))
+
+    def _last_date(self, date):
+        """The last day before a boundary or rate starts or ends."""
+        last = None
+        for model in (TaxBoundry, TaxRate):
+            qry = model.objects.filter(startDate__gt=date).aggregate(first=Min('startDate'))
+            if qry['first'] and (last is None or qry['first'] - timedelta(days=1) < last):
+                last = qry['first'] - timedelta(days=1)
+            qry = model.objects.filter(startDate__lte=date, endDate__gte=date).aggregate(first=Min('endDate'))
+            if qry['first'] and (last is None or qry['first'] < last):
+                last = qry['first']
+        return last
+
+    def covers(self, date):
+        return self.date <= date and (self.last_date is None or date <= self.last_date)
+
+    def lookup(self, zip, ext=None):
+        """Same as `TaxBoundry.lookup`, without querying the database."""
+        if ext is not None:
+            key = zip * 10000 + ext
+            index = self.plus4
+            # ZIP+4 ranges are matched on the zip and the extension separately
+            match = lambda ix: (index.lows[ix] % 10000 <= ext <= index.highs[ix] % 10000 and
+                index.lows[ix] // 10000 <= zip <= index.highs[ix] // 10000)
+            ix = index.find(key, match)
+            if ix is not None:
+                return self._boundry('4', index, ix)
+
+        ix = self.zips.find(zip)
+        if ix is not None:
+            return self._boundry('Z', self.zips, ix)
+        return None
+
+    def _boundry(self, record_type, index, ix):
+        pk, codes = [column[ix] for column in index.columns]
+        boundry = TaxBoundry(id=pk, recordType=record_type,
+            **dict(zip(CODE_FIELDS, self.codes[codes])))
+        low, high = index.lows[ix], index.highs[ix]
+        if record_type == '4':
+            boundry.zipCodeLow, boundry.zipExtensionLow = divmod(low, 10000)
+            boundry.zipCodeHigh, boundry.zipExtensionHigh = divmod(high, 10000)
+        else:
+            boundry.zipCodeLow, boundry.zipCodeHigh = low, high
+        return boundry
+
+    def rate(self, state, fips):
+        """Get the `TaxRate` of a jurisdiction, or None."""
+        row = self.rates.get((state, fips), None)
+        if row is None:
+            return None
+        pk, jurisdiction_type, general_intra, general_inter, food_intra, food_inter = row
+        return TaxRate(id=pk, state=state, jurisdictionType=jurisdiction_type,
+            jurisdictionFipsCode=fips,
+            generalRateIntrastate=general_intra, generalRateInterstate=general_inter,
+            foodRateIntrastate=food_intra, foodRateInterstate=food_inter)
+
+# the index loaded by this process
+_loaded = {'index': None, 'mtime': None, 'checked': 0}
+
+def get_index_path():
+    return get_satchmo_setting('US_SST_INDEX', None)
+
+def rebuild_sst_index(date=None):
+    """Build the index of `date`, or of today, and save it for all the
+    processes to use. Returns the index, or None if `US_SST_INDEX` isn't set."""
+    path = get_index_path()
+    if not path:
+        return None
+
+    index = SSTIndex(date)
+    # write it next to its final place, so that readers never see half a file
+    work = '%s.%i' % (path, os.getpid())
+    out = open(work, 'wb')
+    try:
+        pickle.dump(index, out, pickle.HIGHEST_PROTOCOL)
+    finally:
+        out.close()
+    os.rename(work, path)
+
+    _loaded.update({'index': index, 'mtime': os.path.getmtime(path), 'checked': time.time()})
+    return index
+
+def _load(path):
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        _loaded.update({'index': None, 'mtime': None})
+        return
+    if mtime != _loaded['mtime']:
+        index = None
+        try:
+            infile = open(path, 'rb')
+            try:
+                index = pickle.load(infile)
+            finally:
+                infile.close()
+        except Exception, e:
+            log.error('Could not load the SST index from %s: %s', path, e)
+        _loaded.update({'index': index, 'mtime': mtime})
+
+def get_sst_index(date=None):
+    """Get the index to use for `date`, or None if the database has to be
+    queried instead."""
+    path = get_index_path()
+    if not path:
+        return None
+    if not date:
+        date = _date.today()
+
+    now = time.time()
+    if now - _loaded['checked'] > CHECK_INTERVAL:
+        _loaded['checked'] = now
+        _load(path)
+
+    index = _loaded['index']
+    if index is None or not index.covers(date):
+        log.debug('The SST index does not cover %s, querying the database', date)
+        return None
+    return index
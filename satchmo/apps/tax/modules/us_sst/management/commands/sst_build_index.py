@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from datetime import date
+from tax.modules.us_sst.index import get_index_path, rebuild_sst_index
+
+# We don't actually need it, but otherwise livesettings chokes.
+import tax.config
+
+class Command(BaseCommand):
+    '''Rebuild the index of the SST boundaries and rates in effect today.
+
+    Run it daily from a cron-job, so that the index follows the effective
+    dates of the imported rows.'''
+
+    help = "Rebuilds the index used to look up SST boundaries and rates."
+    args = '[YYYYMMDD]'
+
+    def handle(self, *args, **options):
+        if not get_index_path():
+            raise CommandError("The US_SST_INDEX satchmo setting is not set")
+        day = None
+        if args:
+            day = date(int(args[0][0:4]), int(args[0][4:6]), int(args[0][6:8]))
+        index = rebuild_sst_index(day)
+        print "Done: %d zip, %d zip+4 ranges and %d rates in effect from %s through %s" % (
+            len(index.zips), len(index.plus4), len(index.rates), index.date, index.last_date or 'forever')
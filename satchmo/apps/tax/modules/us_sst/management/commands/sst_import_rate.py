@@ -1,8 +1,8 @@
 from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
 import os
-from datetime import date
-from tax.modules.us_sst.models import TaxRate
-from decimal import Decimal
+from tax.modules.us_sst.importer import RateImporter
+from tax.modules.us_sst.index import rebuild_sst_index
 
 class Command(BaseCommand):
     '''Manage command to import one of the CSV files from the SST website.
@@ -15,50 +15,23 @@ class Command(BaseCommand):
     help = "Imports a CSV rate file from the SST website."
     args = 'file'
 
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only report what the import would change.'),
+    )
+
     def handle(self, *args, **options):
-        new = 0
-        updated = 0
-        unchanged = 0
         if not args:
             raise CommandError("No file specified")
         file = args[0]
         if not os.path.isfile(file):
             raise RuntimeError("File: %s is not a normal file or doesn't exist." % file)
-        file = open(file)
-        for line in file:
-            (state, type, code, rate_intra, rate_inter, food_intra, food_inter,
-             start, end) = line.split(',')
-            state = int(state)
-            start = date(int(start[0:4]), int(start[4:6]), int(start[6:9]))
-            end = date(int(end[0:4]), int(end[4:6]), int(end[6:9]))
-            try:
-                tr = TaxRate.objects.get(
-                    state=state,
-                    jurisdictionType=type,
-                    jurisdictionFipsCode=code,
-                    startDate=start,
-                )
-                # Over time, end dates can change. A new row with a new start
-                # date will also appear. This way, loading a new file correctly
-                # updates the map. (I hope.)
-                if tr.endDate != end:
-                    tr.endDate = end
-                    tr.save()
-                    updated += 1
-                else:
-                    unchanged += 1
+        dry_run = options.get('dry_run', False)
 
-            except TaxRate.DoesNotExist:
-                TaxRate(
-                    state=state,
-                    jurisdictionType=type,
-                    jurisdictionFipsCode=code,
-                    startDate=start,
-                    endDate=end,
-                    generalRateIntrastate = Decimal(rate_intra),
-                    generalRateInterstate = Decimal(rate_inter),
-                    foodRateIntrastate = Decimal(food_intra),
-                    foodRateInterstate = Decimal(food_inter),
-                ).save()
-                new += 1
-        print "Done: New: %d. End date changed: %d. Unchanged: %d" % (new, updated, unchanged)
+        stats = RateImporter().run(open(file), dry_run=dry_run)
+        if dry_run:
+            print "Dry run: %s" % stats
+        else:
+            print "Done: %s" % stats
+            if rebuild_sst_index():
+                print "Rebuilt the SST index"
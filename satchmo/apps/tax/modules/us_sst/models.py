@@ -297,15 +297,9 @@ class TaxBoundry(models.Model):
             return u'%05d -> %05d' % (self.zipCodeLow, self.zipCodeHigh)
     zip_range = property(get_zip_range)
 
-    def rates(self, date=None):
-        l = list()
-        state = self.fipsStateCode
-        
-        if not date:
-            date = _date.today()
-            
-        # Lookup all the applicable codes.
-        for fips in (
+    def _codes(self):
+        """All the applicable jurisdiction codes."""
+        return [fips for fips in (
             self.fipsStateIndicator, self.fipsCountyCode, self.fipsPlaceCode,
             self.special_1_code, self.special_2_code, self.special_3_code,
             self.special_4_code, self.special_5_code, self.special_6_code,
@@ -314,18 +308,35 @@ class TaxBoundry(models.Model):
             self.special_13_code, self.special_14_code, self.special_15_code,
             self.special_16_code, self.special_17_code, self.special_18_code,
             self.special_19_code, self.special_20_code
-        ):
-            if not fips:
-                continue
-            
-            rate = TaxRate.objects.get(
+        ) if fips]
+
+    def rates(self, date=None):
+        from tax.modules.us_sst.index import get_sst_index
+
+        state = int(self.fipsStateCode)
+        codes = self._codes()
+
+        if not date:
+            date = _date.today()
+
+        index = get_sst_index(date)
+        if index is not None:
+            found = dict([(fips, index.rate(state, fips)) for fips in codes])
+        else:
+            found = dict([(rate.jurisdictionFipsCode, rate) for rate in TaxRate.objects.filter(
                 state=state,
-                jurisdictionFipsCode=fips,
+                jurisdictionFipsCode__in=codes,
                 startDate__lte=date,
                 endDate__gte=date,
-            )
+            )])
+
+        l = list()
+        for fips in codes:
+            rate = found.get(fips, None)
+            if rate is None:
+                raise TaxRate.DoesNotExist('No tax rate for state %s, jurisdiction %s on %s' % (state, fips, date))
             l.append( rate  )
-        
+
         return l
 
     def get_percentage(self, date=None):
@@ -355,11 +366,20 @@ class TaxBoundry(models.Model):
     def lookup(cls, zip, ext=None, date=None):
         """Handy function to take a zip code and return the appropriate rates
         for it."""
+        from tax.modules.us_sst.index import get_sst_index
+
         if not date:
             date = _date.today()
-        
+
+        index = get_sst_index(date)
+        if index is not None:
+            try:
+                return index.lookup(int(zip), int(ext) if ext is not None else None)
+            except ValueError:
+                return None
+
         # Try for a ZIP+4 lookup first if we can.
-        if ext:
+        if ext is not None:
             try:
                 return cls.objects.get(
                     recordType='4',
@@ -407,3 +427,6 @@ class TaxBoundry(models.Model):
 #order_success.connect(save_taxes_colletecd)
 
 import config
+
+from tax.listeners import listen_for_rate_changes
+listen_for_rate_changes(Taxable, TaxRate, TaxBoundry)
@@ -9,6 +9,7 @@ from livesettings import config_value
 from satchmo_store.contact.models import Contact
 from l10n.models import AdminArea, Country
 from satchmo_utils import is_string_like
+from tax.utils import cached_location, cached_rate, taxclass_key
 from product.models import TaxClass
 from models import TaxBoundry, TaxRate, Taxable
 import logging
@@ -30,6 +31,15 @@ class Processor(object):
         self.user = user
 
     def _get_location(self):
+        if self.order:
+            source = ('order', self.order.ship_country, self.order.ship_state, self.order.ship_postal_code)
+        elif self.user and self.user.is_authenticated():
+            source = ('user', self.user.pk)
+        else:
+            source = ('default',)
+        return cached_location(self, source, self._find_location)
+
+    def _find_location(self):
         area=country=postal_code=None
 
         if self.order:
@@ -147,28 +157,11 @@ class Processor(object):
         state = location['area']
         country = location['country']
 
-        if is_string_like(taxclass):
-            try:
-                taxclass = TaxClass.objects.get(title__iexact=taxclass)
-
-            except TaxClass.DoesNotExist:
-                raise ImproperlyConfigured("Can't find a '%s' Tax Class", taxclass)
-
         # This module only works in the USA.
-        if country.iso2_code != 'US':
-            rate = None
-        else:
-            try:
-                taxable = Taxable.objects.get(taxClass=taxclass, taxZone=state)
-                if taxable.isTaxable is False:
-                    rate = None
-                else:
-                    rate = self.get_boundry(taxable, location)
-                    rate.useIntrastate = taxable.useIntrastate
-                    rate.useFood = taxable.useFood
-
-            except Taxable.DoesNotExist:
-                rate = None
+        if country.iso2_code == 'US':
+            key = (state and state.pk, location['zip_5'], location['zip_4'],
+                taxclass_key(taxclass), datetime.date.today())
+            rate = cached_rate(self, key, lambda: self._find_rate(taxclass, location))
 
         log.debug("Got rate [%s] = %s", taxclass, rate)
         if get_object:
@@ -179,6 +172,28 @@ class Processor(object):
             else:
                 return Decimal("0.00")
 
+    def _find_rate(self, taxclass, location):
+        if is_string_like(taxclass):
+            try:
+                taxclass = TaxClass.objects.get(title__iexact=taxclass)
+
+            except TaxClass.DoesNotExist:
+                raise ImproperlyConfigured("Can't find a '%s' Tax Class", taxclass)
+
+        try:
+            taxable = Taxable.objects.get(taxClass=taxclass, taxZone=location['area'])
+            if taxable.isTaxable is False:
+                rate = None
+            else:
+                rate = self.get_boundry(taxable, location)
+                rate.useIntrastate = taxable.useIntrastate
+                rate.useFood = taxable.useFood
+
+        except Taxable.DoesNotExist:
+            rate = None
+
+        return rate
+
     def by_price(self, taxclass, price):
         rate = self.get_rate(taxclass)
 
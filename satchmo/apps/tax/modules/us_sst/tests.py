@@ -0,0 +1,133 @@
+from datetime import date
+from decimal import Decimal
+from django.test import TestCase
+from satchmo_store.shop.satchmo_settings import get_satchmo_setting, set_satchmo_setting
+from tax.modules.us_sst import index
+from tax.modules.us_sst.importer import BoundryImporter, RateImporter
+from tax.modules.us_sst.models import TaxBoundry, TaxRate
+import os
+import shutil
+import tempfile
+
+def make_rate(fips, jurisdiction_type, rate, start=date(2008, 1, 1), end=date(9999, 12, 31)):
+    rate = Decimal(rate)
+    return TaxRate.objects.create(state=39, jurisdictionType=jurisdiction_type, jurisdictionFipsCode=fips,
+        generalRateIntrastate=rate, generalRateInterstate=rate, foodRateIntrastate=0, foodRateInterstate=0,
+        startDate=start, endDate=end)
+
+class SSTIndexTest(TestCase):
+
+    def setUp(self):
+        self.old_path = get_satchmo_setting('US_SST_INDEX')
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'sst-index')
+        set_satchmo_setting('US_SST_INDEX', self.path)
+        index._loaded.update({'index': None, 'mtime': None, 'checked': 0})
+
+        make_rate('39', 45, '0.055')
+        make_rate('035', 0, '0.0125')
+        make_rate('16000', 1, '0.01', end=date(2030, 6, 30))
+        start = date(2008, 1, 1)
+        end = date(9999, 12, 31)
+        TaxBoundry.objects.create(recordType='Z', startDate=start, endDate=end,
+            zipCodeLow=44101, zipCodeHigh=44199, fipsStateCode='39', fipsStateIndicator='39',
+            fipsCountyCode='035')
+        TaxBoundry.objects.create(recordType='4', startDate=start, endDate=end,
+            zipCodeLow=44113, zipExtensionLow=1000, zipCodeHigh=44113, zipExtensionHigh=1999,
+            fipsStateCode='39', fipsStateIndicator='39', fipsCountyCode='035', fipsPlaceCode='16000')
+        TaxBoundry.objects.create(recordType='4', startDate=start, endDate=end,
+            zipCodeLow=44114, zipExtensionLow=0, zipCodeHigh=44114, zipExtensionHigh=0,
+            fipsStateCode='39', fipsStateIndicator='39', fipsCountyCode='035', fipsPlaceCode='16000')
+
+    def tearDown(self):
+        set_satchmo_setting('US_SST_INDEX', self.old_path)
+        index._loaded.update({'index': None, 'mtime': None, 'checked': 0})
+        shutil.rmtree(self.dir)
+
+    def _check_lookups(self):
+        self.assertEqual(TaxBoundry.lookup('44113', '1234').percentage, Decimal('0.0775'))
+        self.assertEqual(TaxBoundry.lookup('44113', '2000').percentage, Decimal('0.0675'))
+        self.assertEqual(TaxBoundry.lookup('44150').percentage, Decimal('0.0675'))
+        self.assertEqual(TaxBoundry.lookup('44200'), None)
+        # the "0000" extension is a ZIP+4 lookup too
+        self.assertEqual(TaxBoundry.lookup('44114', '0000').percentage, Decimal('0.0775'))
+        self.assertEqual(TaxBoundry.lookup(44114, 0).percentage, Decimal('0.0775'))
+        self.assertEqual(TaxBoundry.lookup('44114', '0001').percentage, Decimal('0.0675'))
+        rates = TaxBoundry.lookup('44113', '1500').rates()
+        self.assertEqual([rate.jurisdictionFipsCode for rate in rates], ['39', '035', '16000'])
+
+    def test_lookup(self):
+        # from the database
+        self.assertEqual(index.get_sst_index(), None)
+        self._check_lookups()
+
+        built = index.rebuild_sst_index()
+        self.assertEqual(built.last_date, date(2030, 6, 30))
+        self.assertEqual(len(built.codes), 2)
+        self.assert_(index.get_sst_index() is built)
+
+        # from the index, loaded again from the file
+        index._loaded.update({'index': None, 'mtime': None, 'checked': 0})
+        TaxBoundry.objects.all().delete()
+        TaxRate.objects.all().delete()
+        self._check_lookups()
+
+        # which doesn't cover the dates past a change
+        self.assertEqual(index.get_sst_index(date(2030, 7, 1)), None)
+
+    def test_intervals(self):
+        ranges = index.IntervalIndex([(10, 100, 1), (20, 30, 2), (40, 50, 3), (60, 60, 4)])
+        self.assertEqual(ranges.columns[0][ranges.find(25)], 2)
+        self.assertEqual(ranges.columns[0][ranges.find(35)], 1)
+        self.assertEqual(ranges.columns[0][ranges.find(60)], 4)
+        self.assertEqual(ranges.find(5), None)
+        self.assertEqual(ranges.find(101), None)
+
+class ImporterTest(TestCase):
+
+    def test_import_boundries(self):
+        lines = [
+            'Z,20080101,99991231,,,,,,,,,,,,,,,44101,,44199,,,39,39,035,,',
+            '4,20080101,99991231,,,,,,,,,,,,,,,44113,1000,44113,1999,,39,39,035,16000,',
+            'A,20080101,99991231,1,99,B,,MAIN,ST,,,,,,CLEVELAND,44113,1000',
+        ]
+        stats = BoundryImporter().run(lines, dry_run=True)
+        self.assertEqual((stats.new, stats.updated, stats.skipped), (2, 0, 1))
+        self.assertEqual(TaxBoundry.objects.count(), 0)
+
+        BoundryImporter(batch_size=1).run(lines)
+        self.assertEqual(TaxBoundry.objects.count(), 2)
+        plus4 = TaxBoundry.objects.get(recordType='4')
+        self.assertEqual((plus4.zipExtensionLow, plus4.fipsCountyCode, plus4.endDate), (1000, '035', date(9999, 12, 31)))
+
+        # end dates change, the other rows are left alone
+        lines[1] = lines[1].replace('99991231', '20301231')
+        stats = BoundryImporter().run(lines)
+        self.assertEqual((stats.new, stats.updated, stats.unchanged), (0, 1, 1))
+        self.assertEqual(TaxBoundry.objects.get(recordType='4').endDate, date(2030, 12, 31))
+        self.assertEqual(TaxBoundry.objects.count(), 2)
+
+    def test_repeated_after_flush(self):
+        lines = [
+            '39,45,39,0.055,0.055,0,0,20080101,99991231',
+            '39,00,035,0.0125,0.0125,0,0,20080101,99991231',
+            '39,45,39,0.055,0.055,0,0,20080101,20301231',
+            '39,00,035,0.0125,0.0125,0,0,20080101,20291231',
+        ]
+        # the first two rows are inserted before their end dates change
+        stats = RateImporter(batch_size=2).run(lines)
+        self.assertEqual((stats.new, stats.updated), (2, 2))
+        self.assertEqual(TaxRate.objects.count(), 2)
+        self.assertEqual(TaxRate.objects.get(jurisdictionFipsCode='39').endDate, date(2030, 12, 31))
+        self.assertEqual(TaxRate.objects.get(jurisdictionFipsCode='035').endDate, date(2029, 12, 31))
+
+    def test_import_rates(self):
+        lines = ['39,45,39,0.055,0.055,0,0,20080101,99991231\n', '39,00,035,0.0125,0.0125,0,0,20080101,99991231\n']
+        stats = RateImporter().run(lines)
+        self.assertEqual(stats.new, 2)
+        self.assertEqual(TaxRate.objects.get(jurisdictionFipsCode='035').generalRateIntrastate, Decimal('0.0125'))
+
+        lines[1] = '39,00,035,0.0125,0.0125,0,0,20080101,20301231\n'
+        stats = RateImporter().run(lines)
+        self.assertEqual((stats.new, stats.updated, stats.unchanged), (0, 1, 1))
+        self.assertEqual(TaxRate.objects.get(jurisdictionFipsCode='035').endDate, date(2030, 12, 31))
@@ -3,6 +3,8 @@ from django.test import TestCase
 from keyedcache import cache_delete
 from livesettings import config_get
 from satchmo_store.shop.tests import make_test_order, make_order_payment
+from tax.modules.area.models import TaxRate
+from tax.utils import get_tax_processor, invalidate_tax_rates
 import logging
 log = logging.getLogger('tax.test')
 
@@ -43,7 +45,7 @@ class TaxTest(TestCase):
         # 100 + 10 shipping + 20 tax
         self.assertEqual(price, Decimal('135.00'))
 
-        taxes = order.taxes.all()
+        taxes = order.recalculated_taxes
         self.assertEqual(2, len(taxes))
         t1 = taxes[0]
         t2 = taxes[1]
@@ -69,7 +71,7 @@ class TaxTest(TestCase):
         # 100 + 10 shipping + 16 tax
         self.assertEqual(price, Decimal('126.00'))
 
-        taxes = order.taxes.all()
+        taxes = order.recalculated_taxes
         self.assertEqual(2, len(taxes))
         t1 = taxes[0]
         t2 = taxes[1]
@@ -84,6 +86,35 @@ class TaxTest(TestCase):
         self.assertEqual(tmain.tax, Decimal('16.00'))
         self.assertEqual(tship.tax, Decimal('0.00'))
 
+    def testCachedRates(self):
+        """Test that rates are resolved once, until they change"""
+        cache_delete()
+        tax = config_get('TAX','MODULE')
+        tax.update('tax.modules.area')
+
+        order = make_test_order('DE', '')
+        processor = get_tax_processor(order)
+        self.assertEqual(processor.get_rate('Default'), Decimal('0.20'))
+        self.assertEqual(processor.by_price('Default', Decimal('10.00')), Decimal('2.00'))
+
+        # the rate is resolved once, until the rates are invalidated
+        TaxRate.objects.filter(taxCountry__iso2_code='DE', taxClass__title='Default').update(
+            percentage=Decimal('0.15'))
+        self.assertEqual(get_tax_processor(order).get_rate('Default'), Decimal('0.20'))
+        invalidate_tax_rates()
+        self.assertEqual(processor.get_rate('Default'), Decimal('0.15'))
+
+        # the callers get their own copy of the rate
+        rate = processor.get_rate('Default', get_object=True)
+        rate.percentage = Decimal('0.50')
+        self.assertEqual(processor.get_rate('Default'), Decimal('0.15'))
+
+        rate = TaxRate.objects.get(taxCountry__iso2_code='DE', taxClass__title='Default')
+        rate.percentage = Decimal('0.10')
+        rate.save()
+        self.assertEqual(processor.get_rate('Default'), Decimal('0.10'))
+        self.assertEqual(get_tax_processor(order).get_rate('Default'), Decimal('0.10'))
+
     def testDuplicateAdminAreas(self):
         """Test the situation where we have multiple adminareas with the same name"""
         cache_delete()
@@ -102,7 +133,7 @@ class TaxTest(TestCase):
         # 100 + 10 shipping + 20 tax
         self.assertEqual(price, Decimal('130.00'))
 
-        taxes = order.taxes.all()
+        taxes = order.recalculated_taxes
         self.assertEqual(2, len(taxes))
         t1 = taxes[0]
         t2 = taxes[1]
@@ -131,7 +162,7 @@ class TaxTest(TestCase):
         # 100 + 10 shipping + 10 tax
         self.assertEqual(price, Decimal('120.00'))
 
-        taxes = order.taxes.all()
+        taxes = order.recalculated_taxes
         self.assertEqual(1, len(taxes))
         self.assertEqual(taxes[0].tax, Decimal('10.00'))
         self.assertEqual(taxes[0].description, r'10%')
@@ -152,7 +183,7 @@ class TaxTest(TestCase):
         # 100 + 10 shipping + 11 tax
         self.assertEqual(price, Decimal('121.00'))
 
-        taxes = order.taxes.all()
+        taxes = order.recalculated_taxes
         self.assertEqual(2, len(taxes))
         t1 = taxes[0]
         t2 = taxes[1]
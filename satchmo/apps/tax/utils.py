@@ -1,9 +1,16 @@
 from livesettings import config_value
 from satchmo_utils import load_module
+import copy
 import decimal
+import keyedcache
+import threading
+import time
 
 TWOPLACES = decimal.Decimal('0.01')
 
+# cached in place of None, which the cache can't tell from a miss
+NO_RATE = 'no-rate'
+
 def get_tax_processor(order=None, user=None):
     modulename = config_value('TAX', 'MODULE')
     mod = load_module(u'%s.processor' % modulename)
@@ -11,3 +18,95 @@ def get_tax_processor(order=None, user=None):
 
 def round_cents(x):
     return x.quantize(TWOPLACES, decimal.ROUND_FLOOR)
+
+# bumped when the rates change in this process
+_generation = [0]
+
+# the rates resolved by this process, by processor, location and tax class,
+# for one version of the rates, shared by its threads
+_local_rates = {'version' : None, 'rates' : {}}
+_local_rates_lock = threading.Lock()
+# how many rates are kept in memory before starting again
+MAX_LOCAL_RATES = 5000
+
+def cached_location(processor, source, resolve):
+    """Get the location of a tax processor, calling `resolve()` the first time
+    it is needed. `source` identifies what the location is computed from,
+    such as the address of an order."""
+    key = tuple(source)
+    locations = processor.__dict__.setdefault('_tax_locations', {})
+    if key not in locations:
+        locations[key] = resolve()
+    return locations[key]
+
+def _rates_version():
+    try:
+        return keyedcache.cache_get('tax', 'rate', 'version')
+    except keyedcache.NotCachedError:
+        version = 0
+        if keyedcache.cache_enabled():
+            # start from the clock, so that an evicted version is never reused
+            version = int(time.time() * 1000)
+            keyedcache.cache_set('tax', 'rate', 'version', value=version)
+        return version
+
+def invalidate_tax_rates():
+    """Forget the rates resolved so far."""
+    _generation[0] += 1
+    keyedcache.cache_set('tax', 'rate', 'version',
+        value=max(_rates_version() + 1, int(time.time() * 1000)))
+
+def cached_rate(processor, key, resolve):
+    """Get a rate resolved by a tax processor.
+
+    `key` identifies the location, tax class and date the rate is for. The rate
+    is looked for in the memory of the process, then in the cache shared by
+    all the processes, and only if it isn't found `resolve()` is called to
+    get it.
+
+    Each call returns its own copy of the rate, which the caller may change.
+    """
+    key = (processor.method,) + tuple(key)
+    version = _rates_version()
+    local_version = (_generation[0], version)
+    _local_rates_lock.acquire()
+    try:
+        if (_local_rates['version'] != local_version
+                or len(_local_rates['rates']) >= MAX_LOCAL_RATES):
+            _local_rates['version'] = local_version
+            _local_rates['rates'] = {}
+        local = _local_rates['rates']
+        found = key in local
+        if found:
+            rate = local[key]
+    finally:
+        _local_rates_lock.release()
+    if found:
+        return copy.copy(rate)
+
+    try:
+        rate = keyedcache.cache_get('tax', 'rate', version, *key)
+        if isinstance(rate, basestring) and rate == NO_RATE:
+            rate = None
+    except keyedcache.NotCachedError, nce:
+        rate = resolve()
+        if rate is None:
+            keyedcache.cache_set(nce.key, value=NO_RATE)
+        else:
+            keyedcache.cache_set(nce.key, value=rate)
+
+    _local_rates_lock.acquire()
+    try:
+        # unless the rates changed meanwhile
+        if _local_rates['version'] == local_version:
+            _local_rates['rates'][key] = rate
+    finally:
+        _local_rates_lock.release()
+    return copy.copy(rate)
+
+def taxclass_key(taxclass):
+    """The part of a rate key identifying a tax class, given by its title or
+    as a `TaxClass`."""
+    if isinstance(taxclass, basestring):
+        return u'title-%s' % taxclass.lower()
+    return taxclass.pk
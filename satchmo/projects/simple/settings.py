@@ -109,6 +109,7 @@ INSTALLED_APPS = (
     #'product.modules.downloadable',
     #'product.modules.subscription',
     #'satchmo_ext.product_feeds',
+    #'satchmo_ext.product_search',
     #'satchmo_ext.brand',
     'payment',
     'payment.modules.dummy',